@@ -5,8 +5,13 @@ This script allows running different utilities for the project.
 """
 
 import argparse
+import asyncio
+import hashlib
+import json
+import math
 import sys
 import os
+import time
 
 def setup_word_addin():
     """Set up the Word Add-in integration"""
@@ -35,6 +40,356 @@ def run_server(port=2024):
         print(f"Error running server: {e}")
         sys.exit(1)
 
+def read_topics(path):
+    """Read one topic per line from a file, or from stdin when path is "-" """
+    if path == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    topics = [line.strip() for line in lines]
+    # Skip blanks, comments and duplicates, keeping the original order
+    return list(dict.fromkeys(topic for topic in topics if topic and not topic.startswith("#")))
+
+def read_completed_topics(path):
+    """Topics that already have a successful result in the JSONL output file"""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short by an interrupted run; the topic is retried
+                continue
+            if not record.get("error"):
+                completed.add(record.get("topic"))
+    return completed
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+async def research_topic(graph, topic, configurable):
+    """Run the research graph for one topic and return its JSONL record"""
+    from assistant.checkpoint import aresume_input
+
+    config = {"recursion_limit": 100, "configurable": dict(configurable)}
+    if graph.checkpointer is not None:
+        # A stable thread id per topic lets a rerun resume a topic that was
+        # interrupted mid-research instead of starting it over; a topic whose
+        # run finished is researched afresh
+        config["configurable"]["thread_id"] = "batch-" + hashlib.sha1(topic.encode("utf-8")).hexdigest()[:16]
+
+    started = time.time()
+    try:
+        input = await aresume_input(graph, config, {"research_topic": topic})
+        result = await graph.ainvoke(input, config)
+    except Exception as e:
+        return {"topic": topic, "error": str(e), "seconds": round(time.time() - started, 2)}
+
+    prompt_cache_report = result.get("prompt_cache_report") or {}
+    return {
+        "topic": topic,
+        "running_summary": result.get("running_summary"),
+        "stop_reason": result.get("stop_reason"),
+        "seconds": round(time.time() - started, 2),
+        "llm_calls": sum(node["calls"] for node in prompt_cache_report.values()),
+        "search_calls": result.get("search_calls", 0),
+    }
+
+async def research_batch(topics, output, concurrency, configurable):
+    """Research topics with at most `concurrency` runs at a time, appending results as they complete"""
+    from assistant.graph import graph
+
+    semaphore = asyncio.Semaphore(concurrency)
+    records = []
+    started = time.time()
+
+    with open(output, "a", encoding="utf-8") as out:
+        async def run(topic):
+            async with semaphore:
+                record = await research_topic(graph, topic, configurable)
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+            records.append(record)
+            status = f"failed: {record['error']}" if record.get("error") else f"{record['seconds']}s"
+            print(f"[{len(records)}/{len(topics)}] {topic} ({status})")
+
+        await asyncio.gather(*(run(topic) for topic in topics))
+
+    return records, time.time() - started
+
+def print_throughput_summary(records, elapsed):
+    """Print topics per hour, per-topic latency percentiles and call counts for a batch"""
+    succeeded = [record for record in records if not record.get("error")]
+    print(f"Researched {len(succeeded)} topics ({len(records) - len(succeeded)} failed) in {elapsed:.1f}s")
+    if not succeeded:
+        return
+    latencies = [record["seconds"] for record in succeeded]
+    print(f"Throughput: {len(succeeded) / elapsed * 3600:.1f} topics/hour")
+    print(f"Latency per topic: p50 {percentile(latencies, 0.5):.1f}s, p95 {percentile(latencies, 0.95):.1f}s")
+    print(f"LLM calls: {sum(record['llm_calls'] for record in succeeded)}, "
+          f"search calls: {sum(record['search_calls'] for record in succeeded)}")
+
+def run_research(input_path, output, concurrency=4, max_loops=None, model=None):
+    """Research every topic in input_path that does not already have a result in output"""
+    try:
+        topics = read_topics(input_path)
+    except OSError as e:
+        print(f"Error reading topics: {e}")
+        sys.exit(1)
+
+    completed = read_completed_topics(output)
+    pending = [topic for topic in topics if topic not in completed]
+    if len(pending) < len(topics):
+        print(f"Skipping {len(topics) - len(pending)} topics already in {output}")
+    if not pending:
+        return
+
+    configurable = {}
+    if max_loops is not None:
+        configurable["max_web_research_loops"] = max_loops
+    if model:
+        configurable["local_llm"] = model
+
+    records, elapsed = asyncio.run(research_batch(pending, output, max(concurrency, 1), configurable))
+    print_throughput_summary(records, elapsed)
+
+def read_html_corpus(path):
+    """Read saved pages from a directory of .html files, or from a page cache database"""
+    if os.path.isdir(path):
+        pages = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith((".html", ".htm")):
+                    with open(os.path.join(root, name), "rb") as f:
+                        pages.append((f.read(), ""))
+        return pages
+
+    import sqlite3
+    import zlib
+    conn = sqlite3.connect(path)
+    try:
+        return [(zlib.decompress(body), content_type or "") for body, content_type in conn.execute("SELECT body, content_type FROM pages")]
+    finally:
+        conn.close()
+
+def run_extract_benchmark(corpus, backends=None, repeat=3):
+    """Compare page text extraction backends with BeautifulSoup's html.parser on saved pages"""
+    from bs4 import BeautifulSoup
+    from assistant.extract import available_backends, decode_html, extract_text
+    from assistant.llm import CHARS_PER_TOKEN
+
+    try:
+        pages = read_html_corpus(corpus)
+    except Exception as e:
+        print(f"Error reading corpus: {e}")
+        sys.exit(1)
+    if not pages:
+        print(f"No pages found in {corpus}")
+        sys.exit(1)
+
+    def baseline(html, content_type):
+        return BeautifulSoup(decode_html(html, content_type), "html.parser").get_text()
+
+    extractors = [("bs4 html.parser (previous)", baseline)]
+    for backend in backends or available_backends():
+        extractors.append((backend, lambda html, content_type, backend=backend: extract_text(html, content_type, backend=backend)))
+
+    print(f"{len(pages)} pages, {sum(len(html) for html, _ in pages) / 1024 / 1024:.1f} MB of HTML, best of {repeat} runs")
+    print(f"{'extractor':<28} {'pages/s':>9} {'speedup':>8} {'tokens':>10} {'reduction':>10}")
+    base_rate = base_tokens = None
+    for name, extract in extractors:
+        best = None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            texts = [extract(html, content_type) for html, content_type in pages]
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        rate = len(pages) / best
+        tokens = sum(len(text) for text in texts) / CHARS_PER_TOKEN
+        if base_rate is None:
+            base_rate, base_tokens = rate, tokens
+        reduction = 1 - tokens / base_tokens if base_tokens else 0.0
+        print(f"{name:<28} {rate:>9.1f} {rate / base_rate:>7.1f}x {tokens:>10.0f} {reduction:>9.1%}")
+
+def run_sources_benchmark(corpus, sources=300, loops=3, repeat=3):
+    """Compare source formatting before and after cross-loop near-duplicate removal on saved pages"""
+    import random
+    from assistant.extract import extract_text
+    from assistant.tokens import get_tokenizer
+    from assistant.utils import deduplicate_and_format_sources, novel_sources
+
+    try:
+        pages = read_html_corpus(corpus)
+    except Exception as e:
+        print(f"Error reading corpus: {e}")
+        sys.exit(1)
+    texts = [text for text in (extract_text(html, content_type) for html, content_type in pages) if len(text.split()) >= 50]
+    if not texts:
+        print(f"No pages with text found in {corpus}")
+        sys.exit(1)
+
+    # Spread the sources over the loops; after the first loop, some results
+    # repeat an earlier source at the same URL or as a lightly edited mirror
+    rng = random.Random(0)
+    per_loop = max(sources // max(loops, 1), 1)
+    made, results_by_loop = [], []
+    for loop in range(max(loops, 1)):
+        results = []
+        for i in range(per_loop):
+            if made and rng.random() < 0.4:
+                original = rng.choice(made)
+                if rng.random() < 0.5:
+                    results.append(dict(original))
+                    continue
+                sentences = original["raw_content"].split(". ")
+                del sentences[rng.randrange(len(sentences))]
+                mirror_text = "Syndicated from the original publisher. " + ". ".join(sentences)
+                results.append({**original, "url": original["url"].replace("https://", "https://amp.mirror.example/"), "raw_content": mirror_text})
+                continue
+            text = texts[len(made) % len(texts)]
+            source = {"title": text.split("\n", 1)[0][:80], "url": f"https://site{len(made)}.example/page", "content": text[:300], "raw_content": text}
+            made.append(source)
+            results.append(source)
+        results_by_loop.append(results)
+
+    def previous(results):
+        # The formatter before single-pass joining and cross-loop deduplication
+        unique_sources = {}
+        for source in results:
+            unique_sources.setdefault(source["url"], source)
+        formatted_text = "Sources:\n\n"
+        for source in unique_sources.values():
+            formatted_text += f"Source {source['title']}:\n===\n"
+            formatted_text += f"URL: {source['url']}\n===\n"
+            formatted_text += f"Most relevant content from source: {source['content']}\n===\n"
+            raw_content = source["raw_content"]
+            if len(raw_content) > 4000:
+                raw_content = raw_content[:4000] + "... [truncated]"
+            formatted_text += f"Full source content limited to 1000 tokens: {raw_content}\n\n"
+        return formatted_text.strip()
+
+    tokenizer = get_tokenizer(os.environ.get("OLLAMA_MODEL", "llama3.2"))
+
+    def single_pass(results_by_loop):
+        return [deduplicate_and_format_sources({"results": results}, 1000, True, tokenizer=tokenizer) for results in results_by_loop]
+
+    def cross_loop(results_by_loop):
+        registry, formatted = [], []
+        for results in results_by_loop:
+            novel, entries = novel_sources(results, registry)
+            registry.extend(entries)
+            formatted.append(deduplicate_and_format_sources({"results": novel}, 1000, True, tokenizer=tokenizer))
+        return formatted
+
+    formatters = [
+        ("previous (per loop)", lambda: [previous(results) for results in results_by_loop]),
+        ("single pass (per loop)", lambda: single_pass(results_by_loop)),
+        ("single pass + cross-loop", lambda: cross_loop(results_by_loop)),
+    ]
+    total = sum(len(results) for results in results_by_loop)
+    print(f"{total} sources over {len(results_by_loop)} loops from {len(texts)} pages, tokens counted with {tokenizer.name}, best of {repeat} runs")
+    print(f"{'formatter':<26} {'ms':>9} {'sources/s':>10} {'tokens':>10} {'saved':>7}")
+    base_tokens = None
+    for name, run in formatters:
+        best = None
+        for _ in range(max(repeat, 1)):
+            started = time.perf_counter()
+            formatted = run()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        tokens = sum(tokenizer.count(text) for text in formatted)
+        if base_tokens is None:
+            base_tokens = tokens
+        print(f"{name:<26} {best * 1000:>9.1f} {total / best:>10.0f} {tokens:>10} {1 - tokens / base_tokens:>6.1%}")
+
+def run_index_local(directory, workers=None):
+    """Build or update the local search index for a directory"""
+    from assistant.local_index import LOCAL_INDEX_WORKERS, LocalIndex
+
+    if not os.path.isdir(directory):
+        print(f"Error: {directory} is not a directory")
+        sys.exit(1)
+    index = LocalIndex(directory)
+    stats = index.refresh(workers=workers or LOCAL_INDEX_WORKERS)
+    print(f"Indexed {directory} into {index.path}")
+    print(", ".join(f"{key} {value}" for key, value in stats.items()))
+
+def write_synthetic_corpus(directory, files, words_per_file, seed=0):
+    """Write HTML, Markdown and text files of Zipf-distributed words, returning the vocabulary"""
+    import random
+
+    rng = random.Random(seed)
+    vocabulary = [f"{rng.choice('bcdfghklmnprstvz')}{rng.choice('aeiou')}{rng.choice('bcdfghklmnprstvz')}{rng.choice('aeiou')}{i}" for i in range(20000)]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    for i in range(files):
+        words = rng.choices(vocabulary, weights=weights, k=rng.randint(words_per_file // 2, words_per_file * 3 // 2))
+        title = " ".join(words[:6])
+        paragraphs = [" ".join(words[start:start + 80]) + "." for start in range(6, len(words), 80)]
+        subdirectory = os.path.join(directory, f"part{i % 50:02d}")
+        os.makedirs(subdirectory, exist_ok=True)
+        kind = i % 3
+        if kind == 0:
+            body = "".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+            content, name = f"<html><head><title>{title}</title></head><body><nav>Home Docs</nav><h1>{title}</h1>{body}</body></html>", f"doc{i}.html"
+        elif kind == 1:
+            content, name = f"# {title}\n\n" + "\n\n".join(paragraphs), f"doc{i}.md"
+        else:
+            content, name = f"{title}\n\n" + "\n\n".join(paragraphs), f"doc{i}.txt"
+        with open(os.path.join(subdirectory, name), "w") as f:
+            f.write(content)
+    return vocabulary
+
+def run_local_benchmark(files=10000, words_per_file=400, workers=None, queries=200):
+    """Benchmark local index build rate, incremental refresh and query latency on a synthetic corpus"""
+    import random
+    import shutil
+    import statistics
+    import tempfile
+    from assistant.local_index import LOCAL_INDEX_WORKERS, LocalIndex
+
+    workers = workers or LOCAL_INDEX_WORKERS
+    directory = tempfile.mkdtemp(prefix="local-corpus-")
+    try:
+        started = time.perf_counter()
+        vocabulary = write_synthetic_corpus(os.path.join(directory, "corpus"), files, words_per_file)
+        size_mb = sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(os.path.join(directory, "corpus")) for name in names) / 1024 / 1024
+        print(f"{files} files, {size_mb:.1f} MB written in {time.perf_counter() - started:.1f}s")
+
+        print(f"{'build':<24} {'seconds':>8} {'files/s':>9} {'MB/s':>7}")
+        for count in sorted({1, workers}):
+            index = LocalIndex(os.path.join(directory, "corpus"), os.path.join(directory, f"index-{count}.sqlite"))
+            stats = index.refresh(workers=count)
+            print(f"{f'full, {count} worker(s)':<24} {stats['seconds']:>8.2f} {files / stats['seconds']:>9.0f} {size_mb / stats['seconds']:>7.1f}")
+
+        stats = index.refresh(workers=workers)
+        print(f"{'refresh, no changes':<24} {stats['seconds']:>8.2f}")
+        rng = random.Random(1)
+        paths = sorted(index.scan())
+        for path in rng.sample(paths, max(len(paths) // 100, 1)):
+            with open(path, "a") as f:
+                f.write("\n\nAppended paragraph for the incremental refresh.\n")
+        for path in rng.sample(paths, max(len(paths) // 100, 1)):
+            os.utime(path)
+        stats = index.refresh(workers=workers)
+        print(f"{'refresh, 1% edited':<24} {stats['seconds']:>8.2f}   (updated {stats['updated']}, touched {stats['touched']})")
+
+        # Queries mix common and rare words, like natural-language research queries
+        latencies = []
+        for _ in range(queries):
+            query = " ".join(rng.choice(vocabulary[:200]) for _ in range(2)) + " " + " ".join(rng.choice(vocabulary[200:5000]) for _ in range(3))
+            started = time.perf_counter()
+            index.search(query, max_results=3)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+        print(f"{queries} queries: p50 {statistics.median(latencies):.1f} ms, p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms, max {latencies[-1]:.1f} ms")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
 def main():
     parser = argparse.ArgumentParser(description="Ollama Deep Researcher management script")
     subparsers = parser.add_subparsers(dest="command", help="Command to run")
@@ -46,6 +401,37 @@ def main():
     server_parser = subparsers.add_parser("server", help="Run the LangGraph server")
     server_parser.add_argument("--port", type=int, default=2024, help="Port to run server on (default: 2024)")
     
+    # Batch research command
+    research_parser = subparsers.add_parser("research", help="Research topics from a file or stdin and write JSONL results")
+    research_parser.add_argument("--input", default="-", help="File with one topic per line, or - for stdin (default: -)")
+    research_parser.add_argument("--output", default="research.jsonl", help="JSONL file results are appended to; topics already in it are skipped (default: research.jsonl)")
+    research_parser.add_argument("--concurrency", type=int, default=4, help="Topics researched at the same time (default: 4)")
+    research_parser.add_argument("--max-loops", type=int, default=None, help="Research loops per topic (default: MAX_WEB_RESEARCH_LOOPS)")
+    research_parser.add_argument("--model", default=None, help="Ollama model (default: OLLAMA_MODEL)")
+    
+    # Extraction benchmark command
+    extract_parser = subparsers.add_parser("benchmark-extract", help="Benchmark page text extraction on saved HTML pages")
+    extract_parser.add_argument("corpus", help="Directory of saved .html files, or a page cache database (PAGE_CACHE_DB)")
+    extract_parser.add_argument("--backend", action="append", default=None, help="Extraction backend to include, repeatable (default: all installed)")
+    extract_parser.add_argument("--repeat", type=int, default=3, help="Runs per extractor; the fastest is reported (default: 3)")
+    
+    # Source formatting benchmark command
+    sources_parser = subparsers.add_parser("benchmark-sources", help="Benchmark source formatting and cross-loop deduplication on saved HTML pages")
+    sources_parser.add_argument("corpus", help="Directory of saved .html files, or a page cache database (PAGE_CACHE_DB)")
+    sources_parser.add_argument("--sources", type=int, default=300, help="Search results across all loops (default: 300)")
+    sources_parser.add_argument("--loops", type=int, default=3, help="Research loops the results are spread over (default: 3)")
+    sources_parser.add_argument("--repeat", type=int, default=3, help="Runs per formatter; the fastest is reported (default: 3)")
+    
+    # Local search index commands
+    index_parser = subparsers.add_parser("index-local", help="Build or update the local search index for a directory")
+    index_parser.add_argument("directory", nargs="?", default=os.environ.get("LOCAL_SEARCH_DIR", ""), help="Directory to index (default: LOCAL_SEARCH_DIR)")
+    index_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: LOCAL_INDEX_WORKERS)")
+    local_parser = subparsers.add_parser("benchmark-local", help="Benchmark the local search index on a synthetic corpus")
+    local_parser.add_argument("--files", type=int, default=10000, help="Files in the synthetic corpus (default: 10000)")
+    local_parser.add_argument("--words", type=int, default=400, help="Average words per file (default: 400)")
+    local_parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: LOCAL_INDEX_WORKERS)")
+    local_parser.add_argument("--queries", type=int, default=200, help="Queries timed (default: 200)")
+    
     # Parse arguments
     args = parser.parse_args()
     
@@ -54,6 +440,16 @@ def main():
         setup_word_addin()
     elif args.command == "server":
         run_server(port=args.port)
+    elif args.command == "research":
+        run_research(args.input, args.output, concurrency=args.concurrency, max_loops=args.max_loops, model=args.model)
+    elif args.command == "benchmark-extract":
+        run_extract_benchmark(args.corpus, backends=args.backend, repeat=args.repeat)
+    elif args.command == "benchmark-sources":
+        run_sources_benchmark(args.corpus, sources=args.sources, loops=args.loops, repeat=args.repeat)
+    elif args.command == "index-local":
+        run_index_local(args.directory, workers=args.workers)
+    elif args.command == "benchmark-local":
+        run_local_benchmark(files=args.files, words_per_file=args.words, workers=args.workers, queries=args.queries)
     else:
         parser.print_help()
 
@@ -8,15 +8,12 @@ from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 import os
 
 # Import the graph to expose
-from ollama_deep_researcher.graph import get_graph
+from assistant.graph import graph
 # Import the document router
 from ollama_deep_researcher.document_api import router as document_router
 # Add these imports
 from ollama_deep_researcher.word_api import router as word_router
 
-# Create graph instance
-graph = get_graph()
-
 # Configure FastAPI application
 app = create_app(
     graph, 
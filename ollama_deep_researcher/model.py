@@ -0,0 +1,17 @@
+"""Shared Ollama model access for the Word API."""
+import os
+from typing import Optional
+
+from langchain_core.runnables import Runnable
+
+from assistant.backends import parse_base_urls
+from assistant.llm import get_balanced_chat_model
+from assistant.scheduler import INTERACTIVE
+
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_BASE_URLS = parse_base_urls(os.environ.get("OLLAMA_BASE_URLS", "")) or [OLLAMA_BASE_URL]
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "llama3.2")
+
+def get_llm(model: Optional[str] = None, format: Optional[str] = None, temperature: Optional[float] = None) -> Runnable:
+    """Get a pooled ChatOllama client on the least loaded backend, admitted ahead of research calls."""
+    return get_balanced_chat_model(OLLAMA_BASE_URLS, model or OLLAMA_MODEL, format=format, temperature=temperature, lane=INTERACTIVE)
@@ -1,16 +1,14 @@
 from fastapi import APIRouter, BackgroundTasks, HTTPException, Body, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field, validator
 import uuid
 import asyncio
 from typing import Dict, Any, Optional, List
 import json
 import logging
+import time
 from langchain_core.messages import HumanMessage, SystemMessage
 
-# Import graph components
-from ollama_deep_researcher.graph import get_graph
-
 # Import custom error handlers
 from ollama_deep_researcher.word_error_handlers import (
     WordAPIError, with_error_handling, validate_model_response,
@@ -27,6 +25,7 @@ class ResearchRequest(BaseModel):
     topic: str
     model: str = "llama3.2"
     max_loops: int = 3
+    thread_id: Optional[str] = None
 
 class ImproveRequest(BaseModel):
     text: str
@@ -72,11 +71,8 @@ async def start_research(request: ResearchRequest):
         # Generate unique thread ID
         thread_id = str(uuid.uuid4())
         
-        # Initialize graph with request parameters
-        graph = get_graph(
-            ollama_model=request.model,
-            max_loops=request.max_loops
-        )
+        # The graph is compiled once; the model and loop count are passed per run
+        from assistant.graph import graph
         
         # Start research process in background
         active_threads[thread_id] = {
@@ -89,7 +85,7 @@ async def start_research(request: ResearchRequest):
         
         # Start in background
         asyncio.create_task(
-            run_research(thread_id, request.topic, graph)
+            run_research(thread_id, request, graph)
         )
         
         return {"thread_id": thread_id, "status": "started"}
@@ -97,13 +93,19 @@ async def start_research(request: ResearchRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to start research: {str(e)}")
 
-async def run_research(thread_id: str, topic: str, graph):
+async def run_research(thread_id: str, request: ResearchRequest, graph):
     """Run the research process asynchronously"""
     try:
         # Execute graph with topic
-        config = {"recursion_limit": 100}  # Prevent infinite loops
-        result = await graph.aflow({
-            "topic": topic
+        config = {
+            "recursion_limit": 100,  # Prevent infinite loops
+            "configurable": {
+                "local_llm": request.model,
+                "max_web_research_loops": request.max_loops
+            }
+        }
+        result = await graph.ainvoke({
+            "research_topic": request.topic
         }, config=config)
         
         # Store results
@@ -116,6 +118,84 @@ async def run_research(thread_id: str, topic: str, graph):
         active_threads[thread_id]["error"] = str(e)
         print(f"Research failed: {str(e)}")
 
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format a Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_research_events(request: ResearchRequest):
+    """Run the research graph and yield summary tokens and node transitions as SSE messages"""
+    from assistant.checkpoint import aresume_input
+    from assistant.graph import graph
+
+    config = {
+        "recursion_limit": 100,
+        "configurable": {
+            "local_llm": request.model,
+            "max_web_research_loops": request.max_loops
+        }
+    }
+
+    # With a checkpointer, every run has a thread id; sending it back resumes
+    # an interrupted run from its last completed step, or starts a finished
+    # one over
+    thread_id = None
+    if graph.checkpointer is not None:
+        thread_id = request.thread_id or str(uuid.uuid4())
+        config["configurable"]["thread_id"] = thread_id
+
+    try:
+        input = await aresume_input(graph, config, {"research_topic": request.topic})
+        yield format_sse("start", {"topic": request.topic, "thread_id": thread_id, "resumed": input is None})
+
+        async for mode, chunk in graph.astream(
+            input, config=config, stream_mode=["messages", "updates"]
+        ):
+            if mode == "messages":
+                # Only forward summary tokens; the JSON produced by query
+                # writing and reflection is not meant for display. The step
+                # changes with every loop, so clients can reset their view
+                message, metadata = chunk
+                if metadata.get("langgraph_node") == "summarize_sources" and message.content:
+                    yield format_sse("token", {"content": message.content, "step": metadata.get("langgraph_step")})
+            else:
+                for node, update in chunk.items():
+                    update = update or {}
+                    yield format_sse("node", {
+                        "node": node,
+                        "search_query": update.get("search_query"),
+                        "research_loop_count": update.get("research_loop_count")
+                    })
+                    if node == "summarize_sources":
+                        # Incremental summary patches are not streamed as tokens, so
+                        # clients get the rebuilt summary once the step finishes
+                        yield format_sse("summary", {"running_summary": update.get("running_summary")})
+                    if node == "finalize_summary":
+                        yield format_sse("done", {"running_summary": update.get("running_summary")})
+    except Exception as e:
+        logger.error(f"Streaming research failed: {str(e)}", exc_info=True)
+        yield format_sse("error", {"error": str(e)})
+
+@router.post("/research/stream")
+async def stream_research(request: ResearchRequest):
+    """Stream a research run as Server-Sent Events.
+
+    When CHECKPOINT_DB is set, pass the thread_id from the start event to
+    resume an interrupted run.
+
+    Events:
+        start: The run has been accepted, with its thread_id and whether it resumed
+        token: A chunk of the summary currently being written
+        node: A graph node finished, with the current query and loop count
+        summary: The full running summary after a summarize step
+        done: The final summary with sources
+        error: The run failed
+    """
+    return StreamingResponse(
+        stream_research_events(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @router.get("/research/{thread_id}/status")
 async def get_research_status(thread_id: str):
     """Get status of research thread"""
@@ -153,14 +233,11 @@ async def get_research_results(thread_id: str):
 async def improve_text(request: ImproveRequest):
     """Improve the provided text"""
     try:
-        from langchain_community.chat_models import ChatOllama
-        from langchain.prompts import PromptTemplate
+        from langchain_core.prompts import PromptTemplate
+        from ollama_deep_researcher.model import get_llm
         
-        # Set up Ollama client
-        ollama_client = ChatOllama(
-            model=request.model,
-            base_url="http://localhost:11434"
-        )
+        # Get the pooled Ollama client
+        ollama_client = get_llm(request.model)
         
         # Set up prompt
         template = """
@@ -180,7 +257,7 @@ async def improve_text(request: ImproveRequest):
         
         # Run inference
         chain = prompt | ollama_client
-        result = chain.invoke({"text": request.text})
+        result = await chain.ainvoke({"text": request.text})
         
         # Extract content
         improved_text = result.content
@@ -194,14 +271,11 @@ async def improve_text(request: ImproveRequest):
 async def expand_text(request: ExpandRequest):
     """Expand the provided text with more details and information"""
     try:
-        from langchain_community.chat_models import ChatOllama
-        from langchain.prompts import PromptTemplate
+        from langchain_core.prompts import PromptTemplate
+        from ollama_deep_researcher.model import get_llm
         
-        # Set up Ollama client
-        ollama_client = ChatOllama(
-            model=request.model,
-            base_url="http://localhost:11434"
-        )
+        # Get the pooled Ollama client
+        ollama_client = get_llm(request.model)
         
         # Set up prompt
         template = """
@@ -222,7 +296,7 @@ async def expand_text(request: ExpandRequest):
         
         # Run inference
         chain = prompt | ollama_client
-        result = chain.invoke({"text": request.text})
+        result = await chain.ainvoke({"text": request.text})
         
         # Extract content
         expanded_text = result.content
@@ -232,6 +306,54 @@ async def expand_text(request: ExpandRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to expand text: {str(e)}")
 
+@router.get("/fetch/stats")
+async def get_fetch_stats():
+    """Report full-page fetch counts, errors, timeouts and latency per domain"""
+    from assistant.fetch import fetch_stats
+    return fetch_stats()
+
+@router.get("/fetch/cache-stats")
+async def get_page_cache_stats():
+    """Report page cache hits, misses, revalidations, shared downloads, evictions and size"""
+    from assistant.page_cache import page_cache_stats
+    return page_cache_stats()
+
+@router.get("/search/cache-stats")
+async def get_search_cache_stats():
+    """Report search cache hits, coalesced searches, misses and hit ratio per provider"""
+    from assistant.search_cache import search_cache_stats
+    return search_cache_stats()
+
+@router.get("/search/latency-stats")
+async def get_search_latency_stats():
+    """Report p50/p99 latency and outcomes per search provider, and the hedge trigger rate"""
+    from assistant.hedge import search_latency_stats
+    return search_latency_stats()
+
+@router.get("/search/guard-stats")
+async def get_search_guard_stats():
+    """Report circuit state and transitions, retries, throttling and rejections per search provider"""
+    from assistant.search_guard import search_guard_stats
+    return search_guard_stats()
+
+@router.get("/llm/backend-stats")
+async def get_llm_backend_stats():
+    """Report health, outstanding requests, errors and latency per Ollama backend"""
+    from assistant.backends import backend_stats
+    return backend_stats()
+
+@router.get("/llm/scheduler-stats")
+async def get_llm_scheduler_stats():
+    """Report in-flight requests, queue depth and wait times per Ollama backend and lane"""
+    from assistant.scheduler import scheduler_stats
+    return scheduler_stats()
+
+@router.get("/llm/pool-stats")
+async def get_llm_pool_stats():
+    """Report Ollama client reuse and connection pool usage"""
+    from assistant.llm import pool_stats
+    return pool_stats()
+
 @router.post("/word/research")
 @with_error_handling
 async def research_for_word(request: WordResearchRequest):
@@ -240,29 +362,16 @@ async def research_for_word(request: WordResearchRequest):
         logger.info(f"Starting Word research on topic: {request.topic}")
         
         # Get graph instance
-        graph = get_graph()
-        
-        # Initialize research config
-        config = {
-            "configurable": {
-                "topic": request.topic
-            }
-        }
-        
-        # Add existing content as context if provided
-        if request.context:
-            config["configurable"]["context"] = request.context
+        from assistant.graph import graph
         
         # Run the research graph
-        logger.info(f"Creating research thread with config: {config}")
-        thread = graph.create_thread(config)
-        
         logger.info(f"Running research on topic: {request.topic}")
-        result = thread.run(config)
+        result = await graph.ainvoke({"research_topic": request.topic})
         
-        # Extract summary and sources
-        final_summary = result.get("final_summary", "No research results available.")
-        sources = result.get("sources", [])
+        # The final summary already ends with its sources; the queries are
+        # recorded with each loop's search timings
+        final_summary = result.get("running_summary") or "No research results available."
+        sources = []
         
         logger.info(f"Research complete, summary length: {len(final_summary)}")
         
@@ -271,7 +380,7 @@ async def research_for_word(request: WordResearchRequest):
             "status": "success",
             "summary": final_summary,
             "sources": sources,
-            "queries_used": result.get("queries", [])
+            "queries_used": [query for timing in result.get("search_timings", []) for query in timing["queries"]]
         }
         
         return response
@@ -307,7 +416,7 @@ async def edit_for_word(request: WordEditRequest):
             """)
         ]
         
-        response = llm.invoke(messages)
+        response = await llm.ainvoke(messages)
         edited_content = response.content
         
         return {
@@ -329,7 +438,7 @@ async def check_status():
         # Test the model with a simple query
         start_time = time.time()
         llm = get_llm()
-        test_response = llm.invoke("Hello")
+        test_response = await llm.ainvoke("Hello")
         response_time = time.time() - start_time
         
         return {
@@ -385,7 +494,7 @@ async def edit_content(request: WordEditRequest):
     ]
     
     start_time = time.time()
-    response = llm.invoke(messages)
+    response = await llm.ainvoke(messages)
     edited_content = response.content
     processing_time = time.time() - start_time
     
@@ -452,7 +561,7 @@ async def process_long_edit(content: str, instruction: str):
             """)
         ]
         
-        response = llm.invoke(messages)
+        response = await llm.ainvoke(messages)
         edited_chunks.append(response.content)
     
     # Combine the edited chunks
@@ -471,38 +580,15 @@ async def research_topic(request: WordResearchRequest):
     start_time = time.time()
     
     # Import here to avoid circular imports
-    from ollama_deep_researcher.graph import get_graph
-    
-    # Create new thread and run the graph
-    graph = get_graph()
-    thread = graph.new_thread()
-    
-    config = {
-        "configurable": {
-            "topic": request.topic
-        }
-    }
+    from assistant.graph import graph
     
-    if request.context:
-        config["configurable"]["context"] = request.context
-        
-    result = thread.run(config)
+    result = await graph.ainvoke({"research_topic": request.topic})
     
     # Extract the final summary from the result
-    if "final_summary" in result:
-        summary = result["final_summary"]
-        sources = result.get("sources", [])
-        
-        # Format sources as markdown links if available
-        source_links = []
-        for i, source in enumerate(sources[:10]):  # Limit to top 10 sources
-            title = source.get("title", f"Source {i+1}")
-            url = source.get("url", "#")
-            source_links.append(f"- [{title}]({url})")
-            
-        # Add sources to the summary if any exist
-        if source_links:
-            summary += "\n\n## Sources\n\n" + "\n".join(source_links)
+    if result.get("running_summary"):
+        summary = result["running_summary"]
+        # The summary already ends with its sources, one bullet per line
+        sources = [line for line in summary.partition("### Sources:")[2].splitlines() if line.strip()]
         
         processing_time = time.time() - start_time
         logger.info(f"Research completed in {processing_time:.2f} seconds")
@@ -556,7 +642,7 @@ async def verify_content(request: VerifyRequest):
         HumanMessage(content=f"Please analyze this text:\n\n{content}")
     ]
     
-    response = llm.invoke(messages)
+    response = await llm.ainvoke(messages)
     
     # Extract JSON from response
     try:
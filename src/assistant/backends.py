@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from assistant.scheduler import get_scheduler
+
+# Seconds between health checks of each backend when balancing across several
+OLLAMA_HEALTH_CHECK_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_CHECK_INTERVAL", "15"))
+
+# Errors meaning the backend itself is unreachable, as opposed to a bad request;
+# calls failing with these are retried on the next backend
+FAILOVER_ERRORS = (ConnectionError, httpx.TransportError)
+
+def parse_base_urls(value: str) -> List[str]:
+    """Split a comma-separated list of Ollama base URLs, dropping blanks and duplicates"""
+    urls = [url.strip().rstrip("/") for url in (value or "").split(",")]
+    return list(dict.fromkeys(url for url in urls if url))
+
+class Backend:
+    """Health and request counters for one Ollama endpoint."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.healthy = True
+        self.runs_assigned = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_error: Optional[str] = None
+        self.last_checked: Optional[float] = None
+        self.lock = threading.Lock()
+
+    def outstanding(self) -> int:
+        """Requests running on or queued for this backend."""
+        stats = get_scheduler(self.base_url).stats()
+        return stats["in_flight"] + stats["queue_depth"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            completed = self.requests - self.errors
+            return {
+                "healthy": self.healthy,
+                "outstanding": self.outstanding(),
+                "runs_assigned": self.runs_assigned,
+                "requests": self.requests,
+                "errors": self.errors,
+                "avg_latency_ms": round(self.latency_total / completed * 1000, 1) if completed else 0.0,
+                "max_latency_ms": round(self.latency_max * 1000, 1),
+                "last_error": self.last_error,
+            }
+
+_backends_lock = threading.Lock()
+_backends: Dict[str, Backend] = {}
+
+def get_backend(base_url: str) -> Backend:
+    """Return the counters for base_url, shared by every pool that includes it."""
+    base_url = (base_url or "http://localhost:11434").rstrip("/")
+    with _backends_lock:
+        backend = _backends.get(base_url)
+        if backend is None:
+            backend = _backends[base_url] = Backend(base_url)
+        return backend
+
+def record_request(base_url: str, seconds: float):
+    """Count a completed LLM request and its latency."""
+    backend = get_backend(base_url)
+    with backend.lock:
+        backend.requests += 1
+        backend.latency_total += seconds
+        backend.latency_max = max(backend.latency_max, seconds)
+
+def record_error(base_url: str, error: BaseException):
+    """Count a failed LLM request, taking the backend out of rotation if it is unreachable."""
+    backend = get_backend(base_url)
+    with backend.lock:
+        backend.requests += 1
+        backend.errors += 1
+        backend.last_error = f"{type(error).__name__}: {error}"
+        if isinstance(error, FAILOVER_ERRORS):
+            backend.healthy = False
+
+def check_health(backend: Backend, timeout: float = 2.0) -> bool:
+    """Probe a backend's /api/version and update its health."""
+    try:
+        healthy = httpx.get(f"{backend.base_url}/api/version", timeout=timeout).status_code == 200
+        error = None if healthy else "Health check failed"
+    except httpx.HTTPError as e:
+        healthy, error = False, f"{type(e).__name__}: {e}"
+    with backend.lock:
+        backend.healthy = healthy
+        backend.last_checked = time.time()
+        if error:
+            backend.last_error = error
+    return healthy
+
+class BackendPool:
+    """Routes LLM calls across several Ollama endpoints.
+
+    New runs go to the healthy backend with the fewest outstanding requests,
+    ties going to the one assigned the fewest runs so runs starting together
+    are spread out before any of them has sent a request. A run keeps its
+    backend while it stays healthy, so that backend's prompt cache keeps
+    serving the run's shared prefix. A daemon thread re-probes every backend
+    so failed ones rejoin the rotation once they recover.
+    """
+
+    def __init__(self, base_urls: Sequence[str]):
+        self.backends = [get_backend(url) for url in base_urls]
+        self._lock = threading.Lock()
+        if len(self.backends) > 1:
+            threading.Thread(target=self._health_loop, name="ollama-health-check", daemon=True).start()
+
+    def _health_loop(self):
+        while True:
+            for backend in self.backends:
+                check_health(backend)
+            time.sleep(OLLAMA_HEALTH_CHECK_INTERVAL)
+
+    def ranked(self, preferred: Optional[str] = None) -> List[str]:
+        """Order backends for a call: the preferred one if healthy, then healthy ones by load, then unhealthy ones."""
+        preferred = preferred.rstrip("/") if preferred else None
+        order = {backend.base_url: index for index, backend in enumerate(self.backends)}
+
+        def rank(backend: Backend) -> Tuple[int, int, int, int, int]:
+            return (not backend.healthy, backend.base_url != preferred, backend.outstanding(), backend.runs_assigned, order[backend.base_url])
+
+        return [backend.base_url for backend in sorted(self.backends, key=rank)]
+
+    def choose(self, preferred: Optional[str] = None) -> str:
+        """Pick the backend for a run's next call, keeping the preferred one while it is healthy."""
+        with self._lock:
+            base_url = self.ranked(preferred)[0]
+            if base_url != preferred:
+                backend = get_backend(base_url)
+                with backend.lock:
+                    backend.runs_assigned += 1
+            return base_url
+
+_pools_lock = threading.Lock()
+_pools: Dict[Tuple[str, ...], BackendPool] = {}
+
+def get_backend_pool(base_urls: Sequence[str]) -> BackendPool:
+    """Return the shared pool for this list of base URLs."""
+    key = tuple(url.rstrip("/") for url in base_urls) or ("http://localhost:11434",)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = BackendPool(key)
+        return pool
+
+def backend_stats() -> Dict[str, Dict[str, Any]]:
+    """Report health, outstanding requests, request and error counts and latency for every Ollama backend."""
+    with _backends_lock:
+        backends = list(_backends.values())
+    return {backend.base_url: backend.stats() for backend in backends}
@@ -0,0 +1,181 @@
+import asyncio
+import os
+import sqlite3
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.sqlite import SqliteSaver
+
+# Persistent checkpointing is opt-in: set CHECKPOINT_DB to a file path to save
+# the graph state after every step and resume interrupted runs by thread id.
+CHECKPOINT_DB = os.environ.get("CHECKPOINT_DB")
+# Checkpoints kept per thread; only the latest is needed to resume a run
+CHECKPOINT_KEEP_LAST = int(os.environ.get("CHECKPOINT_KEEP_LAST", "3"))
+# Threads with no new checkpoint for this long are deleted
+CHECKPOINT_MAX_AGE_HOURS = float(os.environ.get("CHECKPOINT_MAX_AGE_HOURS", "168"))
+# Checkpoints written between pruning passes
+CHECKPOINT_PRUNE_INTERVAL = int(os.environ.get("CHECKPOINT_PRUNE_INTERVAL", "200"))
+
+def connect(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for frequent small checkpoint writes.
+
+    WAL lets readers (status endpoints, resumed runs) proceed while a run is
+    writing, and synchronous=NORMAL only syncs on WAL checkpoints, which keeps
+    every committed step across a process crash. Incremental auto-vacuum lets
+    pruning hand freed pages back to the filesystem.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+    conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+class ResearchCheckpointer(SqliteSaver):
+    """SqliteSaver that also serves async graph runs and prunes old checkpoints.
+
+    SqliteSaver serializes all access through one connection and lock, so the
+    async methods simply run the sync ones in a worker thread. Each write
+    records the thread's last activity, and every CHECKPOINT_PRUNE_INTERVAL
+    writes old checkpoints are pruned so the database stays bounded.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, keep_last: int = CHECKPOINT_KEEP_LAST,
+                 max_age_hours: float = CHECKPOINT_MAX_AGE_HOURS, prune_interval: int = CHECKPOINT_PRUNE_INTERVAL):
+        super().__init__(conn)
+        self.keep_last = max(keep_last, 1)
+        self.max_age_hours = max_age_hours
+        self.prune_interval = prune_interval
+        self._writes_since_prune = 0
+
+    def setup(self) -> None:
+        if self.is_setup:
+            return
+        super().setup()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS thread_activity (thread_id TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        self.conn.commit()
+
+    def put(self, config, checkpoint, metadata, new_versions):
+        saved = super().put(config, checkpoint, metadata, new_versions)
+        with self.cursor() as cur:
+            cur.execute(
+                "INSERT OR REPLACE INTO thread_activity (thread_id, updated_at) VALUES (?, ?)",
+                (str(config["configurable"]["thread_id"]), time.time()),
+            )
+        self._writes_since_prune += 1
+        if self.prune_interval and self._writes_since_prune >= self.prune_interval:
+            self.prune_checkpoints()
+        return saved
+
+    def prune_checkpoints(self) -> Dict[str, int]:
+        """Delete expired threads and all but the newest checkpoints of the rest.
+
+        Checkpoint ids are time-ordered, so the newest keep_last per thread and
+        namespace are retained along with their pending writes, which is all a
+        resumed run needs. Freed pages are then returned to the filesystem.
+
+        Returns:
+            dict: Number of expired threads, checkpoints and writes deleted
+        """
+        self.setup()
+        self._writes_since_prune = 0
+        cutoff = time.time() - self.max_age_hours * 3600
+        with self.cursor() as cur:
+            cur.execute("SELECT thread_id FROM thread_activity WHERE updated_at < ?", (cutoff,))
+            expired = [row[0] for row in cur.fetchall()]
+            for table in ("checkpoints", "writes", "thread_activity"):
+                cur.executemany(f"DELETE FROM {table} WHERE thread_id = ?", [(thread_id,) for thread_id in expired])
+
+            cur.execute(
+                """
+                DELETE FROM checkpoints WHERE rowid IN (
+                    SELECT rowid FROM (
+                        SELECT rowid, ROW_NUMBER() OVER (
+                            PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC
+                        ) AS position FROM checkpoints
+                    ) WHERE position > ?
+                )
+                """,
+                (self.keep_last,),
+            )
+            checkpoints = cur.rowcount
+            cur.execute(
+                """
+                DELETE FROM writes WHERE NOT EXISTS (
+                    SELECT 1 FROM checkpoints c
+                    WHERE c.thread_id = writes.thread_id
+                    AND c.checkpoint_ns = writes.checkpoint_ns
+                    AND c.checkpoint_id = writes.checkpoint_id
+                )
+                """
+            )
+            writes = cur.rowcount
+
+        with self.lock:
+            # executescript steps incremental_vacuum to completion; execute frees a single page
+            self.conn.executescript("PRAGMA incremental_vacuum;")
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return {"expired_threads": len(expired), "checkpoints": checkpoints, "writes": writes}
+
+    async def aget_tuple(self, config: RunnableConfig):
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> AsyncIterator:
+        items = await asyncio.to_thread(lambda: list(self.list(config, filter=filter, before=before, limit=limit)))
+        for item in items:
+            yield item
+
+    async def aput(self, config, checkpoint, metadata, new_versions):
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config, writes, task_id, task_path=""):
+        return await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+def get_checkpointer(path: Optional[str] = CHECKPOINT_DB) -> Optional[ResearchCheckpointer]:
+    """Build the persistent checkpointer, or None when checkpointing is not enabled.
+
+    Args:
+        path (str, optional): SQLite database path, defaults to CHECKPOINT_DB
+
+    Returns:
+        ResearchCheckpointer: A checkpointer with expired checkpoints already pruned
+    """
+    if not path:
+        return None
+    checkpointer = ResearchCheckpointer(connect(path))
+    checkpointer.prune_checkpoints()
+    return checkpointer
+
+def resume_input(graph, config: RunnableConfig, input: Any) -> Any:
+    """Return None when the thread in config has an unfinished run, so the graph resumes it, else input.
+
+    Resuming continues from the last completed step; nodes that finished in
+    the step that failed are not run again. A thread whose run finished is
+    cleared first, so the input starts a fresh run instead of adding loops,
+    searches and sources on top of the finished run's state.
+    """
+    if graph.checkpointer is None or not config.get("configurable", {}).get("thread_id"):
+        return input
+    state = graph.get_state(config)
+    if state.next:
+        return None
+    if state.values:
+        graph.checkpointer.delete_thread(config["configurable"]["thread_id"])
+    return input
+
+async def aresume_input(graph, config: RunnableConfig, input: Any) -> Any:
+    """Async version of resume_input."""
+    if graph.checkpointer is None or not config.get("configurable", {}).get("thread_id"):
+        return input
+    state = await graph.aget_state(config)
+    if state.next:
+        return None
+    if state.values:
+        await graph.checkpointer.adelete_thread(config["configurable"]["thread_id"])
+    return input
@@ -11,6 +11,7 @@ class SearchAPI(Enum):
     PERPLEXITY = "perplexity"
     TAVILY = "tavily"
     DUCKDUCKGO = "duckduckgo"
+    LOCAL = "local"
 
 @dataclass(kw_only=True)
 class Configuration:
@@ -18,8 +19,34 @@ class Configuration:
     max_web_research_loops: int = int(os.environ.get("MAX_WEB_RESEARCH_LOOPS", "3"))
     local_llm: str = os.environ.get("OLLAMA_MODEL", "llama3.2")
     search_api: SearchAPI = SearchAPI(os.environ.get("SEARCH_API", SearchAPI.DUCKDUCKGO.value))  # Default to DUCKDUCKGO
+    hedge_search_api: str = os.environ.get("HEDGE_SEARCH_API", "")  # Search API also queried when search_api is slow or finds nothing, empty disables hedging
+    hedge_delay: float = float(os.environ.get("HEDGE_DELAY", "1.5"))  # Seconds to wait for search_api before also querying hedge_search_api
+    hedge_merge_window: float = float(os.environ.get("HEDGE_MERGE_WINDOW", "0.25"))  # Seconds the slower search API is given, after the first answer, to be merged in
+    local_search_dir: str = os.environ.get("LOCAL_SEARCH_DIR", "")  # Directory of HTML, Markdown and text files searched by the local search API
     fetch_full_page: bool = os.environ.get("FETCH_FULL_PAGE", "False").lower() in ("true", "1", "t")
     ollama_base_url: str = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434/")
+    ollama_base_urls: str = os.environ.get("OLLAMA_BASE_URLS", "")  # Comma-separated Ollama endpoints to balance runs across, overrides ollama_base_url
+    ollama_keep_alive: str = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # How long Ollama keeps the model loaded between calls of a run
+    ollama_num_ctx: int = int(os.environ.get("OLLAMA_NUM_CTX", "0"))  # Context window to load models with, 0 keeps the server's default (OLLAMA_CONTEXT_LENGTH)
+    query_model: str = os.environ.get("QUERY_MODEL", "")  # Model that writes the first query, defaults to local_llm
+    query_base_url: str = os.environ.get("QUERY_BASE_URL", "")  # Ollama endpoints for query_model, defaults to the run's backend
+    reflection_model: str = os.environ.get("REFLECTION_MODEL", "")  # Model that reflects and drafts follow-up queries, defaults to local_llm
+    reflection_base_url: str = os.environ.get("REFLECTION_BASE_URL", "")  # Ollama endpoints for reflection_model, defaults to the run's backend
+    summary_model: str = os.environ.get("SUMMARY_MODEL", "")  # Model that writes the summary, defaults to local_llm
+    summary_base_url: str = os.environ.get("SUMMARY_BASE_URL", "")  # Ollama endpoints for summary_model, defaults to the run's backend
+    ollama_json_schema: bool = os.environ.get("OLLAMA_JSON_SCHEMA", "True").lower() in ("true", "1", "t")  # Constrain structured calls with a JSON schema (Ollama 0.5+) instead of plain JSON mode
+    json_early_exit: bool = os.environ.get("JSON_EARLY_EXIT", "True").lower() in ("true", "1", "t")  # Stop generating once the needed JSON field is complete
+    num_parallel_queries: int = int(os.environ.get("NUM_PARALLEL_QUERIES", "1"))  # Queries searched concurrently per loop
+    speculative_prefetch: bool = os.environ.get("SPECULATIVE_PREFETCH", "False").lower() in ("true", "1", "t")  # Draft and prefetch the next query while summarizing
+    incremental_summary: bool = os.environ.get("INCREMENTAL_SUMMARY", "False").lower() in ("true", "1", "t")  # Update the summary with patches to related sections
+    summary_context_sections: int = int(os.environ.get("SUMMARY_CONTEXT_SECTIONS", "3"))  # Sections sent in full for an incremental update
+    passage_rerank: bool = os.environ.get("PASSAGE_RERANK", "True").lower() in ("true", "1", "t")  # Send only the full-page passages that best match the query, ranked with BM25
+    rerank_max_passages: int = int(os.environ.get("RERANK_MAX_PASSAGES", "12"))  # Most passages sent per loop across all sources
+    source_dedup_distance: int = int(os.environ.get("SOURCE_DEDUP_DISTANCE", "3"))  # Max SimHash bits a source may differ from an earlier one to be skipped as a near-duplicate, -1 sends every source
+    min_new_source_fraction: float = float(os.environ.get("MIN_NEW_SOURCE_FRACTION", "0"))  # Stop early when fewer of a loop's URLs are new
+    min_new_content_fraction: float = float(os.environ.get("MIN_NEW_CONTENT_FRACTION", "0"))  # Stop early when less of a loop's content is new
+    min_summary_change: float = float(os.environ.get("MIN_SUMMARY_CHANGE", "0"))  # Stop early when the summary changes less than this
+    speculation_similarity_threshold: float = float(os.environ.get("SPECULATION_SIMILARITY_THRESHOLD", "0.5"))  # Min word overlap for a prefetch hit
 
     @classmethod
     def from_runnable_config(
@@ -29,9 +56,22 @@ class Configuration:
         configurable = (
             config["configurable"] if config and "configurable" in config else {}
         )
+        # An empty environment variable counts as unset; any other value,
+        # including False, 0 and "", overrides the field's default
         values: dict[str, Any] = {
-            f.name: os.environ.get(f.name.upper(), configurable.get(f.name))
+            f.name: os.environ.get(f.name.upper()) or configurable.get(f.name)
             for f in fields(cls)
             if f.init
         }
-        return cls(**{k: v for k, v in values.items() if v})
\ No newline at end of file
+        field_types = {f.name: f.type for f in fields(cls)}
+        return cls(**{k: _coerce(v, field_types[k]) for k, v in values.items() if v is not None})
+
+def _coerce(value: Any, field_type: Any) -> Any:
+    """Convert string values from the environment to the field's type."""
+    if not isinstance(value, str):
+        return value
+    if field_type is bool:
+        return value.lower() in ("true", "1", "t")
+    if field_type in (int, float):
+        return field_type(value)
+    return value
\ No newline at end of file
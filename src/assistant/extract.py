@@ -0,0 +1,491 @@
+import codecs
+import os
+import re
+from html.parser import HTMLParser
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+# Parser used to extract page text: lxml, selectolax or html.parser. "auto"
+# picks the fastest one installed; html.parser is pure Python and always available.
+EXTRACT_BACKEND = os.environ.get("EXTRACT_BACKEND", "auto")
+
+# Elements that never hold page content
+SKIP_TAGS = {
+    "head", "script", "style", "noscript", "template", "svg", "math", "canvas", "iframe", "object",
+    "nav", "header", "footer", "aside", "form", "button", "select", "dialog", "menu",
+}
+# ARIA roles and class or id fragments of navigation, banners and other boilerplate
+SKIP_ROLES = {"navigation", "banner", "contentinfo", "complementary", "search", "dialog", "alertdialog", "menu", "menubar"}
+BOILERPLATE = re.compile(
+    r"(^|[-_\s])(cookie|consent|gdpr|banner|nav|navbar|menu|breadcrumbs?|footer|sidebar|share|sharing|social|"
+    r"subscribe|newsletter|signup|promo|advert|ads?|sponsor|popup|modal|related|recommended|comments?)($|[-_\s])",
+    re.IGNORECASE,
+)
+# Elements whose text is kept, and those whose boundaries end a block of text
+MAIN_TAGS = {"main", "article"}
+HEADINGS = {"h1": 1, "h2": 2, "h3": 3, "h4": 4, "h5": 5, "h6": 6}
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "li", "ul", "ol", "dl", "dt", "dd", "blockquote", "pre",
+    "table", "tr", "td", "th", "caption", "figure", "figcaption", "br", "hr", "details", "summary", "address",
+} | set(HEADINGS)
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "param", "source", "track", "wbr"}
+
+# Short blocks that are mostly link text are menus and link lists
+LINK_DENSITY_LIMIT = 0.5
+LINK_DENSE_MAX_WORDS = 40
+# Main/article text must be at least this share of the page to be used on its own
+MAIN_CONTENT_SHARE = 0.25
+
+Event = Tuple[str, Any, Any]
+
+# Containers whose class names describe the whole page layout, so are never matched against BOILERPLATE
+LAYOUT_TAGS = {"html", "body", "main", "article"}
+
+def _skipped(tag: str, attrs: Dict[str, Any], in_main: bool, heuristics: bool) -> bool:
+    if tag in SKIP_TAGS:
+        # An article's own header holds its title
+        return not (in_main and tag == "header")
+    if "hidden" in attrs or attrs.get("aria-hidden") == "true" or attrs.get("role") in SKIP_ROLES:
+        return True
+    if not heuristics or tag in LAYOUT_TAGS:
+        return False
+    return bool(BOILERPLATE.search(f"{attrs.get('class') or ''} {attrs.get('id') or ''}"))
+
+class _Block:
+    """Text between two block boundaries, with how much of it was link text."""
+
+    def __init__(self, heading: int, in_main: bool, preformatted: bool):
+        self.parts: List[str] = []
+        self.text = ""
+        self.link_chars = 0
+        self.heading = heading
+        self.in_main = in_main
+        self.preformatted = preformatted
+
+    def add(self, text: str, in_link: bool):
+        self.parts.append(text)
+        if in_link:
+            self.link_chars += len(text.strip())
+
+    def finish(self) -> str:
+        text = "".join(self.parts)
+        self.text = text.strip("\n") if self.preformatted else " ".join(text.split())
+        return self.text
+
+class _BlockBuilder:
+    """Groups the text of a page's events into blocks, dropping skipped subtrees.
+
+    Events can be fed as they are parsed, so a streamed download can tell how
+    much text it has before the page ends.
+    """
+
+    def __init__(self, heuristics: bool = True):
+        self.heuristics = heuristics
+        self.blocks: List[_Block] = []
+        self.chars = 0
+        self.main_chars = 0
+        self._stack: List[Tuple[str, bool]] = []  # (tag, skipped)
+        self._skip_depth = self._main_depth = self._link_depth = self._pre_depth = self._heading = 0
+        self._block: Optional[_Block] = None
+
+    def _flush(self):
+        block, self._block = self._block, None
+        if block is not None and block.finish():
+            self.blocks.append(block)
+            self.chars += len(block.text)
+            if block.in_main:
+                self.main_chars += len(block.text)
+
+    def feed(self, events: Iterable[Event]):
+        for kind, value, attrs in events:
+            if kind == "text":
+                if self._skip_depth or not value:
+                    continue
+                if self._block is None:
+                    self._block = _Block(self._heading, self._main_depth > 0, self._pre_depth > 0)
+                self._block.add(value, self._link_depth > 0)
+            elif kind == "start":
+                skipped = self._skip_depth > 0 or _skipped(value, attrs, self._main_depth > 0, self.heuristics)
+                if value in BLOCK_TAGS and not self._skip_depth:
+                    self._flush()
+                if value in VOID_TAGS:
+                    continue
+                self._stack.append((value, skipped))
+                if skipped:
+                    self._skip_depth += 1
+                    continue
+                if value in MAIN_TAGS or attrs.get("role") == "main":
+                    self._main_depth += 1
+                self._link_depth += value == "a"
+                self._pre_depth += value == "pre"
+                self._heading = HEADINGS.get(value, self._heading)
+            elif kind == "end":
+                self._close(value)
+
+    def _close(self, value: str):
+        if not any(tag == value for tag, _ in self._stack):
+            return
+        # Close unclosed children along with their parent, as browsers do
+        while self._stack:
+            tag, skipped = self._stack.pop()
+            if skipped:
+                self._skip_depth -= 1
+            else:
+                if tag in MAIN_TAGS:
+                    self._main_depth -= 1
+                self._link_depth -= tag == "a"
+                self._pre_depth -= tag == "pre"
+                if tag in HEADINGS:
+                    self._flush()
+                    self._heading = 0
+            if tag == value:
+                break
+        if value in BLOCK_TAGS and not self._skip_depth:
+            self._flush()
+
+    def ready_chars(self) -> int:
+        """Characters of content so far; until a main element is seen, half the text is assumed to be boilerplate."""
+        return self.main_chars or self.chars // 2
+
+    def discard_open_block(self):
+        self._block = None
+
+    def finish(self) -> List[_Block]:
+        self._flush()
+        return self.blocks
+
+def _blocks(events: Iterable[Event], heuristics: bool = True) -> List[_Block]:
+    builder = _BlockBuilder(heuristics)
+    builder.feed(events)
+    return builder.finish()
+
+def _keep(block: _Block) -> bool:
+    if block.heading or block.preformatted:
+        return True
+    words = block.text.count(" ") + 1
+    if words < 2:
+        return False
+    return not (words <= LINK_DENSE_MAX_WORDS and block.link_chars > LINK_DENSITY_LIMIT * len(block.text))
+
+def _render(blocks: List[_Block]) -> str:
+    """Join the content blocks as paragraphs, with headings as Markdown headings."""
+    main_chars = sum(len(block.text) for block in blocks if block.in_main)
+    if main_chars and main_chars >= MAIN_CONTENT_SHARE * sum(len(block.text) for block in blocks):
+        blocks = [block for block in blocks if block.in_main]
+
+    paragraphs, seen = [], set()
+    for block in blocks:
+        if _keep(block) and block.text not in seen:
+            seen.add(block.text)
+            paragraphs.append((block.heading, block.text))
+
+    # Drop headings with no content under them, walking back from the end
+    kept: List[Tuple[int, str]] = []
+    for level, text in reversed(paragraphs):
+        if level and (not kept or 0 < kept[-1][0] <= level):
+            continue
+        kept.append((level, text))
+    return "\n\n".join(f"{'#' * level} {text}" if level else text for level, text in reversed(kept))
+
+# Backends: each turns a document into start, text and end events
+
+class _EventParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.events: List[Event] = []
+
+    def handle_starttag(self, tag, attrs):
+        self.events.append(("start", tag, dict(attrs)))
+
+    def handle_startendtag(self, tag, attrs):
+        self.events.append(("start", tag, dict(attrs)))
+        if tag not in VOID_TAGS:
+            self.events.append(("end", tag, None))
+
+    def handle_endtag(self, tag):
+        self.events.append(("end", tag, None))
+
+    def handle_data(self, data):
+        self.events.append(("text", data, None))
+
+def _html_parser_events(html: str) -> Iterator[Event]:
+    parser = _EventParser()
+    parser.feed(html)
+    parser.close()
+    return iter(parser.events)
+
+def _lxml_events(html: str) -> Iterator[Event]:
+    from lxml import etree, html as lxml_html
+
+    # lxml refuses str input that declares its own encoding
+    html = re.sub(r"^\s*<\?xml[^>]*\?>", "", html)
+    if not html.strip():
+        return
+    root = lxml_html.document_fromstring(html)
+    for event, element in etree.iterwalk(root, events=("start", "end", "comment", "pi")):
+        tag = element.tag
+        if not isinstance(tag, str):
+            # Comments and processing instructions only contribute their tail
+            if element.tail:
+                yield ("text", element.tail, None)
+            continue
+        if event == "start":
+            yield ("start", tag, element.attrib)
+            if element.text:
+                yield ("text", element.text, None)
+        else:
+            yield ("end", tag, None)
+            if element.tail:
+                yield ("text", element.tail, None)
+
+def _selectolax_events(html: str) -> Iterator[Event]:
+    from selectolax.lexbor import LexborHTMLParser
+
+    root = LexborHTMLParser(html).root
+    if root is None:
+        return
+    stack = [(root, False)]
+    while stack:
+        node, visited = stack.pop()
+        tag = node.tag
+        if tag == "-text":
+            yield ("text", node.text_content, None)
+            continue
+        if not tag or tag.startswith(("-", "_", "!")):
+            continue
+        if visited:
+            yield ("end", tag, None)
+            continue
+        yield ("start", tag, node.attributes)
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed(list(node.iter(include_text=True))))
+
+# Incremental backends: feed() returns the events parsed so far, close() the rest
+
+class _HtmlParserFeed(_EventParser):
+    def feed(self, data: str) -> List[Event]:
+        super().feed(data)
+        events, self.events = self.events, []
+        return events
+
+    def close(self) -> List[Event]:
+        super().close()
+        return self.events
+
+class _LxmlFeed:
+    """Streams events from lxml's pull parser.
+
+    An element's text is only complete once the parser moves past it, so the
+    text before each event is emitted with that event: a start or comment
+    emits its previous sibling's tail or else its parent's text, and an end
+    emits its last child's tail or else its own text.
+    """
+
+    def __init__(self):
+        from lxml import etree
+
+        self.parser = etree.HTMLPullParser(events=("start", "end", "comment", "pi"))
+
+    def _events(self) -> List[Event]:
+        events = []
+        for event, element in self.parser.read_events():
+            if event == "end":
+                last = element[-1] if len(element) else None
+                text = last.tail if last is not None else element.text
+                if text:
+                    events.append(("text", text, None))
+                events.append(("end", element.tag, None))
+                continue
+            previous = element.getprevious()
+            parent = element.getparent()
+            text = previous.tail if previous is not None else parent.text if parent is not None else None
+            if text:
+                events.append(("text", text, None))
+            if event == "start":
+                events.append(("start", element.tag, element.attrib))
+        return events
+
+    def feed(self, data: str) -> List[Event]:
+        self.parser.feed(data)
+        return self._events()
+
+    def close(self) -> List[Event]:
+        try:
+            self.parser.close()
+        except Exception:
+            # An empty or truncated document; keep whatever was parsed
+            pass
+        return self._events()
+
+class _BufferedFeed:
+    """For backends that cannot parse incrementally: parse everything on close."""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.parts: List[str] = []
+
+    def feed(self, data: str) -> List[Event]:
+        self.parts.append(data)
+        return []
+
+    def close(self) -> List[Event]:
+        return list(BACKENDS[self.backend]("".join(self.parts)))
+
+FEEDS: Dict[str, Callable[[], Any]] = {
+    "lxml": _LxmlFeed,
+    "selectolax": lambda: _BufferedFeed("selectolax"),
+    "html.parser": _HtmlParserFeed,
+}
+
+BACKENDS: Dict[str, Callable[[str], Iterator[Event]]] = {
+    "lxml": _lxml_events,
+    "selectolax": _selectolax_events,
+    "html.parser": _html_parser_events,
+}
+
+def available_backends() -> List[str]:
+    """The installed extraction backends, fastest first.
+
+    lxml builds its tree and walks it in C; selectolax parses faster but its
+    nodes are walked from Python, which makes it the slower of the two here.
+    """
+    available = []
+    for name, module in (("lxml", "lxml.html"), ("selectolax", "selectolax.lexbor")):
+        try:
+            __import__(module)
+            available.append(name)
+        except ImportError:
+            pass
+    return available + ["html.parser"]
+
+def resolve_backend(name: str = EXTRACT_BACKEND) -> str:
+    """Return the backend to use for name, falling back to the fastest installed one."""
+    available = available_backends()
+    if name in available:
+        return name
+    if name not in ("auto", ""):
+        print(f"Warning: Extraction backend {name} is not installed, using {available[0]}")
+    return available[0]
+
+_backend: Optional[str] = None
+
+def _default_backend() -> str:
+    global _backend
+    if _backend is None:
+        _backend = resolve_backend()
+    return _backend
+
+# Bytes searched for a <meta charset> declaration
+CHARSET_SNIFF_BYTES = 4096
+
+def _charset(content_type: str, head: bytes) -> str:
+    match = re.search(r"charset=[\"']?([\w-]+)", content_type) or re.search(rb"<meta[^>]+charset=[\"']?([\w-]+)", head[:CHARSET_SNIFF_BYTES], re.IGNORECASE)
+    charset = match.group(1) if match else "utf-8"
+    charset = charset.decode("ascii") if isinstance(charset, bytes) else charset
+    try:
+        codecs.lookup(charset)
+        return charset
+    except LookupError:
+        return "utf-8"
+
+def decode_html(html: Union[str, bytes], content_type: str = "") -> str:
+    """Decode a page using the charset from its Content-Type or meta tag, else UTF-8."""
+    if isinstance(html, str):
+        return html
+    return html.decode(_charset(content_type, html), errors="replace")
+
+def is_plain_text(content_type: str) -> bool:
+    """Whether a Content-Type is text to keep as-is rather than HTML to extract from."""
+    return content_type.split(";")[0].strip().lower() in ("text/plain", "text/markdown")
+
+def _plain_text(text: str) -> str:
+    return "\n\n".join(" ".join(paragraph.split()) for paragraph in re.split(r"\n\s*\n", text) if paragraph.strip())
+
+class TextExtractor:
+    """Incremental extract_text for streamed downloads.
+
+    Bytes are decoded and parsed as they are fed, so ready_chars() tells a
+    download when it has enough text to stop. The charset is taken from the
+    Content-Type, or from a <meta> tag within the first CHARSET_SNIFF_BYTES.
+    Backends that cannot parse incrementally (selectolax) parse on close.
+    """
+
+    def __init__(self, content_type: str = "", backend: Optional[str] = None):
+        self.content_type = content_type
+        self.backend = backend or _default_backend()
+        self.plain = is_plain_text(content_type)
+        self._head = b""
+        self._decoder = None
+        self._parts: List[str] = []
+        self._plain_chars = 0
+        self._feed = None if self.plain else FEEDS[self.backend]()
+        self._builder = _BlockBuilder()
+
+    def feed(self, data: bytes):
+        if self._decoder is None:
+            self._head += data
+            if len(self._head) < CHARSET_SNIFF_BYTES:
+                return
+            data, self._head = self._head, b""
+            self._decoder = codecs.getincrementaldecoder(_charset(self.content_type, data))(errors="replace")
+            self._push(re.sub(r"^\s*<\?xml[^>]*\?>", "", self._decoder.decode(data)))
+        else:
+            self._push(self._decoder.decode(data))
+
+    def _push(self, text: str):
+        self._parts.append(text)
+        if self.plain:
+            self._plain_chars += len(text)
+        else:
+            self._builder.feed(self._feed.feed(text))
+
+    def ready_chars(self) -> int:
+        """Characters of content extracted so far."""
+        return self._plain_chars if self.plain else self._builder.ready_chars()
+
+    def close(self, truncated: bool = False) -> str:
+        """Finish parsing and return the text, as extract_text would.
+
+        Args:
+            truncated (bool): The download stopped early, so the last, partly read paragraph is dropped
+        """
+        if self._decoder is None:
+            self._decoder = codecs.getincrementaldecoder(_charset(self.content_type, self._head))(errors="replace")
+            self._push(re.sub(r"^\s*<\?xml[^>]*\?>", "", self._decoder.decode(self._head)))
+        if not truncated:
+            self._push(self._decoder.decode(b"", final=True))
+        if self.plain:
+            text = "".join(self._parts)
+            return _plain_text(text.rsplit("\n", 1)[0] if truncated else text)
+        if truncated:
+            self._builder.discard_open_block()
+        else:
+            self._builder.feed(self._feed.close())
+        text = _render(self._builder.finish())
+        if not text:
+            text = _render(_blocks(BACKENDS[self.backend]("".join(self._parts)), heuristics=False))
+        return text
+
+def extract_text(html: Union[str, bytes], content_type: str = "", backend: Optional[str] = None) -> str:
+    """Extract a page's main content as paragraphs, with headings kept as Markdown headings.
+
+    Scripts, styles, navigation, headers, footers, cookie banners, sidebars and
+    link lists are dropped. When the page marks its content with <main> or
+    <article>, only that is kept.
+
+    Args:
+        html (str or bytes): The page
+        content_type (str): The response Content-Type, used to decode bytes
+        backend (str, optional): Parser to use, defaults to EXTRACT_BACKEND
+
+    Returns:
+        str: The cleaned text, paragraphs separated by blank lines
+    """
+    backend = backend or _default_backend()
+    html = decode_html(html, content_type)
+    if is_plain_text(content_type):
+        return _plain_text(html)
+    text = _render(_blocks(BACKENDS[backend](html)))
+    if not text:
+        # The class and id heuristics removed everything, so the page is laid out unusually
+        text = _render(_blocks(BACKENDS[backend](html), heuristics=False))
+    return text
@@ -0,0 +1,517 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+import weakref
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+
+from assistant.extract import TextExtractor, extract_text, is_plain_text
+from assistant.page_cache import CachedPage, PageCache, cache_ttl, canonical_url, get_page_cache
+
+logger = logging.getLogger(__name__)
+
+# Pages fetched at once across all searches, and from any one domain
+FETCH_MAX_CONCURRENCY = int(os.environ.get("FETCH_MAX_CONCURRENCY", "16"))
+FETCH_PER_DOMAIN = int(os.environ.get("FETCH_PER_DOMAIN", "2"))
+# Seconds to connect to a site and to wait between bytes of its response
+FETCH_CONNECT_TIMEOUT = float(os.environ.get("FETCH_CONNECT_TIMEOUT", "5"))
+FETCH_READ_TIMEOUT = float(os.environ.get("FETCH_READ_TIMEOUT", "10"))
+# Seconds a search waits for all of its pages; stragglers keep their snippets
+FETCH_DEADLINE = float(os.environ.get("FETCH_DEADLINE", "15"))
+# Domains kept in the fetch stats; the least recently fetched are dropped first
+FETCH_STATS_DOMAINS = int(os.environ.get("FETCH_STATS_DOMAINS", "256"))
+# Bytes of a page read at most, after decompression, so huge pages cannot exhaust memory
+FETCH_MAX_BYTES = int(os.environ.get("FETCH_MAX_BYTES", str(2 * 1024 * 1024)))
+# Characters of page text after which a download stops, when the caller does
+# not pass its own. Searches pass one derived from the summarizer's context
+# window (graph.page_text_chars), as far as a source could ever be used.
+FETCH_TEXT_CHARS = int(os.environ.get("FETCH_TEXT_CHARS", "6000"))
+
+# Only encodings that can be decompressed a bounded piece at a time are accepted
+FETCH_HEADERS = {"User-Agent": "Mozilla/5.0 (compatible; ollama-deep-researcher)", "Accept-Encoding": "gzip, deflate"}
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(FETCH_READ_TIMEOUT, connect=FETCH_CONNECT_TIMEOUT)
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=FETCH_MAX_CONCURRENCY, max_keepalive_connections=FETCH_MAX_CONCURRENCY)
+
+# Content types extracted as pages; others are skipped before their body is downloaded
+HTML_TYPES = {"text/html", "application/xhtml+xml"}
+# Unlabelled bodies are only read as HTML if they start like HTML
+HTML_SNIFF_BYTES = 512
+# Largest piece of decompressed body handed to the extractor at once
+DECODE_CHUNK_BYTES = 64 * 1024
+HTML_SNIFF = re.compile(rb"^\s*(<!doctype html|<html|<head|<body|<\?xml|<!--|<meta|<title)", re.IGNORECASE)
+
+class UnsupportedContent(Exception):
+    """A page whose content type cannot be extracted, such as a PDF or an image."""
+
+def _domain(url: str) -> str:
+    return urlsplit(url).hostname or ""
+
+class _DomainStats:
+    """Fetch counts and timings per domain, so slow or failing sites stand out.
+
+    Only the FETCH_STATS_DOMAINS most recently fetched domains are kept, so a
+    long-running server does not accumulate every site it has ever visited.
+    """
+
+    def __init__(self, size: int = FETCH_STATS_DOMAINS):
+        self.size = max(size, 1)
+        self._lock = threading.Lock()
+        self._domains: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+    def record(self, url: str, seconds: float, outcome: str, size: int = 0):
+        logger.info("Fetched %s in %.0f ms, %.0f KB (%s)", url, seconds * 1000, size / 1024, outcome)
+        with self._lock:
+            domain = _domain(url)
+            stats = self._domains.setdefault(domain, {"fetches": 0, "errors": 0, "timeouts": 0, "skipped": 0, "total_ms": 0.0, "max_ms": 0.0, "bytes": 0})
+            self._domains.move_to_end(domain)
+            while len(self._domains) > self.size:
+                self._domains.popitem(last=False)
+            stats["fetches"] += 1
+            stats["total_ms"] += seconds * 1000
+            stats["max_ms"] = max(stats["max_ms"], seconds * 1000)
+            stats["bytes"] += size
+            if outcome == "timeout":
+                stats["timeouts"] += 1
+            elif outcome == "skipped":
+                stats["skipped"] += 1
+            elif outcome != "ok":
+                stats["errors"] += 1
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                domain: {
+                    "fetches": stats["fetches"],
+                    "errors": stats["errors"],
+                    "timeouts": stats["timeouts"],
+                    "skipped": stats["skipped"],
+                    "avg_ms": round(stats["total_ms"] / stats["fetches"], 1),
+                    "avg_kb": round(stats["bytes"] / stats["fetches"] / 1024, 1),
+                    "max_ms": round(stats["max_ms"], 1),
+                }
+                for domain, stats in sorted(self._domains.items(), key=lambda item: -item[1]["total_ms"])
+            }
+
+_stats = _DomainStats()
+
+def _outcome(error: Optional[BaseException]) -> str:
+    if error is None:
+        return "ok"
+    if isinstance(error, httpx.TimeoutException):
+        return "timeout"
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"HTTP {error.response.status_code}"
+    if isinstance(error, UnsupportedContent):
+        return "skipped"
+    return type(error).__name__
+
+def _lookup(cache: Optional[PageCache], key: str, url: str, text_chars: int) -> Optional[CachedPage]:
+    """Return the cached page, counting a hit if it can be served without a request.
+
+    A page whose download stopped short of text_chars is not returned: it
+    must be downloaded again, and revalidating it would only keep it short.
+    """
+    cached = cache.get(key) if cache else None
+    if cached is not None and 0 < cached.truncated < text_chars:
+        cached = None
+    if cached is not None and cached.fresh:
+        cache.count("hits")
+        logger.info("Fetched %s from the page cache", url)
+    elif cache is not None and cached is None:
+        cache.count("misses")
+    return cached
+
+def _revalidated(cache: Optional[PageCache], key: str, cached: Optional[CachedPage], response: httpx.Response) -> bool:
+    """Extend the cached copy if the response is a 304."""
+    if cached is None or response.status_code != 304:
+        return False
+    cache.touch(key, response.headers, cache_ttl(response.headers) or 0)
+    cache.count("revalidated")
+    return True
+
+def _save(cache: Optional[PageCache], key: str, url: str, cached: Optional[CachedPage], response: httpx.Response, reader: "_PageReader"):
+    """Store the part of a page that was read.
+
+    A page cut off at FETCH_MAX_BYTES is not stored, as it is not the whole
+    document. A page whose download stopped once it had enough text is
+    stored with the limit it stopped at: it holds all the text a new
+    download with that limit, or a lower one, would read.
+    """
+    if cache is None:
+        return
+    if cached is not None:
+        cache.count("changed")
+    if reader.capped:
+        return
+    ttl = cache_ttl(response.headers)
+    # A page that must be revalidated is only worth keeping if it can be, with an ETag or Last-Modified
+    if ttl or (ttl == 0 and ("etag" in response.headers or "last-modified" in response.headers)):
+        cache.put(key, url, bytes(reader.body), response.headers, ttl, reader.text_chars if reader.truncated else 0)
+
+def _cached_text(page: CachedPage) -> str:
+    """Extract a cached page the way its download was extracted."""
+    if not page.truncated:
+        return extract_text(page.body, page.content_type)
+    extractor = TextExtractor(page.content_type)
+    extractor.feed(page.body)
+    return extractor.close(truncated=True)
+
+class _PageReader:
+    """Feeds a streamed response into the extractor until the page ends or enough has been read.
+
+    The content type is checked from the headers before any of the body is
+    read; unlabelled bodies are sniffed. Reading stops after FETCH_MAX_BYTES
+    or once text_chars of text have been extracted, so memory per fetch is
+    bounded however large the page is. Compressed bodies are decoded chunk
+    by chunk as they arrive.
+    """
+
+    def __init__(self, response: httpx.Response, text_chars: int = FETCH_TEXT_CHARS):
+        response.raise_for_status()
+        self.text_chars = text_chars
+        encoding = response.headers.get("content-encoding", "identity").strip().lower()
+        if encoding in ("gzip", "x-gzip", "deflate"):
+            # Accepts gzip and zlib streams; raw deflate is detected on the first chunk
+            self._decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+            self._raw_deflate = encoding == "deflate"
+        elif encoding in ("identity", ""):
+            self._decompressor = None
+        else:
+            raise UnsupportedContent(f"Skipped {encoding}-encoded content")
+        self.content_type = response.headers.get("content-type", "")
+        mime = self.content_type.split(";")[0].strip().lower()
+        if mime in HTML_TYPES or is_plain_text(mime):
+            self.extractor: Optional[TextExtractor] = TextExtractor(self.content_type)
+        elif mime in ("", "application/octet-stream"):
+            self.extractor = None
+        else:
+            raise UnsupportedContent(f"Skipped {mime} content")
+        self.body = bytearray()
+        self.truncated = False
+        self.capped = False
+
+    def _sniff(self, final: bool) -> bool:
+        """Start extracting an unlabelled body once it looks like HTML."""
+        if len(self.body) < HTML_SNIFF_BYTES and not final:
+            return False
+        if not HTML_SNIFF.match(bytes(self.body[:HTML_SNIFF_BYTES]).lstrip(b"\xef\xbb\xbf")):
+            raise UnsupportedContent("Skipped content that is not HTML")
+        self.extractor = TextExtractor("text/html")
+        self.extractor.feed(bytes(self.body))
+        return True
+
+    def _decode(self, raw: bytes) -> Iterator[bytes]:
+        if self._decompressor is None:
+            yield raw
+            return
+        while raw:
+            try:
+                piece = self._decompressor.decompress(raw, DECODE_CHUNK_BYTES)
+            except zlib.error:
+                if not self._raw_deflate:
+                    raise
+                self._decompressor, self._raw_deflate = zlib.decompressobj(-zlib.MAX_WBITS), False
+                continue
+            self._raw_deflate = False
+            yield piece
+            raw = self._decompressor.unconsumed_tail
+
+    def feed(self, raw: bytes) -> bool:
+        """Add a chunk of the raw body, returning True once no more needs to be read."""
+        for chunk in self._decode(raw):
+            if self._add(chunk):
+                return True
+        return False
+
+    def _add(self, chunk: bytes) -> bool:
+        chunk = chunk[:FETCH_MAX_BYTES - len(self.body)]
+        self.body += chunk
+        if self.extractor is None:
+            if not self._sniff(final=False):
+                return False
+        else:
+            self.extractor.feed(chunk)
+        self.capped = len(self.body) >= FETCH_MAX_BYTES
+        self.truncated = self.capped or self.extractor.ready_chars() >= self.text_chars
+        return self.truncated
+
+    def close(self) -> str:
+        if self.extractor is None:
+            self._sniff(final=True)
+        return self.extractor.close(truncated=self.truncated)
+
+class _SyncFetcher:
+    """Pooled client and worker threads shared by every sync search.
+
+    Concurrent requests for the same canonical URL share one future, so runs
+    searching at the same time download a page once. Pages of a domain
+    already fetching FETCH_PER_DOMAIN pages wait in a queue rather than in
+    a worker thread, so one slow site cannot tie up the whole pool.
+    """
+
+    def __init__(self):
+        self.client = httpx.Client(follow_redirects=True, timeout=_timeout(), limits=_limits(), headers=FETCH_HEADERS)
+        self.executor = ThreadPoolExecutor(max_workers=FETCH_MAX_CONCURRENCY, thread_name_prefix="page-fetch")
+        self._active: Dict[str, int] = {}
+        self._queued: Dict[str, Deque[Tuple[str, str, int, Future]]] = {}
+        self._in_flight: Dict[Tuple[str, int], Future] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, url: str, text_chars: int = FETCH_TEXT_CHARS) -> Future:
+        """Start fetching url, or join the download already in flight for it."""
+        key = canonical_url(url)
+        with self._lock:
+            future = self._in_flight.get((key, text_chars))
+            if future is not None:
+                shared = True
+            else:
+                shared = False
+                future = self._in_flight[key, text_chars] = Future()
+                self._queued.setdefault(_domain(url), deque()).append((url, key, text_chars, future))
+                self._dispatch(_domain(url))
+        if shared:
+            cache = get_page_cache()
+            if cache:
+                cache.count("shared")
+        else:
+            future.add_done_callback(lambda _: self._finish((key, text_chars), future))
+        return future
+
+    def _dispatch(self, domain: str):
+        # Called with the lock held: start the domain's queued fetches while it has free slots
+        queued = self._queued.get(domain)
+        while queued and self._active.get(domain, 0) < FETCH_PER_DOMAIN:
+            self._active[domain] = self._active.get(domain, 0) + 1
+            self.executor.submit(self._run, domain, *queued.popleft())
+        if not queued:
+            self._queued.pop(domain, None)
+
+    def _run(self, domain: str, url: str, key: str, text_chars: int, future: Future):
+        try:
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(self.fetch(url, key, text_chars))
+                except BaseException as e:
+                    future.set_exception(e)
+        finally:
+            with self._lock:
+                self._active[domain] -= 1
+                if not self._active[domain]:
+                    del self._active[domain]
+                self._dispatch(domain)
+
+    def _finish(self, flight: Tuple[str, int], future: Future):
+        with self._lock:
+            if self._in_flight.get(flight) is future:
+                del self._in_flight[flight]
+
+    def fetch(self, url: str, key: str, text_chars: int) -> str:
+        cache = get_page_cache()
+        cached = _lookup(cache, key, url, text_chars)
+        if cached is not None and cached.fresh:
+            return _cached_text(cached)
+        reader = None
+        started, error = time.perf_counter(), None
+        try:
+            with self.client.stream("GET", url, headers=cached.validators() if cached else None) as response:
+                if not _revalidated(cache, key, cached, response):
+                    reader = _PageReader(response, text_chars)
+                    for chunk in response.iter_raw():
+                        if reader.feed(chunk):
+                            break
+                    _save(cache, key, url, cached, response, reader)
+        except Exception as e:
+            error = e
+            if cached is None or isinstance(e, UnsupportedContent):
+                raise
+            # Serve the stale copy rather than nothing
+            reader = None
+        finally:
+            _stats.record(url, time.perf_counter() - started, _outcome(error), len(reader.body) if reader else 0)
+        if reader is None:
+            return _cached_text(cached)
+        return reader.close()
+
+class _AsyncFetcher:
+    """Pooled client and limits for one event loop; asyncio primitives cannot be shared across loops.
+
+    Concurrent requests for the same canonical URL and text limit share one
+    task, which is only cancelled once every search waiting on it has given up.
+    """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(follow_redirects=True, timeout=_timeout(), limits=_limits(), headers=FETCH_HEADERS)
+        self.slots = asyncio.Semaphore(FETCH_MAX_CONCURRENCY)
+        # lxml parsers must stay on the thread that created them, so streamed
+        # pages are read, from creating the parser to closing it, on one
+        # thread rather than wherever to_thread runs
+        self.extractor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-extract")
+        # Per-domain limits and the fetches holding or waiting on each; a
+        # domain's semaphore is dropped once no fetch uses it
+        self._domains: Dict[str, Tuple[asyncio.Semaphore, List[int]]] = {}
+        self._in_flight: Dict[Tuple[str, int], Tuple[asyncio.Future, List[int]]] = {}
+
+    def submit(self, url: str, text_chars: int = FETCH_TEXT_CHARS) -> asyncio.Future:
+        """Start fetching url, or join the download already in flight for it."""
+        key = canonical_url(url)
+        flight = (key, text_chars)
+        if flight in self._in_flight:
+            task, waiters = self._in_flight[flight]
+            waiters[0] += 1
+            cache = get_page_cache()
+            if cache:
+                cache.count("shared")
+            return task
+        task = asyncio.ensure_future(self.fetch(url, key, text_chars))
+        self._in_flight[flight] = (task, [1])
+        task.add_done_callback(lambda _: self._in_flight.pop(flight, None))
+        return task
+
+    def abandon(self, task: asyncio.Future):
+        """Stop waiting on a fetch, cancelling it if no other search still needs it."""
+        for in_flight, waiters in list(self._in_flight.values()):
+            if in_flight is task:
+                waiters[0] -= 1
+                if waiters[0] == 0:
+                    task.cancel()
+                return
+
+    @asynccontextmanager
+    async def _domain_slot(self, domain: str) -> AsyncIterator[None]:
+        if domain not in self._domains:
+            self._domains[domain] = (asyncio.Semaphore(FETCH_PER_DOMAIN), [0])
+        slot, users = self._domains[domain]
+        users[0] += 1
+        try:
+            async with slot:
+                yield
+        finally:
+            users[0] -= 1
+            if users[0] == 0:
+                del self._domains[domain]
+
+    async def fetch(self, url: str, key: str, text_chars: int) -> str:
+        cache = get_page_cache()
+        cached = await asyncio.to_thread(_lookup, cache, key, url, text_chars)
+        loop = asyncio.get_running_loop()
+        reader = None
+        if cached is None or not cached.fresh:
+            async with self.slots, self._domain_slot(_domain(url)):
+                started, error = time.perf_counter(), None
+                try:
+                    async with self.client.stream("GET", url, headers=cached.validators() if cached else None) as response:
+                        if not await asyncio.to_thread(_revalidated, cache, key, cached, response):
+                            reader = await loop.run_in_executor(self.extractor, _PageReader, response, text_chars)
+                            async for chunk in response.aiter_raw():
+                                # Parsing is CPU-bound, so keep it off the event loop
+                                if await loop.run_in_executor(self.extractor, reader.feed, chunk):
+                                    break
+                            await asyncio.to_thread(_save, cache, key, url, cached, response, reader)
+                except asyncio.CancelledError as e:
+                    error = e
+                    raise
+                except Exception as e:
+                    error = e
+                    if cached is None or isinstance(e, UnsupportedContent):
+                        raise
+                    # Serve the stale copy rather than nothing
+                    reader = None
+                finally:
+                    # A fetch cancelled at the deadline is logged as a timeout
+                    outcome = "timeout" if isinstance(error, asyncio.CancelledError) else _outcome(error)
+                    _stats.record(url, time.perf_counter() - started, outcome, len(reader.body) if reader else 0)
+        if reader is None:
+            return await asyncio.to_thread(_cached_text, cached)
+        return await loop.run_in_executor(self.extractor, reader.close)
+
+_sync_fetcher: Optional[_SyncFetcher] = None
+_sync_fetcher_lock = threading.Lock()
+_async_fetchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _AsyncFetcher]" = weakref.WeakKeyDictionary()
+
+def _get_sync_fetcher() -> _SyncFetcher:
+    global _sync_fetcher
+    with _sync_fetcher_lock:
+        if _sync_fetcher is None:
+            _sync_fetcher = _SyncFetcher()
+        return _sync_fetcher
+
+def _get_async_fetcher() -> _AsyncFetcher:
+    loop = asyncio.get_running_loop()
+    fetcher = _async_fetchers.get(loop)
+    if fetcher is None:
+        fetcher = _async_fetchers[loop] = _AsyncFetcher()
+    return fetcher
+
+def fetch_pages(urls: List[str], deadline: Optional[float] = None, text_chars: Optional[int] = None) -> Dict[str, str]:
+    """Fetch pages concurrently and return the text of those that arrive before the deadline.
+
+    Fetches share one pooled client and are capped at FETCH_MAX_CONCURRENCY
+    overall and FETCH_PER_DOMAIN per domain. Pages that fail, or are still
+    loading when the deadline passes, are left out so callers can fall back
+    to the search snippet.
+
+    Args:
+        urls (list): The pages to fetch
+        deadline (float, optional): Seconds to wait for all pages, defaults to FETCH_DEADLINE
+        text_chars (int, optional): Characters of text after which a page stops downloading, defaults to FETCH_TEXT_CHARS
+
+    Returns:
+        dict: Page text by URL for the pages that were fetched
+    """
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    fetcher = _get_sync_fetcher()
+    futures = {url: fetcher.submit(url, text_chars or FETCH_TEXT_CHARS) for url in urls}
+    done, _ = wait(set(futures.values()), timeout=FETCH_DEADLINE if deadline is None else deadline)
+
+    pages = {}
+    for url, future in futures.items():
+        if future not in done:
+            # The fetch finishes in the background, bounded by the read timeout,
+            # and still fills the page cache for the next search
+            print(f"Warning: Fetching {url} missed the deadline, using its snippet")
+            continue
+        try:
+            pages[url] = future.result()
+        except Exception as e:
+            print(f"Warning: Failed to fetch full page content for {url}: {str(e)}")
+    return pages
+
+async def afetch_pages(urls: List[str], deadline: Optional[float] = None, text_chars: Optional[int] = None) -> Dict[str, str]:
+    """Async version of fetch_pages; fetches still running at the deadline are cancelled unless another search is waiting on them."""
+    urls = list(dict.fromkeys(urls))
+    if not urls:
+        return {}
+    fetcher = _get_async_fetcher()
+    tasks = {url: fetcher.submit(url, text_chars or FETCH_TEXT_CHARS) for url in urls}
+    done, _ = await asyncio.wait(set(tasks.values()), timeout=FETCH_DEADLINE if deadline is None else deadline)
+
+    pages = {}
+    for url, task in tasks.items():
+        if task not in done:
+            fetcher.abandon(task)
+            print(f"Warning: Fetching {url} missed the deadline, using its snippet")
+            continue
+        try:
+            pages[url] = task.result()
+        except Exception as e:
+            print(f"Warning: Failed to fetch full page content for {url}: {str(e)}")
+    return pages
+
+def fetch_stats() -> Dict[str, Dict[str, Any]]:
+    """Report fetch count, errors, timeouts and average and max latency per domain, slowest first."""
+    return _stats.report()
@@ -1,95 +1,459 @@
+import asyncio
+import functools
 import json
+import re
+import time
+from typing import Optional, Union
 
 from typing_extensions import Literal
 
 from langchain_core.messages import HumanMessage, SystemMessage
-from langchain_core.runnables import RunnableConfig
-from langchain_ollama import ChatOllama
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph import START, END, StateGraph
+from langgraph.types import Send
 
+from assistant.backends import get_backend_pool, parse_base_urls
+from assistant.checkpoint import get_checkpointer
 from assistant.configuration import Configuration, SearchAPI
-from assistant.utils import deduplicate_and_format_sources, tavily_search, format_sources, perplexity_search, duckduckgo_search
-from assistant.state import SummaryState, SummaryStateInput, SummaryStateOutput
-from assistant.prompts import query_writer_instructions, summarizer_instructions, reflection_instructions
-
-# Nodes
-def generate_query(state: SummaryState, config: RunnableConfig):
-    """ Generate a query for web search """
-
-    # Format the prompt
-    query_writer_instructions_formatted = query_writer_instructions.format(research_topic=state.research_topic)
-
-    # Generate a query
-    configurable = Configuration.from_runnable_config(config)
-    llm_json_mode = ChatOllama(base_url=configurable.ollama_base_url, model=configurable.local_llm, temperature=0, format="json")
-    result = llm_json_mode.invoke(
-        [SystemMessage(content=query_writer_instructions_formatted),
-        HumanMessage(content=f"Generate a query for web search:")]
-    )
-    query = json.loads(result.content)
-
-    return {"search_query": query['query']}
-
-def web_research(state: SummaryState, config: RunnableConfig):
-    """ Gather information from the web """
-
-    # Configure
-    configurable = Configuration.from_runnable_config(config)
+from assistant.hedge import ameasured, ahedged_search, hedged_search, measured
+from assistant.llm import get_balanced_chat_model, stream_to_message, astream_to_message, stream_json, astream_json, llm_call_stats, prompt_cache_report, json_early_exit_report
+from assistant.utils import deduplicate_and_format_sources, tavily_search, format_sources, perplexity_search, duckduckgo_search, atavily_search, aperplexity_search, aduckduckgo_search, local_search, alocal_search, content_shingles, summary_change, split_summary_sections, render_summary_sections, summary_outline, select_related_sections, apply_summary_patch, parse_json_object, novel_sources
+from assistant.search_guard import SearchUnavailable
+from assistant.tokens import CHARS_PER_TOKEN, acontext_window, context_window, get_tokenizer
+from assistant.state import SummaryState, SummaryStateInput, SummaryStateOutput, SearchBranchState
+from assistant.prompts import research_context_instructions, query_writer_instructions, multi_query_writer_instructions, summarizer_instructions, incremental_summarizer_instructions, reflection_instructions, multi_reflection_instructions, draft_follow_up_instructions, query_writer_schema, multi_query_writer_schema, reflection_schema, multi_reflection_schema
+
+# Helpers
+def get_search_api(configurable: Configuration) -> str:
+    """ Get the name of the configured search API """
 
     # Handle both cases for search_api:
     # 1. When selected in Studio UI -> returns a string (e.g. "tavily")
     # 2. When using default -> returns an Enum (e.g. SearchAPI.TAVILY)
     if isinstance(configurable.search_api, str):
-        search_api = configurable.search_api
-    else:
-        search_api = configurable.search_api.value
+        return configurable.search_api
+    return configurable.search_api.value
+
+def provider_search(search_api: str, query: str, research_loop_count: int, configurable: Configuration):
+    """ Run a query against one search API, returning the results and whether they carry raw content """
 
-    # Search the web
     if search_api == "tavily":
-        search_results = tavily_search(state.search_query, include_raw_content=True, max_results=1)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, include_raw_content=True)
+        return tavily_search(query, include_raw_content=True, max_results=1), True
     elif search_api == "perplexity":
-        search_results = perplexity_search(state.search_query, state.research_loop_count)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, include_raw_content=False)
+        return perplexity_search(query, research_loop_count), False
     elif search_api == "duckduckgo":
-        search_results = duckduckgo_search(state.search_query, max_results=3, fetch_full_page=configurable.fetch_full_page)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, include_raw_content=True)
+        text_chars = None
+        if configurable.fetch_full_page:
+            model, endpoint = summary_endpoint(SummaryState(), configurable)
+            text_chars = page_text_chars(configurable, context_window(endpoint, model, configurable.ollama_num_ctx))
+        return duckduckgo_search(query, max_results=3, fetch_full_page=configurable.fetch_full_page, text_chars=text_chars), True
+    elif search_api == "local":
+        return local_search(query, configurable.local_search_dir, max_results=3), True
     else:
         raise ValueError(f"Unsupported search API: {configurable.search_api}")
 
-    return {"sources_gathered": [format_sources(search_results)], "research_loop_count": state.research_loop_count + 1, "web_research_results": [search_str]}
+async def aprovider_search(search_api: str, query: str, research_loop_count: int, configurable: Configuration):
+    """ Async version of provider_search """
 
-def summarize_sources(state: SummaryState, config: RunnableConfig):
-    """ Summarize the gathered sources """
+    if search_api == "tavily":
+        return await atavily_search(query, include_raw_content=True, max_results=1), True
+    elif search_api == "perplexity":
+        return await aperplexity_search(query, research_loop_count), False
+    elif search_api == "duckduckgo":
+        text_chars = None
+        if configurable.fetch_full_page:
+            text_chars = page_text_chars(configurable, await asummary_context_window(SummaryState(), configurable))
+        return await aduckduckgo_search(query, max_results=3, fetch_full_page=configurable.fetch_full_page, text_chars=text_chars), True
+    elif search_api == "local":
+        return await alocal_search(query, configurable.local_search_dir, max_results=3), True
+    else:
+        raise ValueError(f"Unsupported search API: {configurable.search_api}")
 
-    # Existing summary
-    existing_summary = state.running_summary
+def search(search_api: str, query: str, research_loop_count: int, configurable: Configuration):
+    """ Run a query against the search API, hedged with hedge_search_api when the search API is slow or finds nothing """
+
+    secondary = configurable.hedge_search_api
+    try:
+        if not secondary or secondary == search_api:
+            return measured(search_api, lambda: provider_search(search_api, query, research_loop_count, configurable))
+        return hedged_search(search_api, lambda: provider_search(search_api, query, research_loop_count, configurable),
+                             secondary, lambda: provider_search(secondary, query, research_loop_count, configurable),
+                             configurable.hedge_delay, configurable.hedge_merge_window)
+    except SearchUnavailable as e:
+        # The provider is rate limited or down: carry on with what the summary has so far
+        print(f"Warning: search skipped: {e}")
+        return {"results": []}, False
+
+async def asearch(search_api: str, query: str, research_loop_count: int, configurable: Configuration):
+    """ Async version of search """
+
+    secondary = configurable.hedge_search_api
+    try:
+        if not secondary or secondary == search_api:
+            return await ameasured(search_api, lambda: aprovider_search(search_api, query, research_loop_count, configurable))
+        return await ahedged_search(search_api, lambda: aprovider_search(search_api, query, research_loop_count, configurable),
+                                    secondary, lambda: aprovider_search(secondary, query, research_loop_count, configurable),
+                                    configurable.hedge_delay, configurable.hedge_merge_window)
+    except SearchUnavailable as e:
+        print(f"Warning: search skipped: {e}")
+        return {"results": []}, False
+
+def ollama_backends(configurable: Configuration) -> list:
+    """ The Ollama endpoints to balance across: ollama_base_urls if set, else ollama_base_url """
+
+    return parse_base_urls(configurable.ollama_base_urls) or [configurable.ollama_base_url]
+
+def route_backend(state: SummaryState, configurable: Configuration) -> str:
+    """ Keep the run on the backend it started on while it is healthy, else move it to the least loaded one """
+
+    return get_backend_pool(ollama_backends(configurable)).choose(state.ollama_backend)
+
+# The model settings each LLM node uses; drafting a follow-up is a reflection task
+NODE_MODEL_ROLES = {
+    "generate_query": "query",
+    "summarize_sources": "summary",
+    "draft_follow_up": "reflection",
+    "reflect_on_summary": "reflection",
+}
+
+def node_model(configurable: Configuration, node: str) -> tuple:
+    """ The model and base URL override for a node, falling back to local_llm and the run's backends """
+
+    role = NODE_MODEL_ROLES[node]
+    return getattr(configurable, f"{role}_model") or configurable.local_llm, getattr(configurable, f"{role}_base_url")
+
+# Tokens kept free for the summary the summarizer writes
+SUMMARY_OUTPUT_TOKENS = 1024
+# Share of the context window left unused, for the chat template and tokenizer differences
+PROMPT_MARGIN = 0.05
+# Tokens of search results sent even when the rest of the prompt fills the context
+MIN_SOURCE_TOKENS = 512
+# Full pages are read this many times further when passage reranking picks
+# passages from the whole page rather than only its top
+PAGE_RERANK_READ_FACTOR = 4
+
+def chat_model(configurable: Configuration, node: str, backend: Optional[str] = None, format: Union[str, dict, None] = None):
+    """ Get the shared Ollama client for the node's model on the run's backend, kept loaded for the rest of the run """
+
+    model, base_url = node_model(configurable, node)
+
+    # A node with its own endpoints is balanced across those, outside the run's backend affinity
+    if base_url:
+        return get_balanced_chat_model(parse_base_urls(base_url), model, format=format, keep_alive=configurable.ollama_keep_alive,
+                                       num_ctx=configurable.ollama_num_ctx or None)
+    return get_balanced_chat_model(ollama_backends(configurable), model, preferred=backend, format=format,
+                                   keep_alive=configurable.ollama_keep_alive, num_ctx=configurable.ollama_num_ctx or None)
+
+def timed(node: str, func):
+    """ Wrap a node so its update records how long the node took """
+
+    def timing_update(update: Optional[dict], started: float) -> dict:
+        update = dict(update or {})
+        update["node_timings"] = [{"node": node, "seconds": round(time.perf_counter() - started, 3)}]
+        return update
+
+    if asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def awrapper(state, config: RunnableConfig):
+            started = time.perf_counter()
+            return timing_update(await func(state, config), started)
+        return awrapper
+
+    @functools.wraps(func)
+    def wrapper(state, config: RunnableConfig):
+        started = time.perf_counter()
+        return timing_update(func(state, config), started)
+    return wrapper
+
+def node_latency_report(node_timings: list, configurable: Configuration) -> dict:
+    """ Per-node call count and wall-clock latency, with the model each LLM node used """
+
+    report = {}
+    for timing in node_timings:
+        node = report.setdefault(timing["node"], {"calls": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+        node["calls"] += 1
+        node["total_seconds"] = round(node["total_seconds"] + timing["seconds"], 3)
+        node["max_seconds"] = max(node["max_seconds"], timing["seconds"])
+    for name, node in report.items():
+        node["avg_seconds"] = round(node["total_seconds"] / node["calls"], 3)
+        if name in NODE_MODEL_ROLES:
+            node["model"] = node_model(configurable, name)[0]
+    return report
+
+def research_messages(state: SummaryState, configurable: Configuration, *task: str) -> list:
+    """ Lay out a prompt as the shared topic message, then the existing summary, then the node's task
+
+    Everything before the task is byte-identical for all calls in a run that see
+    the same summary, e.g. reflection and the next loop's summarizer, so Ollama
+    can serve that prefix from its prompt cache.
+    """
+
+    messages = [SystemMessage(content=research_context_instructions.format(research_topic=state.research_topic))]
+    summary = summary_context(state, configurable)
+    if summary:
+        messages.append(HumanMessage(content=f"<Existing Summary> \n {summary} \n <Existing Summary>"))
+    messages.extend(HumanMessage(content=content) for content in task)
+    return messages
+
+def json_output(configurable: Configuration, schema: dict, key: str) -> tuple:
+    """ The Ollama format for a structured call, the schema where enabled and plain JSON mode otherwise, and the keys it needs """
+
+    return (schema if configurable.ollama_json_schema else "json"), [key]
+
+def query_writer_output(configurable: Configuration) -> tuple:
+    """ The format and needed keys for the query writer """
+
+    if configurable.num_parallel_queries > 1:
+        return json_output(configurable, multi_query_writer_schema, "queries")
+    return json_output(configurable, query_writer_schema, "query")
+
+def reflection_output(configurable: Configuration) -> tuple:
+    """ The format and needed keys for reflection """
+
+    if configurable.num_parallel_queries > 1:
+        return json_output(configurable, multi_reflection_schema, "follow_up_queries")
+    return json_output(configurable, reflection_schema, "follow_up_query")
+
+def parse_queries(queries, fallback: str, number_of_queries: int) -> list:
+    """ Keep up to number_of_queries non-empty query strings from the LLM output """
+
+    if not isinstance(queries, list):
+        queries = []
+    queries = [query.strip() for query in queries if isinstance(query, str) and query.strip()]
+    return queries[:number_of_queries] or [fallback]
+
+def query_writer_messages(state: SummaryState, configurable: Configuration) -> list:
+    """ Build the messages for the query writer """
+
+    # Generate several queries in one call when searching in parallel
+    if configurable.num_parallel_queries > 1:
+        return research_messages(state, configurable,
+                                 multi_query_writer_instructions.format(number_of_queries=configurable.num_parallel_queries),
+                                 f"Generate {configurable.num_parallel_queries} queries for web search:")
 
-    # Most recent web research
+    # Format the prompt
+    query_writer_instructions_formatted = query_writer_instructions.format()
+    return research_messages(state, configurable, query_writer_instructions_formatted, f"Generate a query for web search:")
+
+def parse_query_writer_output(content: str, state: SummaryState, configurable: Configuration) -> dict:
+    """ Turn the query writer's JSON output into a state update """
+
+    # Malformed output falls back to searching for the topic itself
+    query = parse_json_object(content)
+    if configurable.num_parallel_queries > 1:
+        queries = parse_queries(query.get('queries'), state.research_topic, configurable.num_parallel_queries)
+        return {"search_query": queries[0], "search_queries": queries}
+
+    return {"search_query": parse_queries([query.get('query')], state.research_topic, 1)[0]}
+
+def summary_endpoint(state: SummaryState, configurable: Configuration) -> tuple:
+    """ The summary model and the Ollama server it runs on """
+
+    model, base_url = node_model(configurable, "summarize_sources")
+    return model, parse_base_urls(base_url)[0] if base_url else (state.ollama_backend or ollama_backends(configurable)[0])
+
+async def asummary_context_window(state: SummaryState, configurable: Configuration) -> int:
+    """ The summary model's context window, looked up without blocking the event loop """
+
+    model, endpoint = summary_endpoint(state, configurable)
+    return await acontext_window(endpoint, model, configurable.ollama_num_ctx)
+
+def page_text_chars(configurable: Configuration, window: int) -> int:
+    """ Characters of text to read from each full page a search fetches
+
+    A search returns up to three sources, and the sources share a budget
+    smaller than the summary model's context window, so none is given more
+    than about a third of it. Pages are read that far, with half as much
+    again for boilerplate the extractor removes. Without passage_rerank only
+    a page's top is sent, so reading further is wasted; with it, BM25 ranks
+    passages from the whole page, so pages are read PAGE_RERANK_READ_FACTOR
+    times further. FETCH_MAX_BYTES still bounds each download.
+    """
+
+    chars = window // 3 * CHARS_PER_TOKEN * 3 // 2
+    return chars * PAGE_RERANK_READ_FACTOR if configurable.passage_rerank else chars
+
+def source_token_budget(state: SummaryState, configurable: Configuration, window: Optional[int] = None) -> tuple:
+    """ The tokens the summarizer's context leaves for search results, and the tokenizer to count them with
+
+    The budget is the summary model's context window less the rest of the
+    summarizer prompt, room for the summary it writes and a margin for the
+    chat template and tokenizer differences. Async nodes pass the window,
+    from asummary_context_window, so it is not looked up synchronously.
+    """
+
+    model, endpoint = summary_endpoint(state, configurable)
+    if window is None:
+        window = context_window(endpoint, model, configurable.ollama_num_ctx)
+    tokenizer = get_tokenizer(model)
+
+    # An incremental update sends related paragraphs on top of the outline, and may fall back to a full rewrite
+    instructions = max(summarizer_instructions, incremental_summarizer_instructions, key=len)
+    messages = research_messages(state, configurable, instructions, "<New Search Results> \n  \n <New Search Results>")
+    prompt_tokens = sum(tokenizer.count(message.content) for message in messages)
+    if configurable.incremental_summary and state.summary_sections:
+        prompt_tokens += tokenizer.count(state.running_summary)
+
+    budget = int(window * (1 - PROMPT_MARGIN)) - prompt_tokens - SUMMARY_OUTPUT_TOKENS
+    return max(budget, MIN_SOURCE_TOKENS), tokenizer
+
+def web_research_update(state: SummaryState, search_results: dict, include_raw_content: bool, configurable: Configuration,
+                        window: Optional[int] = None) -> dict:
+    """ Turn the results of a single search into a state update """
+
+    # Sources summarized by an earlier loop, under any URL, are not sent again
+    novel_results, registry_entries = search_results["results"], []
+    if configurable.source_dedup_distance >= 0:
+        novel_results, registry_entries = novel_sources(search_results["results"], state.source_registry, configurable.source_dedup_distance)
+
+    if novel_results or not search_results["results"]:
+        token_budget, tokenizer = source_token_budget(state, configurable, window)
+        query = " ".join(state.search_queries or [state.search_query or ""]) if configurable.passage_rerank else None
+        search_str = deduplicate_and_format_sources({"results": novel_results}, include_raw_content=include_raw_content,
+                                                    token_budget=token_budget, tokenizer=tokenizer, query=query,
+                                                    topic=state.research_topic or "", max_passages=configurable.rerank_max_passages)
+    else:
+        search_str = "Sources:\n\nEvery source found repeats one from an earlier search."
+    update = {"sources_gathered": [format_sources(search_results)], "research_loop_count": state.research_loop_count + 1,
+              "web_research_results": [search_str], "source_registry": registry_entries}
+    update.update(source_novelty_update(state, search_results, configurable))
+    update["source_novelty"][0]["duplicate_sources"] = len(search_results["results"]) - len(novel_results)
+    return update
+
+def source_novelty_update(state: SummaryState, search_results: dict, configurable: Configuration) -> dict:
+    """ Measure how many of this loop's URLs, and how much of its content, earlier loops had not seen """
+
+    urls = list(dict.fromkeys(source["url"] for source in search_results["results"]))
+    seen_urls = set(state.seen_urls)
+    new_urls = [url for url in urls if url not in seen_urls]
+    novelty = {"loop": state.research_loop_count + 1, "new_source_fraction": round(len(new_urls) / len(urls), 3) if urls else 0.0}
+    update = {"seen_urls": new_urls, "source_novelty": [novelty]}
+
+    # Content shingles are only kept in state when the content check is enabled
+    if configurable.min_new_content_fraction > 0:
+        shingles = set()
+        for source in search_results["results"]:
+            shingles |= content_shingles(f"{source.get('content') or ''} {source.get('raw_content') or ''}")
+        new_shingles = shingles - set(state.content_shingles)
+        novelty["new_content_fraction"] = round(len(new_shingles) / len(shingles), 3) if shingles else 0.0
+        update["content_shingles"] = sorted(new_shingles)
+    return update
+
+def summary_change_update(state: SummaryState, running_summary: str) -> dict:
+    """ Record the summary update and how much it changed the previous summary """
+
+    update = {"running_summary": running_summary}
+    if state.running_summary:
+        update["summary_changes"] = [{"loop": state.research_loop_count, "summary_change": round(summary_change(state.running_summary, running_summary), 3)}]
+    return update
+
+def check_convergence(state: SummaryState, configurable: Configuration) -> Optional[str]:
+    """ Return the reason to stop early if the latest loop added too little, otherwise None """
+
+    # The first loop has nothing to be compared against
+    if state.research_loop_count <= 1 or not state.source_novelty:
+        return None
+
+    novelty = state.source_novelty[-1]
+    if novelty["new_source_fraction"] < configurable.min_new_source_fraction:
+        return f"Only {novelty['new_source_fraction']:.0%} of the sources in loop {novelty['loop']} were new (minimum {configurable.min_new_source_fraction:.0%})"
+    if novelty.get("new_content_fraction", 1.0) < configurable.min_new_content_fraction:
+        return f"Only {novelty['new_content_fraction']:.0%} of the content in loop {novelty['loop']} was new (minimum {configurable.min_new_content_fraction:.0%})"
+
+    if state.summary_changes and state.summary_changes[-1]["loop"] == state.research_loop_count:
+        change = state.summary_changes[-1]["summary_change"]
+        if change < configurable.min_summary_change:
+            return f"The summary changed by only {change:.0%} in loop {state.research_loop_count} (minimum {configurable.min_summary_change:.0%})"
+    return None
+
+def early_stop_update(state: SummaryState, configurable: Configuration) -> Optional[dict]:
+    """ Stop the research early, skipping reflection, when another loop would add too little """
+
+    if state.research_loop_count > configurable.max_web_research_loops:
+        return None
+    stop_reason = check_convergence(state, configurable)
+    if not stop_reason:
+        return None
+    return {"stop_reason": stop_reason, "loops_saved": configurable.max_web_research_loops + 1 - state.research_loop_count}
+
+def search_branch_update(state: SearchBranchState, search_results: dict, include_raw_content: bool, started: float, finished: float) -> dict:
+    """ Record the results and timing of a parallel search branch """
+
+    return {"search_branch_results": [{
+        "research_loop_count": state["research_loop_count"],
+        "search_query": state["search_query"],
+        "search_results": search_results,
+        "include_raw_content": include_raw_content,
+        "started": started,
+        "finished": finished,
+    }], "search_calls": 1, "search_cache_hits": int(search_results.get("cached", False)), "search_hedges": int(search_results.get("hedged", False))}
+
+def summarizer_messages(state: SummaryState, configurable: Configuration) -> list:
+    """ Build the messages for the summarizer """
+
+    # Most recent web research, sent last as it changes on every call
     most_recent_web_research = state.web_research_results[-1]
 
-    # Build the human message
-    if existing_summary:
-        human_message_content = (
-            f"<User Input> \n {state.research_topic} \n <User Input>\n\n"
-            f"<Existing Summary> \n {existing_summary} \n <Existing Summary>\n\n"
-            f"<New Search Results> \n {most_recent_web_research} \n <New Search Results>"
-        )
+    # The existing summary is part of the stable prefix built by research_messages
+    if state.running_summary:
+        search_results = f"<New Search Results> \n {most_recent_web_research} \n <New Search Results>"
     else:
-        human_message_content = (
-            f"<User Input> \n {state.research_topic} \n <User Input>\n\n"
-            f"<Search Results> \n {most_recent_web_research} \n <Search Results>"
-        )
+        search_results = f"<Search Results> \n {most_recent_web_research} \n <Search Results>"
 
-    # Run the LLM
-    configurable = Configuration.from_runnable_config(config)
-    llm = ChatOllama(base_url=configurable.ollama_base_url, model=configurable.local_llm, temperature=0)
-    result = llm.invoke(
-        [SystemMessage(content=summarizer_instructions),
-        HumanMessage(content=human_message_content)]
+    return research_messages(state, configurable, summarizer_instructions, search_results)
+
+def incremental_summarizer_messages(state: SummaryState, configurable: Configuration):
+    """ Build the messages for patching the summary, returning them with the IDs of the sections sent in full """
+
+    # Most recent web research
+    most_recent_web_research = state.web_research_results[-1]
+
+    # Only the sections most related to the new results are sent in full, the rest as an outline
+    related_sections = select_related_sections(state.summary_sections, most_recent_web_research, configurable.summary_context_sections)
+    related_text = "\n\n".join(f"[{section['id']}] {section['text']}" for section in related_sections)
+    human_message_content = (
+        f"<Related Paragraphs> \n {related_text} \n <Related Paragraphs>\n\n"
+        f"<New Search Results> \n {most_recent_web_research} \n <New Search Results>"
     )
 
-    running_summary = result.content
+    # The outline is sent as the existing summary by research_messages
+    messages = research_messages(state, configurable, incremental_summarizer_instructions, human_message_content)
+    return messages, {section["id"] for section in related_sections}
+
+def parse_summary_patch(content: str) -> Optional[dict]:
+    """ Parse the summary patch, or return None if the output is not a JSON object """
+
+    try:
+        patch = json.loads(strip_thinking_tokens(content))
+    except json.JSONDecodeError:
+        return None
+    return patch if isinstance(patch, dict) else None
+
+def summary_sections_update(state: SummaryState, sections: list) -> dict:
+    """ Record the patched sections and the summary rebuilt from them """
+
+    update = summary_change_update(state, render_summary_sections(sections))
+    update["summary_sections"] = sections
+    return update
+
+def full_summary_update(state: SummaryState, running_summary: str, configurable: Configuration) -> dict:
+    """ Record a fully rewritten summary, splitting it into sections for later incremental updates """
+
+    update = summary_change_update(state, strip_thinking_tokens(running_summary))
+    if configurable.incremental_summary:
+        update["summary_sections"] = split_summary_sections(update["running_summary"])
+    return update
+
+def summary_context(state: SummaryState, configurable: Configuration) -> Optional[str]:
+    """ The existing summary as sent to the LLM: the outline when updating incrementally """
+
+    if configurable.incremental_summary and state.summary_sections:
+        return summary_outline(state.summary_sections)
+    return state.running_summary
+
+def strip_thinking_tokens(running_summary: str) -> str:
+    """ Remove <think> blocks from the summary """
 
     # TODO: This is a hack to remove the <think> tags w/ Deepseek models
     # It appears very challenging to prompt them out of the responses
@@ -97,64 +461,443 @@ def summarize_sources(state: SummaryState, config: RunnableConfig):
         start = running_summary.find("<think>")
         end = running_summary.find("</think>") + len("</think>")
         running_summary = running_summary[:start] + running_summary[end:]
+    return running_summary
 
-    return {"running_summary": running_summary}
+def reflection_messages(state: SummaryState, configurable: Configuration) -> list:
+    """ Build the messages for reflecting on the summary """
 
-def reflect_on_summary(state: SummaryState, config: RunnableConfig):
-    """ Reflect on the summary and generate a follow-up query """
+    # Generate several follow-up queries in one call when searching in parallel
+    if configurable.num_parallel_queries > 1:
+        return research_messages(state, configurable,
+                                 multi_reflection_instructions.format(number_of_queries=configurable.num_parallel_queries),
+                                 f"Identify knowledge gaps and generate {configurable.num_parallel_queries} follow-up web search queries based on the existing summary.")
 
-    # Generate a query
-    configurable = Configuration.from_runnable_config(config)
-    llm_json_mode = ChatOllama(base_url=configurable.ollama_base_url, model=configurable.local_llm, temperature=0, format="json")
-    result = llm_json_mode.invoke(
-        [SystemMessage(content=reflection_instructions.format(research_topic=state.research_topic)),
-        HumanMessage(content=f"Identify a knowledge gap and generate a follow-up web search query based on our existing knowledge: {state.running_summary}")]
-    )
-    follow_up_query = json.loads(result.content)
+    return research_messages(state, configurable,
+                             reflection_instructions.format(),
+                             f"Identify a knowledge gap and generate a follow-up web search query based on the existing summary.")
+
+def parse_reflection_output(content: str, state: SummaryState, configurable: Configuration) -> dict:
+    """ Turn the reflection's JSON output into a state update """
+
+    follow_up_query = parse_json_object(content)
+    if configurable.num_parallel_queries > 1:
+        queries = parse_queries(follow_up_query.get('follow_up_queries'), f"Tell me more about {state.research_topic}", configurable.num_parallel_queries)
+        return {"search_query": queries[0], "search_queries": queries}
 
     # Get the follow-up query
     query = follow_up_query.get('follow_up_query')
 
     # JSON mode can fail in some cases
-    if not query:
+    if not isinstance(query, str) or not query.strip():
 
         # Fallback to a placeholder query
-        return {"search_query": f"Tell me more about {state.research_topic}"}
+        return {"search_query": f"Tell me more about {state.research_topic}", "search_queries": []}
 
     # Update search query with follow-up query
-    return {"search_query": follow_up_query['follow_up_query']}
+    return {"search_query": query, "search_queries": []}
+
+def query_similarity(query: str, other_query: str) -> float:
+    """ Jaccard similarity of the lowercase words in two queries """
+
+    words, other_words = set(re.findall(r"\w+", query.lower())), set(re.findall(r"\w+", other_query.lower()))
+    if not words or not other_words:
+        return 0.0
+    return len(words & other_words) / len(words | other_words)
+
+def should_draft_follow_up(state: SummaryState, configurable: Configuration) -> bool:
+    """ Whether to draft and prefetch the next query, which only pays off if another loop will run """
+
+    return configurable.speculative_prefetch and configurable.num_parallel_queries <= 1 and state.research_loop_count <= configurable.max_web_research_loops
+
+def draft_follow_up_messages(state: SummaryState, configurable: Configuration) -> list:
+    """ Build the messages for drafting the follow-up query from the raw search results """
+
+    # Shares its prefix with the summarizer running at the same time
+    return research_messages(state, configurable,
+                             draft_follow_up_instructions.format(),
+                             f"<New Search Results> \n {state.web_research_results[-1]} \n <New Search Results>")
+
+def speculative_update(state: SummaryState, draft_query: str, search_results: dict, include_raw_content: bool, search_seconds: float) -> dict:
+    """ Record results prefetched for the drafted query """
+
+    return {"speculative_results": {
+        "research_loop_count": state.research_loop_count,
+        "search_query": draft_query,
+        "search_results": search_results,
+        "include_raw_content": include_raw_content,
+        "search_seconds": search_seconds,
+    }, "search_calls": 1, "search_cache_hits": int(search_results.get("cached", False)), "search_hedges": int(search_results.get("hedged", False))}
+
+def take_prefetched_results(state: SummaryState, configurable: Configuration):
+    """ Return the prefetched results if their draft query is close to the current query, plus the hit/miss record """
+
+    speculative = state.speculative_results
+    if not speculative or speculative["research_loop_count"] != state.research_loop_count:
+        return None, []
+
+    similarity = query_similarity(speculative["search_query"], state.search_query)
+    hit = similarity >= configurable.speculation_similarity_threshold
+    stats = [{
+        "loop": state.research_loop_count,
+        "draft_query": speculative["search_query"],
+        "search_query": state.search_query,
+        "similarity": round(similarity, 3),
+        "hit": hit,
+        "seconds_saved": round(speculative["search_seconds"], 3) if hit else 0.0,
+    }]
+    return (speculative if hit else None), stats
 
-def finalize_summary(state: SummaryState):
+# Nodes
+# Each node that waits on Ollama or a search API has an async twin, used
+# when the graph is driven by ainvoke/astream so runs don't hold a thread
+def generate_query(state: SummaryState, config: RunnableConfig):
+    """ Generate a query for web search """
+
+    # Generate a query
+    configurable = Configuration.from_runnable_config(config)
+    backend = route_backend(state, configurable)
+    format, keys = query_writer_output(configurable)
+    llm_json_mode = chat_model(configurable, "generate_query", backend, format=format)
+    messages = query_writer_messages(state, configurable)
+    result = stream_json(llm_json_mode, messages, keys, "generate_query", early_exit=configurable.json_early_exit)
+    update = parse_query_writer_output(result.content, state, configurable)
+    update["llm_calls"] = [llm_call_stats("generate_query", messages, result)]
+    update["ollama_backend"] = backend
+    return update
+
+async def agenerate_query(state: SummaryState, config: RunnableConfig):
+    """ Generate a query for web search """
+
+    configurable = Configuration.from_runnable_config(config)
+    backend = route_backend(state, configurable)
+    format, keys = query_writer_output(configurable)
+    llm_json_mode = chat_model(configurable, "generate_query", backend, format=format)
+    messages = query_writer_messages(state, configurable)
+    result = await astream_json(llm_json_mode, messages, keys, "generate_query", early_exit=configurable.json_early_exit)
+    update = parse_query_writer_output(result.content, state, configurable)
+    update["llm_calls"] = [llm_call_stats("generate_query", messages, result)]
+    update["ollama_backend"] = backend
+    return update
+
+def web_research(state: SummaryState, config: RunnableConfig):
+    """ Gather information from the web """
+
+    # Configure
+    configurable = Configuration.from_runnable_config(config)
+
+    # Use the results prefetched for the drafted query when it matches, otherwise search the web
+    prefetched, speculation_stats = take_prefetched_results(state, configurable)
+    if prefetched:
+        search_results, include_raw_content = prefetched["search_results"], prefetched["include_raw_content"]
+    else:
+        search_results, include_raw_content = search(get_search_api(configurable), state.search_query, state.research_loop_count, configurable)
+
+    update = web_research_update(state, search_results, include_raw_content, configurable)
+    update["speculation_stats"] = speculation_stats
+    update["search_calls"] = 0 if prefetched else 1
+    update["search_cache_hits"] = 0 if prefetched else int(search_results.get("cached", False))
+    update["search_hedges"] = 0 if prefetched else int(search_results.get("hedged", False))
+    return update
+
+async def aweb_research(state: SummaryState, config: RunnableConfig):
+    """ Gather information from the web """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    prefetched, speculation_stats = take_prefetched_results(state, configurable)
+    if prefetched:
+        search_results, include_raw_content = prefetched["search_results"], prefetched["include_raw_content"]
+    else:
+        search_results, include_raw_content = await asearch(get_search_api(configurable), state.search_query, state.research_loop_count, configurable)
+
+    window = await asummary_context_window(state, configurable)
+    update = web_research_update(state, search_results, include_raw_content, configurable, window)
+    update["speculation_stats"] = speculation_stats
+    update["search_calls"] = 0 if prefetched else 1
+    update["search_cache_hits"] = 0 if prefetched else int(search_results.get("cached", False))
+    update["search_hedges"] = 0 if prefetched else int(search_results.get("hedged", False))
+    return update
+
+def search_branch(state: SearchBranchState, config: RunnableConfig):
+    """ Run one of the queries fanned out in parallel """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    started = time.time()
+    search_results, include_raw_content = search(get_search_api(configurable), state["search_query"], state["research_loop_count"], configurable)
+    return search_branch_update(state, search_results, include_raw_content, started, time.time())
+
+async def asearch_branch(state: SearchBranchState, config: RunnableConfig):
+    """ Run one of the queries fanned out in parallel """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    started = time.time()
+    search_results, include_raw_content = await asearch(get_search_api(configurable), state["search_query"], state["research_loop_count"], configurable)
+    return search_branch_update(state, search_results, include_raw_content, started, time.time())
+
+def merge_search_results(state: SummaryState, config: RunnableConfig):
+    """ Merge the results of the parallel searches into this loop's web research """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    branches = [branch for branch in state.search_branch_results if branch["research_loop_count"] == state.research_loop_count]
+
+    # Sources found by more than one query are only kept once
+    unique_results = {}
+    for branch in branches:
+        for result in branch["search_results"]["results"]:
+            unique_results.setdefault(result["url"], result)
+    search_results = {"results": list(unique_results.values())}
+    include_raw_content = all(branch["include_raw_content"] for branch in branches)
+    update = web_research_update(state, search_results, include_raw_content, configurable)
+    # The raw results are not needed once merged; only their timings are kept, in search_timings
+    update["search_branch_results"] = None
+
+    # Compare the fan-out wall-clock time to running the same searches one after another
+    branch_seconds = [branch["finished"] - branch["started"] for branch in branches]
+    wall_seconds = max(branch["finished"] for branch in branches) - min(branch["started"] for branch in branches)
+    serial_seconds = sum(branch_seconds)
+    update["search_timings"] = [{
+        "loop": state.research_loop_count,
+        "queries": [branch["search_query"] for branch in branches],
+        "branch_seconds": [round(seconds, 3) for seconds in branch_seconds],
+        "wall_seconds": round(wall_seconds, 3),
+        "serial_seconds": round(serial_seconds, 3),
+        "speedup": round(serial_seconds / wall_seconds, 2) if wall_seconds > 0 else None,
+    }]
+    return update
+
+def summarize_sources(state: SummaryState, config: RunnableConfig):
+    """ Summarize the gathered sources """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    # Once there is a summary, only patch the sections related to the new results.
+    # The patch is JSON, so it is kept out of the token stream
+    if configurable.incremental_summary and state.summary_sections:
+        messages, editable_ids = incremental_summarizer_messages(state, configurable)
+        llm_json_mode = chat_model(configurable, "summarize_sources", state.ollama_backend, format="json")
+        result = llm_json_mode.with_config(tags=[TAG_NOSTREAM]).invoke(messages, config)
+        patch = parse_summary_patch(result.content)
+        if patch is not None:
+            update = summary_sections_update(state, apply_summary_patch(state.summary_sections, patch, editable_ids))
+            update["llm_calls"] = [llm_call_stats("summarize_sources", messages, result)]
+            return update
+        print("Warning: Summary patch was not valid JSON, rewriting the full summary")
+
+    # Run the LLM, streaming tokens so stream_mode="messages" clients see the summary as it is written
+    llm = chat_model(configurable, "summarize_sources", state.ollama_backend)
+    messages = summarizer_messages(state, configurable)
+    result = stream_to_message(llm, messages, config)
+    update = full_summary_update(state, result.content, configurable)
+    update["llm_calls"] = [llm_call_stats("summarize_sources", messages, result)]
+    return update
+
+async def asummarize_sources(state: SummaryState, config: RunnableConfig):
+    """ Summarize the gathered sources """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    if configurable.incremental_summary and state.summary_sections:
+        messages, editable_ids = incremental_summarizer_messages(state, configurable)
+        llm_json_mode = chat_model(configurable, "summarize_sources", state.ollama_backend, format="json")
+        result = await llm_json_mode.with_config(tags=[TAG_NOSTREAM]).ainvoke(messages, config)
+        patch = parse_summary_patch(result.content)
+        if patch is not None:
+            update = summary_sections_update(state, apply_summary_patch(state.summary_sections, patch, editable_ids))
+            update["llm_calls"] = [llm_call_stats("summarize_sources", messages, result)]
+            return update
+        print("Warning: Summary patch was not valid JSON, rewriting the full summary")
+
+    llm = chat_model(configurable, "summarize_sources", state.ollama_backend)
+    messages = summarizer_messages(state, configurable)
+    result = await astream_to_message(llm, messages, config)
+    update = full_summary_update(state, result.content, configurable)
+    update["llm_calls"] = [llm_call_stats("summarize_sources", messages, result)]
+    return update
+
+def draft_follow_up(state: SummaryState, config: RunnableConfig):
+    """ Draft the next query from the raw search results and prefetch it while the summary is written
+
+    Runs alongside summarize_sources. It only saves time when Ollama can serve
+    both calls at once (OLLAMA_NUM_PARALLEL > 1), otherwise the draft queues
+    behind the summary.
+    """
+
+    configurable = Configuration.from_runnable_config(config)
+    if not should_draft_follow_up(state, configurable):
+        return {}
+
+    # A failed speculation must never fail the run
+    try:
+        format, keys = json_output(configurable, reflection_schema, "follow_up_query")
+        llm_json_mode = chat_model(configurable, "draft_follow_up", state.ollama_backend, format=format)
+        messages = draft_follow_up_messages(state, configurable)
+        result = stream_json(llm_json_mode, messages, keys, "draft_follow_up", early_exit=configurable.json_early_exit)
+        llm_calls = [llm_call_stats("draft_follow_up", messages, result)]
+        draft_query = parse_json_object(result.content).get('follow_up_query')
+        if not isinstance(draft_query, str) or not draft_query.strip():
+            return {"llm_calls": llm_calls}
+
+        started = time.time()
+        search_results, include_raw_content = search(get_search_api(configurable), draft_query, state.research_loop_count, configurable)
+        update = speculative_update(state, draft_query, search_results, include_raw_content, time.time() - started)
+        update["llm_calls"] = llm_calls
+        return update
+    except Exception as e:
+        print(f"Warning: Speculative prefetch failed: {str(e)}")
+        return {}
+
+async def adraft_follow_up(state: SummaryState, config: RunnableConfig):
+    """ Draft the next query from the raw search results and prefetch it while the summary is written """
+
+    configurable = Configuration.from_runnable_config(config)
+    if not should_draft_follow_up(state, configurable):
+        return {}
+
+    try:
+        format, keys = json_output(configurable, reflection_schema, "follow_up_query")
+        llm_json_mode = chat_model(configurable, "draft_follow_up", state.ollama_backend, format=format)
+        messages = draft_follow_up_messages(state, configurable)
+        result = await astream_json(llm_json_mode, messages, keys, "draft_follow_up", early_exit=configurable.json_early_exit)
+        llm_calls = [llm_call_stats("draft_follow_up", messages, result)]
+        draft_query = parse_json_object(result.content).get('follow_up_query')
+        if not isinstance(draft_query, str) or not draft_query.strip():
+            return {"llm_calls": llm_calls}
+
+        started = time.time()
+        search_results, include_raw_content = await asearch(get_search_api(configurable), draft_query, state.research_loop_count, configurable)
+        update = speculative_update(state, draft_query, search_results, include_raw_content, time.time() - started)
+        update["llm_calls"] = llm_calls
+        return update
+    except Exception as e:
+        print(f"Warning: Speculative prefetch failed: {str(e)}")
+        return {}
+
+def reflect_on_summary(state: SummaryState, config: RunnableConfig):
+    """ Reflect on the summary and generate a follow-up query """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    # Skip the reflection call if the research has converged
+    early_stop = early_stop_update(state, configurable)
+    if early_stop:
+        return early_stop
+
+    # Generate a query
+    backend = route_backend(state, configurable)
+    format, keys = reflection_output(configurable)
+    llm_json_mode = chat_model(configurable, "reflect_on_summary", backend, format=format)
+    messages = reflection_messages(state, configurable)
+    result = stream_json(llm_json_mode, messages, keys, "reflect_on_summary", early_exit=configurable.json_early_exit)
+    update = parse_reflection_output(result.content, state, configurable)
+    update["llm_calls"] = [llm_call_stats("reflect_on_summary", messages, result)]
+    update["ollama_backend"] = backend
+    return update
+
+async def areflect_on_summary(state: SummaryState, config: RunnableConfig):
+    """ Reflect on the summary and generate a follow-up query """
+
+    configurable = Configuration.from_runnable_config(config)
+
+    early_stop = early_stop_update(state, configurable)
+    if early_stop:
+        return early_stop
+
+    backend = route_backend(state, configurable)
+    format, keys = reflection_output(configurable)
+    llm_json_mode = chat_model(configurable, "reflect_on_summary", backend, format=format)
+    messages = reflection_messages(state, configurable)
+    result = await astream_json(llm_json_mode, messages, keys, "reflect_on_summary", early_exit=configurable.json_early_exit)
+    update = parse_reflection_output(result.content, state, configurable)
+    update["llm_calls"] = [llm_call_stats("reflect_on_summary", messages, result)]
+    update["ollama_backend"] = backend
+    return update
+
+def finalize_summary(state: SummaryState, config: RunnableConfig):
     """ Finalize the summary """
 
     # Format all accumulated sources into a single bulleted list
     all_sources = "\n".join(source for source in state.sources_gathered)
     state.running_summary = f"## Summary\n\n{state.running_summary}\n\n ### Sources:\n{all_sources}"
-    return {"running_summary": state.running_summary}
+    update = {"running_summary": state.running_summary, "stop_reason": state.stop_reason or "Reached max_web_research_loops"}
 
-def route_research(state: SummaryState, config: RunnableConfig) -> Literal["finalize_summary", "web_research"]:
+    # Report how long each node took, and with which model
+    configurable = Configuration.from_runnable_config(config)
+    if state.node_timings:
+        update["node_latency"] = node_latency_report(state.node_timings, configurable)
+
+    # Report prompt evaluation and estimated prompt cache savings per node
+    if state.llm_calls:
+        update["prompt_cache_report"] = prompt_cache_report(state.llm_calls)
+        update["json_early_exit_report"] = json_early_exit_report(state.llm_calls)
+
+    # Report how many searches the search cache answered without a request
+    if state.search_calls:
+        update["search_cache_report"] = {
+            "searches": state.search_calls,
+            "hits": state.search_cache_hits,
+            "hit_ratio": round(state.search_cache_hits / state.search_calls, 2),
+        }
+
+    # Report how often a slow or empty search was also sent to the hedge search API
+    if configurable.hedge_search_api and state.search_calls:
+        update["search_hedge_report"] = {
+            "searches": state.search_calls,
+            "hedged": state.search_hedges,
+            "hedge_rate": round(state.search_hedges / state.search_calls, 2),
+        }
+
+    # Report how often the prefetched follow-up results were used
+    if state.speculation_stats:
+        hits = sum(1 for stats in state.speculation_stats if stats["hit"])
+        update["speculation_report"] = {
+            "drafts": len(state.speculation_stats),
+            "hits": hits,
+            "hit_rate": round(hits / len(state.speculation_stats), 2),
+            "seconds_saved": round(sum(stats["seconds_saved"] for stats in state.speculation_stats), 3),
+        }
+    return update
+
+def route_search(state: SummaryState) -> Union[Literal["web_research"], list[Send]]:
+    """ Fan out to one search branch per query, or search a single query """
+
+    if len(state.search_queries) > 1:
+        return [Send("search_branch", {"search_query": query, "research_loop_count": state.research_loop_count}) for query in state.search_queries]
+    return "web_research"
+
+def route_research(state: SummaryState, config: RunnableConfig) -> Union[Literal["finalize_summary", "web_research"], list[Send]]:
     """ Route the research based on the follow-up query """
 
     configurable = Configuration.from_runnable_config(config)
-    if state.research_loop_count <= configurable.max_web_research_loops:
-        return "web_research"
+    if not state.stop_reason and state.research_loop_count <= configurable.max_web_research_loops:
+        return route_search(state)
     else:
         return "finalize_summary"
 
 # Add nodes and edges
 builder = StateGraph(SummaryState, input=SummaryStateInput, output=SummaryStateOutput, config_schema=Configuration)
-builder.add_node("generate_query", generate_query)
-builder.add_node("web_research", web_research)
-builder.add_node("summarize_sources", summarize_sources)
-builder.add_node("reflect_on_summary", reflect_on_summary)
+builder.add_node("generate_query", RunnableLambda(timed("generate_query", generate_query), afunc=timed("generate_query", agenerate_query)))
+builder.add_node("web_research", RunnableLambda(timed("web_research", web_research), afunc=timed("web_research", aweb_research)))
+builder.add_node("search_branch", RunnableLambda(timed("search_branch", search_branch), afunc=timed("search_branch", asearch_branch)))
+builder.add_node("merge_search_results", timed("merge_search_results", merge_search_results))
+builder.add_node("summarize_sources", RunnableLambda(timed("summarize_sources", summarize_sources), afunc=timed("summarize_sources", asummarize_sources)))
+builder.add_node("draft_follow_up", RunnableLambda(timed("draft_follow_up", draft_follow_up), afunc=timed("draft_follow_up", adraft_follow_up)))
+builder.add_node("reflect_on_summary", RunnableLambda(timed("reflect_on_summary", reflect_on_summary), afunc=timed("reflect_on_summary", areflect_on_summary)))
 builder.add_node("finalize_summary", finalize_summary)
 
 # Add edges
 builder.add_edge(START, "generate_query")
-builder.add_edge("generate_query", "web_research")
+builder.add_conditional_edges("generate_query", route_search, ["web_research", "search_branch"])
 builder.add_edge("web_research", "summarize_sources")
-builder.add_edge("summarize_sources", "reflect_on_summary")
-builder.add_conditional_edges("reflect_on_summary", route_research)
+builder.add_edge("web_research", "draft_follow_up")
+builder.add_edge("search_branch", "merge_search_results")
+builder.add_edge("merge_search_results", "summarize_sources")
+builder.add_edge("merge_search_results", "draft_follow_up")
+builder.add_edge(["summarize_sources", "draft_follow_up"], "reflect_on_summary")
+builder.add_conditional_edges("reflect_on_summary", route_research, ["web_research", "search_branch", "finalize_summary"])
 builder.add_edge("finalize_summary", END)
 
-graph = builder.compile()
\ No newline at end of file
+# Persist state after every step when CHECKPOINT_DB is set, so runs can resume by thread_id
+graph = builder.compile(checkpointer=get_checkpointer())
\ No newline at end of file
@@ -0,0 +1,276 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+# Latest uncached response times kept per provider for the percentiles
+LATENCY_SAMPLES = 1000
+# Threads running hedged searches; abandoned slow searches hold one until they return
+HEDGE_THREADS = 16
+
+# A provider's response: the search results and whether they carry raw content
+SearchResponse = Tuple[Dict[str, Any], bool]
+
+def adequate(response: Optional[SearchResponse]) -> bool:
+    """A response is good enough to answer with when it has at least one result."""
+    return response is not None and bool(response[0].get("results"))
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+class SearchLatency:
+    """Response times and outcomes per search provider, and how often hedged searches fired.
+
+    Only responses that needed a request are timed; search cache hits are
+    counted but would drag the percentiles toward zero. Async searches
+    cancelled after losing a hedge are counted too: they were at least as
+    slow as the hedge delay, so a high count means the p99 understates the
+    provider's tail.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples: Dict[str, Deque[float]] = {}
+        self.outcomes: Dict[str, Dict[str, int]] = {}
+        self.hedges: Dict[str, Dict[str, int]] = {}
+
+    def record(self, provider: str, seconds: float, response: Optional[SearchResponse]):
+        if response is None:
+            outcome = "errors"
+        elif response[0].get("cached"):
+            outcome = "cached"
+        else:
+            outcome = "responses" if adequate(response) else "empty"
+        with self.lock:
+            outcomes = self.outcomes.setdefault(provider, {"responses": 0, "empty": 0, "errors": 0, "cached": 0})
+            outcomes[outcome] += 1
+            if outcome != "cached":
+                self.samples.setdefault(provider, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def record_cancelled(self, provider: str):
+        # A hedged search that lost was cancelled before it answered, so it has no response time
+        with self.lock:
+            outcomes = self.outcomes.setdefault(provider, {"responses": 0, "empty": 0, "errors": 0, "cached": 0})
+            outcomes["cancelled"] = outcomes.get("cancelled", 0) + 1
+
+    def record_hedge(self, pair: str, counter: str):
+        with self.lock:
+            counters = self.hedges.setdefault(pair, {"searches": 0, "hedged": 0, "primary_won": 0, "secondary_won": 0, "merged": 0, "failed": 0})
+            counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            samples = {provider: sorted(values) for provider, values in self.samples.items()}
+            outcomes = {provider: dict(counts) for provider, counts in self.outcomes.items()}
+            hedges = {pair: dict(counters) for pair, counters in self.hedges.items()}
+        providers = {}
+        for provider, counts in outcomes.items():
+            timed = samples.get(provider)
+            providers[provider] = {**counts, **({
+                "p50_seconds": round(_percentile(timed, 0.5), 3),
+                "p99_seconds": round(_percentile(timed, 0.99), 3),
+                "max_seconds": round(timed[-1], 3),
+            } if timed else {})}
+        for counters in hedges.values():
+            counters["hedge_rate"] = round(counters["hedged"] / counters["searches"], 3) if counters["searches"] else 0.0
+        return {"providers": providers, "hedging": hedges}
+
+_latency = SearchLatency()
+
+def measured(provider: str, run: Callable[[], SearchResponse]) -> SearchResponse:
+    """Run a provider's search, recording its response time and outcome."""
+    started = time.perf_counter()
+    try:
+        response = run()
+    except Exception:
+        _latency.record(provider, time.perf_counter() - started, None)
+        raise
+    _latency.record(provider, time.perf_counter() - started, response)
+    return response
+
+async def ameasured(provider: str, run: Callable[[], Awaitable[SearchResponse]]) -> SearchResponse:
+    """Async version of measured."""
+    started = time.perf_counter()
+    try:
+        response = await run()
+    except asyncio.CancelledError:
+        _latency.record_cancelled(provider)
+        raise
+    except Exception:
+        _latency.record(provider, time.perf_counter() - started, None)
+        raise
+    _latency.record(provider, time.perf_counter() - started, response)
+    return response
+
+def merge_responses(responses: List[Tuple[str, SearchResponse]]) -> SearchResponse:
+    """Combine responses in provider order, keeping the first result for each URL."""
+    results = {}
+    for _, (search_results, _) in responses:
+        for result in search_results["results"]:
+            results.setdefault(result["url"], result)
+    merged = {
+        "results": list(results.values()),
+        "cached": all(search_results.get("cached", False) for _, (search_results, _) in responses),
+        "provider": "+".join(provider for provider, _ in responses),
+    }
+    return merged, all(include_raw_content for _, (_, include_raw_content) in responses)
+
+def _answer(pair: str, primary: str, responses: List[Tuple[str, SearchResponse]], hedged: bool) -> SearchResponse:
+    # Responses are in provider order, primary first
+    if len(responses) > 1:
+        _latency.record_hedge(pair, "merged")
+        search_results, include_raw_content = merge_responses(responses)
+    else:
+        provider, (search_results, include_raw_content) = responses[0]
+        _latency.record_hedge(pair, "primary_won" if provider == primary else "secondary_won")
+        search_results = {**search_results, "provider": provider}
+    return {**search_results, "hedged": hedged}, include_raw_content
+
+def _fallback(pair: str, primary: str, errors: Dict[str, BaseException], inadequate: List[SearchResponse]) -> SearchResponse:
+    # Neither provider answered with results: return an empty response, or raise
+    # the primary's error, chained to the secondary's, if both failed
+    _latency.record_hedge(pair, "failed")
+    if inadequate:
+        search_results, include_raw_content = inadequate[0]
+        return {**search_results, "hedged": True}, include_raw_content
+    error = errors.pop(primary, None)
+    other = next(iter(errors.values()), None)
+    if error is None:
+        raise other
+    raise error from other
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS, thread_name_prefix="hedged-search")
+        return _executor
+
+def hedged_search(primary: str, run_primary: Callable[[], SearchResponse], secondary: str, run_secondary: Callable[[], SearchResponse],
+                  delay: float, merge_window: float) -> SearchResponse:
+    """Search the primary provider, and the secondary too if the primary is slow or comes back empty.
+
+    The secondary is queried once delay seconds pass without a response
+    from the primary, or as soon as the primary fails or returns no
+    results. The first response with results is used; if the other
+    provider answers within merge_window seconds after it, the two are
+    merged, otherwise the slower search is abandoned (a running thread
+    cannot be interrupted, so its result is discarded).
+
+    Returns:
+        tuple: The search results, marked with "hedged" and the answering
+        "provider", and whether they carry raw content
+    """
+    pair = f"{primary}>{secondary}"
+    _latency.record_hedge(pair, "searches")
+    executor = _get_executor()
+    providers = {executor.submit(measured, primary, run_primary): primary}
+    pending = set(providers)
+    responses: Dict[str, SearchResponse] = {}
+    errors: Dict[str, BaseException] = {}
+    inadequate: List[SearchResponse] = []
+    hedged = False
+    deadline: Optional[float] = None
+
+    def collect(done):
+        for future in done:
+            try:
+                response = future.result()
+            except Exception as e:
+                errors[providers[future]] = e
+                continue
+            if adequate(response):
+                responses[providers[future]] = response
+            else:
+                inadequate.append(response)
+
+    done, pending = wait(pending, timeout=delay)
+    collect(done)
+    while True:
+        if not responses and not hedged:
+            # The primary is slow, failed or empty: ask the secondary as well
+            hedged = True
+            _latency.record_hedge(pair, "hedged")
+            future = executor.submit(measured, secondary, run_secondary)
+            providers[future] = secondary
+            pending.add(future)
+        if not pending:
+            break
+        if responses:
+            deadline = deadline or time.monotonic() + merge_window
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+        else:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        collect(done)
+
+    for future in pending:
+        future.cancel()
+    if not responses:
+        return _fallback(pair, primary, errors, inadequate)
+    return _answer(pair, primary, [(provider, responses[provider]) for provider in (primary, secondary) if provider in responses], hedged)
+
+async def ahedged_search(primary: str, run_primary: Callable[[], Awaitable[SearchResponse]], secondary: str,
+                         run_secondary: Callable[[], Awaitable[SearchResponse]], delay: float, merge_window: float) -> SearchResponse:
+    """Async version of hedged_search; the slower search is cancelled rather than abandoned."""
+    pair = f"{primary}>{secondary}"
+    _latency.record_hedge(pair, "searches")
+    providers = {asyncio.ensure_future(ameasured(primary, run_primary)): primary}
+    pending = set(providers)
+    responses: Dict[str, SearchResponse] = {}
+    errors: Dict[str, BaseException] = {}
+    inadequate: List[SearchResponse] = []
+    hedged = False
+    deadline: Optional[float] = None
+
+    def collect(done):
+        for task in done:
+            if task.cancelled():
+                # Cancelled by something other than this hedge, which only cancels tasks it stopped waiting on
+                errors[providers[task]] = RuntimeError(f"{providers[task]} search was cancelled")
+            elif task.exception() is not None:
+                errors[providers[task]] = task.exception()
+            elif adequate(task.result()):
+                responses[providers[task]] = task.result()
+            else:
+                inadequate.append(task.result())
+
+    try:
+        done, pending = await asyncio.wait(pending, timeout=delay)
+        collect(done)
+        while True:
+            if not responses and not hedged:
+                hedged = True
+                _latency.record_hedge(pair, "hedged")
+                task = asyncio.ensure_future(ameasured(secondary, run_secondary))
+                providers[task] = secondary
+                pending.add(task)
+            if not pending:
+                break
+            if responses:
+                deadline = deadline or time.monotonic() + merge_window
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                done, pending = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            else:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+    finally:
+        for task in pending:
+            task.cancel()
+
+    if not responses:
+        return _fallback(pair, primary, errors, inadequate)
+    return _answer(pair, primary, [(provider, responses[provider]) for provider in (primary, secondary) if provider in responses], hedged)
+
+def search_latency_stats() -> Dict[str, Any]:
+    """Report p50/p99 response times and outcomes per search provider, and the hedge trigger rate per provider pair."""
+    return _latency.stats()
@@ -0,0 +1,440 @@
+import json
+import os
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Sequence, Tuple, Union
+
+import httpx
+from langchain_core.runnables import Runnable
+from langchain_ollama import ChatOllama
+from ollama import AsyncClient, Client
+
+from assistant.backends import FAILOVER_ERRORS, get_backend_pool, record_error, record_request
+from assistant.scheduler import RESEARCH, get_scheduler
+from assistant.tokens import CHARS_PER_TOKEN
+from assistant.utils import parse_json_fields
+
+# Connection pool sizing for each Ollama endpoint. Ollama serves at most
+# OLLAMA_NUM_PARALLEL requests at once, so a small keep-alive pool is enough.
+OLLAMA_POOL_MAX_CONNECTIONS = int(os.environ.get("OLLAMA_POOL_MAX_CONNECTIONS", "16"))
+OLLAMA_POOL_KEEPALIVE_EXPIRY = float(os.environ.get("OLLAMA_POOL_KEEPALIVE_EXPIRY", "300"))
+
+class _ConnectionPool:
+    """Shared sync and async HTTP clients for a single Ollama endpoint.
+
+    Every ChatOllama handed out by the registry for this endpoint uses these
+    two clients, so all of them draw from the same keep-alive connection pool.
+    New TCP connections are counted through httpcore's trace extension.
+    """
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.requests = 0
+        self.connections_opened = 0
+        self._lock = threading.Lock()
+
+        limits = httpx.Limits(
+            max_connections=OLLAMA_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=OLLAMA_POOL_MAX_CONNECTIONS,
+            keepalive_expiry=OLLAMA_POOL_KEEPALIVE_EXPIRY,
+        )
+        self.sync_client = Client(host=base_url, limits=limits, event_hooks={"request": [self._on_request]})
+        self.async_client = AsyncClient(host=base_url, limits=limits, event_hooks={"request": [self._on_async_request]})
+
+    def _count(self, event_name: str):
+        with self._lock:
+            if event_name == "connection.connect_tcp.complete":
+                self.connections_opened += 1
+
+    def _on_request(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+        request.extensions["trace"] = lambda event_name, info: self._count(event_name)
+
+    async def _on_async_request(self, request: httpx.Request):
+        with self._lock:
+            self.requests += 1
+
+        async def trace(event_name, info):
+            self._count(event_name)
+
+        request.extensions["trace"] = trace
+
+    def open_connections(self) -> int:
+        """Count the connections currently held open by both clients."""
+        total = 0
+        for client in (self.sync_client, self.async_client):
+            pool = getattr(getattr(client._client, "_transport", None), "_pool", None)
+            total += len(getattr(pool, "connections", []))
+        return total
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            requests, opened = self.requests, self.connections_opened
+        return {
+            "requests": requests,
+            "connections_opened": opened,
+            "connections_reused": max(requests - opened, 0),
+            "open_connections": self.open_connections(),
+        }
+
+class ScheduledChatOllama(ChatOllama):
+    """ChatOllama whose requests are admitted by the backend's AdmissionScheduler.
+
+    The slot is held until the response has been fully read, so streamed
+    completions count against the backend's capacity for their whole length.
+    Each request's latency, or its error, is recorded against the backend.
+    """
+
+    lane: str = RESEARCH
+
+    def _create_chat_stream(self, messages, stop=None, **kwargs) -> Iterator:
+        with get_scheduler(self.base_url).slot(self.lane):
+            started = time.monotonic()
+            try:
+                yield from super()._create_chat_stream(messages, stop, **kwargs)
+            except GeneratorExit:
+                # Closed by the caller before the response finished, e.g. a JSON early exit
+                record_request(self.base_url, time.monotonic() - started)
+                raise
+            except Exception as e:
+                record_error(self.base_url, e)
+                raise
+            record_request(self.base_url, time.monotonic() - started)
+
+    async def _acreate_chat_stream(self, messages, stop=None, **kwargs) -> AsyncIterator:
+        async with get_scheduler(self.base_url).aslot(self.lane):
+            started = time.monotonic()
+            try:
+                async for part in super()._acreate_chat_stream(messages, stop, **kwargs):
+                    yield part
+            except GeneratorExit:
+                record_request(self.base_url, time.monotonic() - started)
+                raise
+            except Exception as e:
+                record_error(self.base_url, e)
+                raise
+            record_request(self.base_url, time.monotonic() - started)
+
+_registry_lock = threading.Lock()
+_pools: Dict[str, _ConnectionPool] = {}
+_models: Dict[Tuple[Any, ...], ScheduledChatOllama] = {}
+_model_hits = 0
+_model_misses = 0
+
+def _normalize_base_url(base_url: str) -> str:
+    return (base_url or "http://localhost:11434").rstrip("/")
+
+def _get_pool(base_url: str) -> _ConnectionPool:
+    pool = _pools.get(base_url)
+    if pool is None:
+        pool = _pools[base_url] = _ConnectionPool(base_url)
+    return pool
+
+def get_chat_model(base_url: str, model: str, format: Union[str, dict, None] = None, temperature: Optional[float] = 0,
+                   keep_alive: Optional[str] = None, lane: str = RESEARCH, num_ctx: Optional[int] = None) -> ScheduledChatOllama:
+    """Return the shared ChatOllama client for (base_url, model, format, temperature, keep_alive, lane, num_ctx).
+
+    Clients are built once per key and reused for the life of the process.
+    All clients for the same endpoint share one keep-alive connection pool,
+    which serves both sync (invoke/stream) and async (ainvoke/astream) callers,
+    and one admission scheduler, which caps in-flight requests and serves the
+    interactive lane before the research lane.
+
+    Args:
+        base_url (str): The Ollama endpoint
+        model (str): The Ollama model name
+        format (str or dict, optional): Output format, "json" or a JSON schema
+        temperature (float, optional): Sampling temperature
+        keep_alive (str, optional): How long Ollama keeps the model loaded after a call, e.g. "30m"
+        lane (str): Admission lane, "interactive" or "research"
+        num_ctx (int, optional): Context window to load the model with, the server default if not set
+
+    Returns:
+        ScheduledChatOllama: A client bound to the shared connection pool and scheduler
+    """
+    global _model_hits, _model_misses
+
+    base_url = _normalize_base_url(base_url)
+    format_key = json.dumps(format, sort_keys=True) if isinstance(format, dict) else format
+    key = (base_url, model, format_key, temperature, keep_alive, lane, num_ctx)
+    with _registry_lock:
+        llm = _models.get(key)
+        if llm is not None:
+            _model_hits += 1
+            return llm
+        _model_misses += 1
+
+        kwargs: Dict[str, Any] = {"base_url": base_url, "model": model, "temperature": temperature, "lane": lane}
+        if format:
+            kwargs["format"] = format
+        if keep_alive:
+            kwargs["keep_alive"] = keep_alive
+        # Only sent when set: a num_ctx different from the loaded model's makes Ollama reload it
+        if num_ctx:
+            kwargs["num_ctx"] = num_ctx
+        llm = ScheduledChatOllama(**kwargs)
+
+        # Point the client at the endpoint's shared pool instead of the
+        # per-instance httpx clients ChatOllama creates for itself
+        pool = _get_pool(base_url)
+        llm._client = pool.sync_client
+        llm._async_client = pool.async_client
+
+        _models[key] = llm
+        return llm
+
+def get_balanced_chat_model(base_urls: Sequence[str], model: str, preferred: Optional[str] = None, **kwargs) -> Runnable:
+    """Return a chat model on the best backend in base_urls that fails over to the others.
+
+    The preferred backend is used while it is healthy, otherwise the least
+    loaded healthy one. If the chosen backend is unreachable, the call is
+    retried on the remaining backends in order of load.
+
+    Args:
+        base_urls (list): The Ollama endpoints to balance across
+        model (str): The Ollama model name
+        preferred (str, optional): The backend already serving this run
+        **kwargs: Passed to get_chat_model
+
+    Returns:
+        Runnable: The chat model, wrapped with fallbacks when there are several backends
+    """
+    ranked = get_backend_pool(base_urls).ranked(preferred)
+    llm = get_chat_model(ranked[0], model, **kwargs)
+    if len(ranked) == 1:
+        return llm
+    fallbacks = [get_chat_model(base_url, model, **kwargs) for base_url in ranked[1:]]
+    return llm.with_fallbacks(fallbacks, exceptions_to_handle=FAILOVER_ERRORS)
+
+def pool_stats() -> Dict[str, Any]:
+    """Report client reuse and connection pool usage for every Ollama endpoint.
+
+    Returns:
+        dict: Stats containing:
+            - clients (dict): Registry size plus hits (reuses) and misses (constructions)
+            - pools (dict): Per base URL request count, connections opened,
+              requests served on a reused connection and currently open connections
+    """
+    with _registry_lock:
+        clients = {"cached": len(_models), "hits": _model_hits, "misses": _model_misses}
+        pools = list(_pools.values())
+    return {"clients": clients, "pools": {pool.base_url: pool.stats() for pool in pools}}
+
+def stream_to_message(llm: ChatOllama, messages: list, config: Optional[dict] = None):
+    """Stream a completion and return the merged message, including Ollama's final metadata."""
+    message = None
+    for chunk in llm.stream(messages, config):
+        message = chunk if message is None else message + chunk
+    return message
+
+async def astream_to_message(llm: ChatOllama, messages: list, config: Optional[dict] = None):
+    """Async version of stream_to_message."""
+    message = None
+    async for chunk in llm.astream(messages, config):
+        message = chunk if message is None else message + chunk
+    return message
+
+def llm_call_stats(node: str, messages: list, message) -> Dict[str, Any]:
+    """Collect Ollama's token counts and timings for one call.
+
+    Ollama only counts prompt tokens it had to evaluate, so a prompt_eval_count
+    well below the prompt's size means the rest was served from its prompt cache.
+
+    Args:
+        node (str): The graph node that made the call
+        messages (list): The messages sent
+        message: The response message
+
+    Returns:
+        dict: Prompt size in characters, prompt_eval_count, eval_count and
+            the prompt eval, eval and model load durations in milliseconds.
+            For calls stopped early only eval_count and eval_ms are known,
+            as counted and timed by stream_json
+    """
+    metadata = getattr(message, "response_metadata", None) or {}
+
+    def ms(key):
+        return round((metadata.get(key) or 0) / 1e6, 1)
+
+    return {
+        "node": node,
+        "early_exit": bool(metadata.get("early_exit")),
+        "prompt_chars": sum(len(m.content) for m in messages if isinstance(m.content, str)),
+        "prompt_eval_count": metadata.get("prompt_eval_count") or 0,
+        "prompt_eval_ms": ms("prompt_eval_duration"),
+        "eval_count": metadata.get("eval_count") or 0,
+        "eval_ms": ms("eval_duration"),
+        "load_ms": ms("load_duration"),
+    }
+
+def prompt_cache_report(llm_calls: list) -> Dict[str, Dict[str, Any]]:
+    """Summarize prompt evaluation and estimated prompt cache savings per node.
+
+    The cached token estimate is the prompt's size (at CHARS_PER_TOKEN) minus the
+    tokens Ollama evaluated, and the time saved prices those tokens at the node's
+    measured prompt eval rate.
+
+    Args:
+        llm_calls (list): Stats from llm_call_stats
+
+    Returns:
+        dict: Per node call count, prompt size, prompt_eval_count, prompt eval
+            time, estimated cached tokens and estimated milliseconds saved
+    """
+    report: Dict[str, Dict[str, Any]] = {}
+    for call in llm_calls:
+        node = report.setdefault(call["node"], {"calls": 0, "prompt_chars": 0, "prompt_eval_count": 0, "prompt_eval_ms": 0.0, "estimated_cached_tokens": 0})
+        node["calls"] += 1
+        # Calls stopped early never receive Ollama's prompt counters
+        if call.get("early_exit"):
+            continue
+        node["prompt_chars"] += call["prompt_chars"]
+        node["prompt_eval_count"] += call["prompt_eval_count"]
+        node["prompt_eval_ms"] = round(node["prompt_eval_ms"] + call["prompt_eval_ms"], 1)
+        node["estimated_cached_tokens"] += max(call["prompt_chars"] // CHARS_PER_TOKEN - call["prompt_eval_count"], 0)
+
+    for node in report.values():
+        ms_per_token = node["prompt_eval_ms"] / node["prompt_eval_count"] if node["prompt_eval_count"] else 0.0
+        node["estimated_ms_saved"] = round(node["estimated_cached_tokens"] * ms_per_token, 1)
+    return report
+
+# Every Nth structured call per node is left to finish, so the full response
+# length the early exits are compared against stays current
+JSON_EARLY_EXIT_SAMPLE_EVERY = int(os.environ.get("JSON_EARLY_EXIT_SAMPLE_EVERY", "10"))
+
+_json_lock = threading.Lock()
+_json_calls: Dict[str, int] = {}
+_json_baselines: Dict[str, Dict[str, float]] = {}
+
+def _sample_full_response(node: str) -> bool:
+    with _json_lock:
+        count = _json_calls.get(node, 0)
+        _json_calls[node] = count + 1
+    return JSON_EARLY_EXIT_SAMPLE_EVERY > 0 and count % JSON_EARLY_EXIT_SAMPLE_EVERY == 0
+
+def _record_full_response(node: str, message):
+    metadata = getattr(message, "response_metadata", None) or {}
+    if not metadata.get("eval_count"):
+        return
+    with _json_lock:
+        baseline = _json_baselines.setdefault(node, {"calls": 0, "eval_count": 0, "eval_ns": 0})
+        baseline["calls"] += 1
+        baseline["eval_count"] += metadata["eval_count"]
+        baseline["eval_ns"] += metadata.get("eval_duration") or 0
+
+class _JsonEarlyExit:
+    """Tracks a streaming JSON response until every wanted key has a complete value."""
+
+    def __init__(self, keys: Sequence[str]):
+        self.keys = keys
+        self.text = ""
+        self.tokens = 0
+        self.first_token: Optional[float] = None
+
+    def done(self, chunk) -> bool:
+        if not chunk.content:
+            return False
+        if self.first_token is None:
+            self.first_token = time.monotonic()
+        self.text += chunk.content
+        self.tokens += 1
+        fields = parse_json_fields(self.text)
+        return all(key in fields for key in self.keys)
+
+    def mark(self, message):
+        # Ollama streams one token per chunk, so the chunks read stand in for eval_count
+        message.response_metadata = {
+            **(message.response_metadata or {}),
+            "early_exit": True,
+            "eval_count": self.tokens,
+            "eval_duration": int((time.monotonic() - self.first_token) * 1e9),
+        }
+        return message
+
+def stream_json(llm, messages: list, keys: Sequence[str], node: str, config: Optional[dict] = None, early_exit: bool = True):
+    """Stream a JSON completion, stopping generation once every key in keys has a complete value.
+
+    Closing the stream drops the connection, which makes Ollama stop
+    generating the remaining fields. The returned message then holds the
+    JSON received so far and is marked early_exit in its response_metadata.
+
+    Args:
+        llm: The chat model
+        messages (list): The messages to send
+        keys (list): The top-level keys whose values are needed
+        node (str): The graph node making the call, for json_early_exit_report
+        config (dict, optional): Runnable config
+        early_exit (bool): Whether to stop early at all
+
+    Returns:
+        The merged response message
+    """
+    early_exit = early_exit and not _sample_full_response(node)
+    tracker = _JsonEarlyExit(keys)
+    message = None
+    stream = llm.stream(messages, config)
+    try:
+        for chunk in stream:
+            message = chunk if message is None else message + chunk
+            if early_exit and tracker.done(chunk):
+                return tracker.mark(message)
+    finally:
+        stream.close()
+    _record_full_response(node, message)
+    return message
+
+async def astream_json(llm, messages: list, keys: Sequence[str], node: str, config: Optional[dict] = None, early_exit: bool = True):
+    """Async version of stream_json."""
+    early_exit = early_exit and not _sample_full_response(node)
+    tracker = _JsonEarlyExit(keys)
+    message = None
+    stream = llm.astream(messages, config)
+    try:
+        async for chunk in stream:
+            message = chunk if message is None else message + chunk
+            if early_exit and tracker.done(chunk):
+                return tracker.mark(message)
+    finally:
+        await stream.aclose()
+    _record_full_response(node, message)
+    return message
+
+def json_early_exit_report(llm_calls: list) -> Dict[str, Dict[str, Any]]:
+    """Summarize the tokens and time saved by stopping structured calls early, per node.
+
+    Savings are estimated against the average length and generation speed of
+    the full responses each node has produced in this process.
+
+    Args:
+        llm_calls (list): Stats from llm_call_stats
+
+    Returns:
+        dict: Per node call and early exit counts, tokens generated by the
+            early exits, and estimated tokens and milliseconds saved (None
+            until a full response has been seen)
+    """
+    report: Dict[str, Dict[str, Any]] = {}
+    for call in llm_calls:
+        node = report.setdefault(call["node"], {"calls": 0, "early_exits": 0, "tokens_generated": 0})
+        node["calls"] += 1
+        if call.get("early_exit"):
+            node["early_exits"] += 1
+            node["tokens_generated"] += call["eval_count"]
+
+    with _json_lock:
+        baselines = {name: dict(baseline) for name, baseline in _json_baselines.items()}
+    for name, node in list(report.items()):
+        if not node["early_exits"]:
+            del report[name]
+            continue
+        baseline = baselines.get(name)
+        if not baseline:
+            node["estimated_tokens_saved"] = node["estimated_ms_saved"] = None
+            continue
+        full_tokens = baseline["eval_count"] / baseline["calls"]
+        ns_per_token = baseline["eval_ns"] / baseline["eval_count"]
+        saved = max(round(full_tokens * node["early_exits"] - node["tokens_generated"]), 0)
+        node["estimated_tokens_saved"] = saved
+        node["estimated_ms_saved"] = round(saved * ns_per_token / 1e6, 1)
+    return report
@@ -0,0 +1,244 @@
+import hashlib
+import multiprocessing
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from assistant.extract import decode_html, extract_text
+from assistant.rerank import terms
+
+# Index file for LOCAL_SEARCH_DIR; by default one file per directory under
+# ~/.cache/ollama-deep-researcher
+LOCAL_SEARCH_DB = os.environ.get("LOCAL_SEARCH_DB", "")
+# Worker processes reading and extracting changed files while indexing
+LOCAL_INDEX_WORKERS = int(os.environ.get("LOCAL_INDEX_WORKERS", str(os.cpu_count() or 1)))
+# Seconds between checks of the directory for new, changed and deleted files
+LOCAL_INDEX_REFRESH = float(os.environ.get("LOCAL_INDEX_REFRESH", "300"))
+
+# Indexed file types and how their text is read
+LOCAL_EXTENSIONS = {".html": "html", ".htm": "html", ".md": "text", ".markdown": "text", ".txt": "text", ".rst": "text"}
+# Fewer changed files than this are read in-process, as starting workers costs more
+PARALLEL_MIN_FILES = 64
+# Changed files written per transaction while indexing
+INDEX_BATCH = 500
+# Characters of a document returned as its raw_content
+LOCAL_RAW_CHARS = 20000
+# Words around the matches in a result's snippet
+SNIPPET_WORDS = 48
+# BM25 weights of the title and body columns
+TITLE_WEIGHT = 5.0
+BODY_WEIGHT = 1.0
+
+def _title(path: str, kind: str, data: bytes, text: str) -> str:
+    if kind == "html":
+        match = re.search(rb"<title[^>]*>(.*?)</title>", data[:65536], re.IGNORECASE | re.DOTALL)
+        if match:
+            title = " ".join(decode_html(match.group(1)).split())
+            if title:
+                return title[:200]
+    for line in text.splitlines():
+        line = line.strip().lstrip("#").strip()
+        if line:
+            return line[:200]
+    return Path(path).stem
+
+def read_document(path: str, kind: str, known_hash: Optional[str]) -> Tuple[str, Optional[str], Optional[str], Optional[str]]:
+    """Hash a file and extract its title and text, in a worker process.
+
+    Returns:
+        tuple: (path, hash, title, text); title and text are None when the
+        hash equals known_hash, and hash is None when the file cannot be read
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return path, None, None, None
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if digest == known_hash:
+        return path, digest, None, None
+    text = extract_text(data) if kind == "html" else decode_html(data)
+    return path, digest, _title(path, kind, data, text), text
+
+def _read_document(args: Tuple[str, str, Optional[str]]):
+    return read_document(*args)
+
+def default_index_path(directory: str) -> str:
+    name = hashlib.blake2b(os.path.abspath(directory).encode(), digest_size=8).hexdigest()
+    return os.path.join(os.path.expanduser("~"), ".cache", "ollama-deep-researcher", f"local-{name}.sqlite")
+
+def match_expression(query: str) -> str:
+    """An FTS5 query matching documents with any of the query's terms, ranked by BM25."""
+    return " OR ".join(f'"{term}"' for term in dict.fromkeys(terms(query)))
+
+class LocalIndex:
+    """A directory of HTML, Markdown and text files in a SQLite FTS5 index.
+
+    The files table keeps each file's mtime, size and content hash. A
+    refresh only reads files whose mtime or size changed, and only
+    re-extracts those whose hash changed, so unchanged and touched files
+    cost one stat each. Changed files are read in worker processes and
+    written from this process in batched transactions. Searches use their
+    own connection, so they are served from the last committed index while
+    a refresh runs.
+    """
+
+    def __init__(self, directory: str, path: Optional[str] = None):
+        self.directory = os.path.abspath(directory)
+        self.path = path or LOCAL_SEARCH_DB or default_index_path(directory)
+        parent = os.path.dirname(self.path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.refreshed_at = 0.0
+        self.last_refresh: Dict[str, Any] = {}
+        self.conn = self._connect()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE, "
+            "mtime REAL NOT NULL, size INTEGER NOT NULL, hash TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS documents USING fts5(title, body, tokenize='porter unicode61')"
+        )
+        self.conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def scan(self) -> Dict[str, Tuple[float, int, str]]:
+        """The indexable files under the directory, with their mtime, size and kind."""
+        files = {}
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                kind = LOCAL_EXTENSIONS.get(os.path.splitext(name)[1].lower())
+                if kind is None:
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                files[path] = (stat.st_mtime, stat.st_size, kind)
+        return files
+
+    def _read(self, changed: List[Tuple[str, str, Optional[str]]], workers: int) -> Iterator[tuple]:
+        if workers <= 1 or len(changed) < PARALLEL_MIN_FILES:
+            yield from map(_read_document, changed)
+            return
+        # Spawned rather than forked workers, as the server process runs threads
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            yield from pool.map(_read_document, changed, chunksize=max(1, min(64, len(changed) // (workers * 4))))
+
+    def refresh(self, workers: int = LOCAL_INDEX_WORKERS) -> Dict[str, Any]:
+        """Bring the index up to date with the directory.
+
+        Returns:
+            dict: Counts of files added, updated, touched (changed mtime, same
+            content), unchanged, removed and unreadable, and the seconds taken
+        """
+        with self.refresh_lock:
+            started = time.perf_counter()
+            conn = self._connect()
+            try:
+                known = {path: (mtime, size, digest) for path, mtime, size, digest in conn.execute("SELECT path, mtime, size, hash FROM files")}
+                on_disk = self.scan()
+                changed = [(path, kind, known[path][2] if path in known else None)
+                           for path, (mtime, size, kind) in on_disk.items()
+                           if path not in known or known[path][:2] != (mtime, size)]
+                removed = [path for path in known if path not in on_disk]
+                stats = {"files": len(on_disk), "added": 0, "updated": 0, "touched": 0, "removed": len(removed),
+                         "unreadable": 0, "unchanged": len(on_disk) - len(changed)}
+
+                pending = 0
+                for path, digest, title, text in self._read(changed, workers):
+                    mtime, size, _ = on_disk[path]
+                    if digest is None:
+                        stats["unreadable"] += 1
+                        continue
+                    if title is None:
+                        conn.execute("UPDATE files SET mtime = ?, size = ? WHERE path = ?", (mtime, size, path))
+                        stats["touched"] += 1
+                    else:
+                        row = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                        if row is None:
+                            file_id = conn.execute("INSERT INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                                                   (path, mtime, size, digest)).lastrowid
+                            stats["added"] += 1
+                        else:
+                            file_id = row[0]
+                            conn.execute("UPDATE files SET mtime = ?, size = ?, hash = ? WHERE id = ?", (mtime, size, digest, file_id))
+                            conn.execute("DELETE FROM documents WHERE rowid = ?", (file_id,))
+                            stats["updated"] += 1
+                        conn.execute("INSERT INTO documents (rowid, title, body) VALUES (?, ?, ?)", (file_id, title, text))
+                    pending += 1
+                    if pending >= INDEX_BATCH:
+                        conn.commit()
+                        pending = 0
+
+                for path in removed:
+                    row = conn.execute("SELECT id FROM files WHERE path = ?", (path,)).fetchone()
+                    conn.execute("DELETE FROM documents WHERE rowid = ?", (row[0],))
+                    conn.execute("DELETE FROM files WHERE id = ?", (row[0],))
+                conn.commit()
+            finally:
+                conn.close()
+            stats["seconds"] = round(time.perf_counter() - started, 3)
+            self.refreshed_at = time.time()
+            self.last_refresh = stats
+            return stats
+
+    def refresh_if_stale(self):
+        """Refresh when LOCAL_INDEX_REFRESH has passed, unless another thread is already refreshing."""
+        if time.time() - self.refreshed_at < LOCAL_INDEX_REFRESH or self.refresh_lock.locked():
+            return
+        self.refresh()
+
+    def search(self, query: str, max_results: int = 3) -> Dict[str, List[Dict[str, str]]]:
+        """Return the documents best matching the query by BM25, in the search API response shape."""
+        expression = match_expression(query)
+        if not expression:
+            return {"results": []}
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT files.path, documents.title, snippet(documents, 1, '', '', ' ... ', {SNIPPET_WORDS}), "
+                "substr(documents.body, 1, ?) FROM documents JOIN files ON files.id = documents.rowid "
+                f"WHERE documents MATCH ? ORDER BY bm25(documents, {TITLE_WEIGHT}, {BODY_WEIGHT}) LIMIT ?",
+                (LOCAL_RAW_CHARS, expression, max_results),
+            ).fetchall()
+        return {"results": [
+            {"title": title, "url": Path(path).as_uri(), "content": snippet, "raw_content": body}
+            for path, title, snippet, body in rows
+        ]}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            documents = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return {"directory": self.directory, "index": self.path, "documents": documents, "last_refresh": self.last_refresh}
+
+_indexes: Dict[str, LocalIndex] = {}
+_indexes_lock = threading.Lock()
+
+def get_local_index(directory: str) -> LocalIndex:
+    """Return the shared index for a directory, opening it on first use."""
+    directory = os.path.abspath(directory)
+    with _indexes_lock:
+        index = _indexes.get(directory)
+        if index is None:
+            index = _indexes[directory] = LocalIndex(directory)
+        return index
+
+def search_local(directory: str, query: str, max_results: int = 3) -> Dict[str, List[Dict[str, str]]]:
+    """Search a directory's index, first bringing it up to date if it is stale."""
+    index = get_local_index(directory)
+    index.refresh_if_stale()
+    return index.search(query, max_results)
@@ -0,0 +1,203 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, NamedTuple, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Fetched pages are cached in this SQLite file across runs; set it to an
+# empty string to disable the cache
+PAGE_CACHE_DB = os.environ.get(
+    "PAGE_CACHE_DB", os.path.join(os.path.expanduser("~"), ".cache", "ollama-deep-researcher", "pages.sqlite")
+)
+# Seconds a page is served without revalidation, unless the site sends its own max-age
+PAGE_CACHE_TTL = float(os.environ.get("PAGE_CACHE_TTL", "86400"))
+# Compressed page bytes kept before the least recently used pages are evicted
+PAGE_CACHE_MAX_MB = float(os.environ.get("PAGE_CACHE_MAX_MB", "256"))
+
+# Query parameters that only track where a click came from
+TRACKING_PARAMS = re.compile(
+    r"^(utm_\w+|fbclid|gclid|dclid|gbraid|wbraid|msclkid|yclid|mc_cid|mc_eid|_ga|_gl|igshid|ref_src|spm)$", re.IGNORECASE
+)
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+def canonical_url(url: str) -> str:
+    """Normalize a URL so the same page is cached once however it was linked.
+
+    Lowercases the scheme and host, drops default ports, fragments and
+    tracking parameters, and sorts the remaining query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").rstrip(".")
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if not TRACKING_PARAMS.match(key))
+    return urlunsplit((scheme, host, parts.path or "/", urlencode(query), ""))
+
+def cache_ttl(headers) -> Optional[float]:
+    """Seconds a response may be served from cache, or None if it must not be stored.
+
+    no-cache and private responses get 0: they are stored, but revalidated
+    before every use.
+    """
+    cache_control = headers.get("cache-control", "").lower()
+    if "no-store" in cache_control:
+        return None
+    if re.search(r"\b(no-cache|private)\b", cache_control):
+        return 0.0
+    match = re.search(r"max-age=(\d+)", cache_control)
+    if match:
+        return float(match.group(1))
+    return PAGE_CACHE_TTL
+
+class CachedPage(NamedTuple):
+    url: str
+    body: bytes
+    content_type: str
+    etag: Optional[str]
+    last_modified: Optional[str]
+    expires_at: float
+    # Characters of text the download stopped at once it had enough, so the
+    # body ends mid-page; 0 when the whole page was read
+    truncated: int = 0
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> Dict[str, str]:
+        """Conditional request headers to revalidate this page."""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+class PageCache:
+    """Fetched page bodies by canonical URL, stored compressed in SQLite.
+
+    Pages are served as-is until they expire, then revalidated with their
+    ETag or Last-Modified so unchanged pages cost a 304 rather than a full
+    download. When the stored bytes exceed max_bytes the least recently used
+    pages are evicted. One connection is shared under a lock, like the
+    checkpointer; async callers run these methods in a worker thread.
+    """
+
+    def __init__(self, path: str, max_bytes: float = PAGE_CACHE_MAX_MB * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS pages (
+                key TEXT PRIMARY KEY, url TEXT NOT NULL, body BLOB NOT NULL, size INTEGER NOT NULL,
+                content_type TEXT, etag TEXT, last_modified TEXT,
+                fetched_at REAL NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL,
+                truncated INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        if "truncated" not in {row[1] for row in self.conn.execute("PRAGMA table_info(pages)")}:
+            # Caches written before truncated bodies were marked
+            self.conn.execute("ALTER TABLE pages ADD COLUMN truncated INTEGER NOT NULL DEFAULT 0")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self.conn.commit()
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+        self.counters = {"hits": 0, "misses": 0, "revalidated": 0, "changed": 0, "shared": 0, "stored": 0, "evicted": 0}
+
+    def count(self, counter: str):
+        with self.lock:
+            self.counters[counter] += 1
+
+    def get(self, key: str) -> Optional[CachedPage]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT url, body, content_type, etag, last_modified, expires_at, truncated FROM pages WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self.conn.execute("UPDATE pages SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.conn.commit()
+        url, body, content_type, etag, last_modified, expires_at, truncated = row
+        return CachedPage(url, zlib.decompress(body), content_type or "", etag, last_modified, expires_at, truncated)
+
+    def put(self, key: str, url: str, body: bytes, headers, ttl: float, truncated: int = 0):
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock:
+            previous = self.conn.execute("SELECT size FROM pages WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, url, compressed, len(compressed), headers.get("content-type"), headers.get("etag"),
+                 headers.get("last-modified"), now, now + ttl, now, int(truncated)),
+            )
+            self.total_bytes += len(compressed) - (previous[0] if previous else 0)
+            self.counters["stored"] += 1
+            self._evict()
+            self.conn.commit()
+
+    def touch(self, key: str, headers, ttl: float):
+        """Extend an unchanged page's lifetime after a 304, taking any new validators."""
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "UPDATE pages SET expires_at = ?, accessed_at = ?, etag = COALESCE(?, etag), "
+                "last_modified = COALESCE(?, last_modified) WHERE key = ?",
+                (now + ttl, now, headers.get("etag"), headers.get("last-modified"), key),
+            )
+            self.conn.commit()
+
+    def _evict(self):
+        # Called with the lock held; evicts down to 90% so a full cache is not trimmed on every store
+        if self.total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        for key, size in self.conn.execute("SELECT key, size FROM pages ORDER BY accessed_at").fetchall():
+            if self.total_bytes <= target:
+                break
+            self.conn.execute("DELETE FROM pages WHERE key = ?", (key,))
+            self.total_bytes -= size
+            self.counters["evicted"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            pages = self.conn.execute("SELECT COUNT(*) FROM pages").fetchone()[0]
+            counters = dict(self.counters)
+            total_bytes = self.total_bytes
+        lookups = counters["hits"] + counters["misses"] + counters["revalidated"] + counters["changed"]
+        return {
+            **counters,
+            "hit_ratio": round((counters["hits"] + counters["revalidated"]) / lookups, 3) if lookups else 0.0,
+            "pages": pages,
+            "size_mb": round(total_bytes / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+        }
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+
+def get_page_cache() -> Optional[PageCache]:
+    """Return the shared page cache, or None when PAGE_CACHE_DB is empty or cannot be opened."""
+    global _page_cache, PAGE_CACHE_DB
+    with _page_cache_lock:
+        if _page_cache is None and PAGE_CACHE_DB:
+            try:
+                _page_cache = PageCache(PAGE_CACHE_DB)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Warning: Page cache disabled, could not open {PAGE_CACHE_DB}: {str(e)}")
+                PAGE_CACHE_DB = ""
+        return _page_cache
+
+def page_cache_stats() -> Dict[str, Any]:
+    """Report page cache hits, misses, revalidations, shared downloads, evictions and size."""
+    cache = get_page_cache()
+    return cache.stats() if cache else {"enabled": False}
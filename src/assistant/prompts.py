@@ -1,9 +1,14 @@
-query_writer_instructions="""Your goal is to generate a targeted web search query.
-The query will gather information related to a specific topic.
+# Shared by every LLM call in a run. Node-specific instructions come after the
+# stable content (this message and the existing summary) so consecutive calls
+# share a byte-identical prefix that Ollama can serve from its prompt cache
+research_context_instructions="""You are an expert research assistant researching a topic with web search.
 
 <TOPIC>
 {research_topic}
-</TOPIC>
+</TOPIC>"""
+
+query_writer_instructions="""Your goal is to generate a targeted web search query.
+The query will gather information related to the research topic.
 
 <FORMAT>
 Format your response as a JSON object with ALL three of these exact keys:
@@ -23,6 +28,44 @@ Example output:
 
 Provide your response in JSON format:"""
 
+# JSON schemas passed as Ollama's `format` so the output has exactly these keys,
+# in this order. The key the graph uses comes first, so generation can be
+# stopped as soon as its value is complete.
+query_writer_schema = {
+    "type": "object",
+    "properties": {"query": {"type": "string"}, "aspect": {"type": "string"}, "rationale": {"type": "string"}},
+    "required": ["query", "aspect", "rationale"],
+}
+
+multi_query_writer_instructions="""Your goal is to generate {number_of_queries} targeted web search queries.
+The queries will be searched in parallel to gather information related to the research topic.
+
+<REQUIREMENTS>
+Each query should cover a different aspect of the topic so the results overlap as little as possible.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with these exact keys:
+   - "queries": A list of exactly {number_of_queries} search query strings
+   - "rationale": Brief explanation of how the queries cover the topic
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "queries": ["machine learning transformer architecture explained", "transformer model training cost benchmarks"],
+    "rationale": "Covers both the structure of transformer models and the practical cost of training them"
+}}
+</EXAMPLE>
+
+Provide your response in JSON format:"""
+
+multi_query_writer_schema = {
+    "type": "object",
+    "properties": {"queries": {"type": "array", "items": {"type": "string"}}, "rationale": {"type": "string"}},
+    "required": ["queries", "rationale"],
+}
+
 summarizer_instructions="""
 <GOAL>
 Generate a high-quality summary of the web search results and keep it concise / related to the user topic.
@@ -48,7 +91,45 @@ When EXTENDING an existing summary:
 - Start directly with the updated summary, without preamble or titles. Do not use XML tags in the output.  
 < /FORMATTING >"""
 
-reflection_instructions = """You are an expert research assistant analyzing a summary about {research_topic}.
+incremental_summarizer_instructions="""
+<GOAL>
+Update a research summary with new web search results by returning a patch. Keep it concise / related to the user topic.
+</GOAL>
+
+<INPUT>
+- An outline of the existing summary: the ID and opening sentence of every paragraph
+- The full text of the paragraphs most related to the new search results
+- The new search results
+</INPUT>
+
+<REQUIREMENTS>
+1. Read the outline, the related paragraphs and the new search results carefully.
+2. For each piece of new information:
+    a. If it's related to one of the related paragraphs, rewrite that paragraph to integrate it.
+    b. If it's entirely new but relevant, add a new paragraph after the paragraph it follows best.
+    c. If it's not relevant to the user topic or is already covered by the outline, skip it.
+3. Only rewrite paragraphs whose full text you were given. Leave every other paragraph out of the patch.
+4. Rewritten paragraphs must keep the information they already contained.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with these exact keys:
+- "updates": A list of objects with "id" (the paragraph ID) and "text" (the full rewritten paragraph)
+- "additions": A list of objects with "after" (ID of the paragraph the new one follows, or null to append it) and "text" (the new paragraph)
+Do not use XML tags in the paragraph text.
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{
+    "updates": [{"id": "s2", "text": "Transformers process all tokens in parallel using self-attention, which ..."}],
+    "additions": [{"after": "s3", "text": "Training cost grows quadratically with sequence length because ..."}]
+}
+</EXAMPLE>
+
+Provide your patch in JSON format:"""
+
+reflection_instructions = """Analyze the existing summary of the research topic.
 
 <GOAL>
 1. Identify knowledge gaps or areas that need deeper exploration
@@ -62,16 +143,77 @@ Ensure the follow-up question is self-contained and includes necessary context f
 
 <FORMAT>
 Format your response as a JSON object with these exact keys:
+- follow_up_query: Write a specific question to address the most important gap
 - knowledge_gap: Describe what information is missing or needs clarification
-- follow_up_query: Write a specific question to address this gap
 </FORMAT>
 
 <EXAMPLE>
 Example output:
 {{
-    "knowledge_gap": "The summary lacks information about performance metrics and benchmarks",
-    "follow_up_query": "What are typical performance benchmarks and metrics used to evaluate [specific technology]?"
+    "follow_up_query": "What are typical performance benchmarks and metrics used to evaluate [specific technology]?",
+    "knowledge_gap": "The summary lacks information about performance metrics and benchmarks"
 }}
 </EXAMPLE>
 
+Provide your analysis in JSON format:"""
+
+reflection_schema = {
+    "type": "object",
+    "properties": {"follow_up_query": {"type": "string"}, "knowledge_gap": {"type": "string"}},
+    "required": ["follow_up_query", "knowledge_gap"],
+}
+
+multi_reflection_instructions = """Analyze the existing summary of the research topic.
+
+<GOAL>
+1. Identify knowledge gaps or areas that need deeper exploration
+2. Generate {number_of_queries} follow-up questions that would help expand your understanding
+3. Focus on technical details, implementation specifics, or emerging trends that weren't fully covered
+</GOAL>
+
+<REQUIREMENTS>
+Ensure each follow-up question is self-contained and includes necessary context for web search.
+Each follow-up question should address a different gap so they can be searched in parallel.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with these exact keys:
+- follow_up_queries: A list of exactly {number_of_queries} specific questions, each addressing a different gap
+- knowledge_gap: Describe what information is missing or needs clarification
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "follow_up_queries": ["What are typical performance benchmarks for [specific technology]?", "How much does it cost to deploy [specific technology] in production?"],
+    "knowledge_gap": "The summary lacks information about performance metrics and deployment costs"
+}}
+</EXAMPLE>
+
+Provide your analysis in JSON format:"""
+
+multi_reflection_schema = {
+    "type": "object",
+    "properties": {"follow_up_queries": {"type": "array", "items": {"type": "string"}}, "knowledge_gap": {"type": "string"}},
+    "required": ["follow_up_queries", "knowledge_gap"],
+}
+
+draft_follow_up_instructions = """The existing summary is being updated with the new search results below. Predict the follow-up question that will be asked once it is done.
+
+<GOAL>
+1. Read the existing summary and the new search results
+2. Identify what will still be missing once the new results are added to the summary
+3. Generate a follow-up question that would fill that gap
+</GOAL>
+
+<REQUIREMENTS>
+Ensure the follow-up question is self-contained and includes necessary context for web search.
+</REQUIREMENTS>
+
+<FORMAT>
+Format your response as a JSON object with these exact keys:
+- follow_up_query: Write a specific question to address the most important remaining gap
+- knowledge_gap: Describe what information will still be missing
+</FORMAT>
+
 Provide your analysis in JSON format:"""
\ No newline at end of file
@@ -0,0 +1,146 @@
+import re
+from typing import Dict, List
+
+import numpy as np
+
+# Words per passage: short paragraphs are merged up to this size, longer ones split at sentences
+PASSAGE_WORDS = 120
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Weight of research topic terms relative to the search query's
+TOPIC_WEIGHT = 0.5
+# Marks passages left out between two selected ones
+PASSAGE_GAP = "\n\n[...]\n\n"
+
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from has have how i in is it its of on or should that the "
+    "their this to vs was were what when where which who why will with".split()
+)
+
+def terms(text: str) -> List[str]:
+    """Lowercased words of a text, without stopwords."""
+    return [word for word in re.findall(r"\w+", text.lower()) if word not in STOPWORDS]
+
+def _chunks(paragraph: str, max_words: int) -> List[str]:
+    # Split an oversized paragraph at sentence ends, and a run-on sentence at max_words
+    chunks, current, count = [], [], 0
+    for sentence in re.split(r"(?<=[.!?])\s+", paragraph):
+        words = sentence.split()
+        while len(words) > max_words:
+            chunks.append(" ".join(words[:max_words]))
+            words = words[max_words:]
+        if current and count + len(words) > max_words:
+            chunks.append(" ".join(current))
+            current, count = [], 0
+        current.append(" ".join(words))
+        count += len(words)
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+def split_passages(text: str, max_words: int = PASSAGE_WORDS) -> List[str]:
+    """Split text into passages of about max_words words, along paragraphs where possible.
+
+    Headings and short paragraphs are merged with the paragraphs after them,
+    so each passage keeps its context.
+    """
+    passages, current, count = [], [], 0
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        words = len(paragraph.split())
+        if current and count + words > max_words:
+            passages.append("\n\n".join(current))
+            current, count = [], 0
+        if words > max_words:
+            passages.extend(_chunks(paragraph, max_words))
+            continue
+        current.append(paragraph)
+        count += words
+    if current:
+        passages.append("\n\n".join(current))
+    return passages
+
+def bm25_scores(passages: List[List[str]], query_weights: Dict[str, float]) -> np.ndarray:
+    """Score tokenized passages against weighted query terms with BM25.
+
+    Term frequencies are counted into a passages x query-terms matrix in one
+    bincount, and the passages are scored as a single matrix-vector product.
+    Document frequencies come from the passages themselves, so terms common
+    to every passage count for little.
+
+    Args:
+        passages (list): Each passage as a list of terms
+        query_weights (dict): Query terms and their weights
+
+    Returns:
+        ndarray: One score per passage; 0 means no query term occurs in it
+    """
+    vocabulary = {term: column for column, term in enumerate(query_weights)}
+    rows, columns = [], []
+    for row, passage in enumerate(passages):
+        for term in passage:
+            column = vocabulary.get(term)
+            if column is not None:
+                rows.append(row)
+                columns.append(column)
+    n, width = len(passages), len(vocabulary)
+    cells = np.asarray(rows, dtype=np.int64) * width + np.asarray(columns, dtype=np.int64)
+    tf = np.bincount(cells, minlength=n * width).reshape(n, width).astype(float)
+
+    df = np.count_nonzero(tf, axis=0)
+    idf = np.log1p((n - df + 0.5) / (df + 0.5))
+    lengths = np.fromiter((len(passage) for passage in passages), dtype=float, count=n)
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / max(lengths.mean(), 1.0))
+    weights = np.fromiter(query_weights.values(), dtype=float, count=width)
+    return (tf * (BM25_K1 + 1) / (tf + norm[:, None])) @ (idf * weights)
+
+def select_passages(texts: List[str], query: str, topic: str, tokenizer, budget: int, max_passages: int) -> List[str]:
+    """Keep the passages of each text that best answer the query, within a token budget.
+
+    The passages of all texts are ranked together by BM25 against the query
+    and, at a lower weight, the research topic. The best are taken until the
+    budget or max_passages is reached; passages matching no term are never
+    taken. Each text is rebuilt from its chosen passages in their original
+    order, with a marker where passages were left out.
+
+    Args:
+        texts (list): Full contents, e.g. each source's raw_content
+        query (str): The search query
+        topic (str): The research topic
+        tokenizer: Counts tokens, from assistant.tokens.get_tokenizer
+        budget (int): Tokens the chosen passages may use in total
+        max_passages (int): Most passages to choose across all texts
+
+    Returns:
+        list: The chosen passages of each text, empty where none were chosen
+    """
+    weights = {term: TOPIC_WEIGHT for term in terms(topic)}
+    weights.update((term, 1.0) for term in terms(query))
+    passages = [(index, split_passages(text)) for index, text in enumerate(texts)]
+    flat = [(index, position, passage) for index, split in passages for position, passage in enumerate(split)]
+    if not weights or not flat:
+        return list(texts)
+
+    scores = bm25_scores([terms(passage) for _, _, passage in flat], weights)
+    chosen, used = [], 0
+    for row in np.argsort(-scores, kind="stable"):
+        if scores[row] <= 0 or len(chosen) >= max_passages:
+            break
+        tokens = tokenizer.count(flat[row][2])
+        if used + tokens <= budget:
+            chosen.append(flat[row])
+            used += tokens
+
+    selected = []
+    for index, _ in passages:
+        parts, previous = [], None
+        for _, position, passage in sorted(entry for entry in chosen if entry[0] == index):
+            if parts:
+                parts.append("\n\n" if position == previous + 1 else PASSAGE_GAP)
+            parts.append(passage)
+            previous = position
+        selected.append("".join(parts))
+    return selected
@@ -0,0 +1,178 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Dict, List, Optional
+
+# Requests each Ollama backend runs at once. Match the server's own
+# OLLAMA_NUM_PARALLEL so queued calls wait here, in priority order, rather
+# than in Ollama's FIFO queue.
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", "4"))
+
+# Admission lanes, served in this order. Interactive calls (Word edits,
+# /improve, /expand) are admitted ahead of queued research loop calls.
+INTERACTIVE = "interactive"
+RESEARCH = "research"
+LANES = (INTERACTIVE, RESEARCH)
+
+class _Waiter:
+    """A queued request, woken through a threading.Event or an asyncio future."""
+
+    def __init__(self, lane: str, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.lane = lane
+        self.enqueued = time.monotonic()
+        self.granted = False
+        self.loop = loop
+        self.event = None if loop else threading.Event()
+        self.future = loop.create_future() if loop else None
+
+class AdmissionScheduler:
+    """Caps in-flight LLM requests to one Ollama backend and admits queued ones by lane.
+
+    Sync callers block on an event and async callers await a future, so
+    graph runs on threads, async graph runs and API handlers all share the
+    same slots. A released slot goes straight to the next waiter in the
+    highest-priority lane, first come first served within a lane.
+    """
+
+    def __init__(self, base_url: str, capacity: int = OLLAMA_NUM_PARALLEL):
+        self.base_url = base_url
+        self.capacity = max(capacity, 1)
+        self.in_flight = 0
+        self._queue: List[Any] = []
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._admitted = {lane: 0 for lane in LANES}
+        self._wait_total = {lane: 0.0 for lane in LANES}
+        self._wait_max = {lane: 0.0 for lane in LANES}
+
+    def _record(self, lane: str, waited: float):
+        self._admitted[lane] += 1
+        self._wait_total[lane] += waited
+        self._wait_max[lane] = max(self._wait_max[lane], waited)
+
+    def _admit_now(self, lane: str) -> bool:
+        # Called with the lock held
+        if self.in_flight < self.capacity and not self._queue:
+            self.in_flight += 1
+            self._record(lane, 0.0)
+            return True
+        return False
+
+    def _enqueue(self, waiter: _Waiter):
+        heapq.heappush(self._queue, (LANES.index(waiter.lane), next(self._order), waiter))
+
+    def acquire(self, lane: str = RESEARCH):
+        """Block until a slot is free for a request in this lane."""
+        with self._lock:
+            if self._admit_now(lane):
+                return
+            waiter = _Waiter(lane)
+            self._enqueue(waiter)
+        waiter.event.wait()
+
+    async def aacquire(self, lane: str = RESEARCH):
+        """Wait without blocking the event loop until a slot is free for a request in this lane."""
+        with self._lock:
+            if self._admit_now(lane):
+                return
+            waiter = _Waiter(lane, asyncio.get_running_loop())
+            self._enqueue(waiter)
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            with self._lock:
+                if not waiter.granted:
+                    self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                    heapq.heapify(self._queue)
+                    raise
+            # Granted while being cancelled: if the future already holds the
+            # slot, hand it back; a cancelled future is handed back by _resolve
+            if waiter.future.done() and not waiter.future.cancelled():
+                self.release()
+            raise
+
+    def _resolve(self, waiter: _Waiter):
+        if waiter.future.cancelled():
+            self.release()
+        else:
+            waiter.future.set_result(None)
+
+    def release(self):
+        """Free a slot, passing it directly to the next waiter if there is one."""
+        with self._lock:
+            if not self._queue:
+                self.in_flight -= 1
+                return
+            _, _, waiter = heapq.heappop(self._queue)
+            waiter.granted = True
+            self._record(waiter.lane, time.monotonic() - waiter.enqueued)
+
+        if waiter.event is not None:
+            waiter.event.set()
+            return
+        try:
+            waiter.loop.call_soon_threadsafe(self._resolve, waiter)
+        except RuntimeError:
+            # The waiter's event loop has closed, so nobody will use the slot
+            self.release()
+
+    @contextmanager
+    def slot(self, lane: str = RESEARCH):
+        """Hold a slot for the duration of a sync request."""
+        self.acquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self, lane: str = RESEARCH):
+        """Hold a slot for the duration of an async request."""
+        await self.aacquire(lane)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            queued = {lane: 0 for lane in LANES}
+            for _, _, waiter in self._queue:
+                queued[waiter.lane] += 1
+            lanes = {
+                lane: {
+                    "queued": queued[lane],
+                    "admitted": self._admitted[lane],
+                    "avg_wait_ms": round(self._wait_total[lane] / self._admitted[lane] * 1000, 1) if self._admitted[lane] else 0.0,
+                    "max_wait_ms": round(self._wait_max[lane] * 1000, 1),
+                }
+                for lane in LANES
+            }
+            return {"capacity": self.capacity, "in_flight": self.in_flight, "queue_depth": len(self._queue), "lanes": lanes}
+
+_schedulers_lock = threading.Lock()
+_schedulers: Dict[str, AdmissionScheduler] = {}
+
+def get_scheduler(base_url: str) -> AdmissionScheduler:
+    """Return the admission scheduler shared by every LLM call to base_url."""
+    base_url = (base_url or "http://localhost:11434").rstrip("/")
+    with _schedulers_lock:
+        scheduler = _schedulers.get(base_url)
+        if scheduler is None:
+            scheduler = _schedulers[base_url] = AdmissionScheduler(base_url)
+        return scheduler
+
+def scheduler_stats() -> Dict[str, Dict[str, Any]]:
+    """Report in-flight requests, queue depth and per-lane wait times for every Ollama backend.
+
+    Returns:
+        dict: Per base URL capacity, in_flight, queue_depth and, for each lane,
+            the number queued and admitted and the average and max wait in milliseconds
+    """
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {scheduler.base_url: scheduler.stats() for scheduler in schedulers}
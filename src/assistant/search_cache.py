@@ -0,0 +1,251 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+# Search responses are cached in this SQLite file across runs and users;
+# set it to an empty string to keep only the in-memory tier
+SEARCH_CACHE_DB = os.environ.get(
+    "SEARCH_CACHE_DB", os.path.join(os.path.expanduser("~"), ".cache", "ollama-deep-researcher", "search.sqlite")
+)
+# Responses kept in memory, most recently used first
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "512"))
+# Seconds a response is reused, per provider; 0 disables caching for that provider.
+# Paid APIs are kept longer, as every miss costs credits.
+SEARCH_CACHE_TTLS = {
+    "duckduckgo": float(os.environ.get("SEARCH_CACHE_TTL_DUCKDUCKGO", "21600")),
+    "tavily": float(os.environ.get("SEARCH_CACHE_TTL_TAVILY", "86400")),
+    "perplexity": float(os.environ.get("SEARCH_CACHE_TTL_PERPLEXITY", "86400")),
+}
+# Stores between deletions of expired rows from the SQLite tier
+SEARCH_CACHE_PURGE_INTERVAL = 100
+
+def normalize_query(query: str) -> str:
+    """Lowercase a query and collapse its whitespace, so trivially different queries share a cache entry."""
+    return " ".join(query.lower().split())
+
+def cache_key(provider: str, query: str, max_results: Optional[int], include_raw_content: bool, text_chars: Optional[int] = None) -> str:
+    key = [provider, normalize_query(query), max_results, bool(include_raw_content)]
+    if text_chars:
+        # Full pages read to different lengths are different responses
+        key.append(text_chars)
+    return json.dumps(key)
+
+def _cacheable(response: Any) -> bool:
+    # Failed searches come back empty and should be retried, not cached
+    return isinstance(response, dict) and bool(response) and response.get("results") != []
+
+class _Abandoned(Exception):
+    """Tells the waiters of a coalesced search that its searcher was cancelled."""
+
+class SearchCache:
+    """Search responses by provider, normalized query and options, in an LRU and an optional SQLite tier.
+
+    Lookups try memory first, then SQLite, promoting disk hits into memory.
+    Identical searches running at the same time are coalesced: the first
+    caller searches and the others wait for its response. Responses are
+    stored as JSON, so every caller gets its own copy.
+    """
+
+    def __init__(self, path: Optional[str] = SEARCH_CACHE_DB, size: int = SEARCH_CACHE_SIZE):
+        self.size = max(size, 1)
+        self.lock = threading.Lock()
+        self.memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.conn = self._connect(path) if path else None
+        self._stores_since_purge = 0
+        self._in_flight: Dict[str, Future] = {}
+        self._async_in_flight: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+        self.counters: Dict[str, Dict[str, int]] = {}
+
+    def _connect(self, path: str) -> Optional[sqlite3.Connection]:
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS searches (key TEXT PRIMARY KEY, provider TEXT NOT NULL, "
+                "response TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.commit()
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Search cache kept in memory only, could not open {path}: {str(e)}")
+            return None
+
+    def count(self, provider: str, counter: str):
+        with self.lock:
+            counters = self.counters.setdefault(provider, {"memory_hits": 0, "disk_hits": 0, "coalesced": 0, "misses": 0})
+            counters[counter] += 1
+
+    def get(self, provider: str, key: str) -> Optional[Any]:
+        """Return a fresh cached response, or None."""
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[0] > now:
+                self.memory.move_to_end(key)
+                tier = "memory_hits"
+            else:
+                entry = None
+                if self.conn is not None:
+                    row = self.conn.execute("SELECT expires_at, response FROM searches WHERE key = ?", (key,)).fetchone()
+                    if row is not None and row[0] > now:
+                        entry = row
+                        self._remember(key, entry)
+                tier = "disk_hits"
+        if entry is None:
+            return None
+        self.count(provider, tier)
+        return json.loads(entry[1])
+
+    def _remember(self, key: str, entry: Tuple[float, str]):
+        # Called with the lock held
+        self.memory[key] = entry
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.size:
+            self.memory.popitem(last=False)
+
+    def put(self, provider: str, key: str, response: Any):
+        ttl = SEARCH_CACHE_TTLS.get(provider, 0)
+        if not ttl or not _cacheable(response):
+            return
+        entry = (time.time() + ttl, json.dumps(response))
+        with self.lock:
+            self._remember(key, entry)
+            if self.conn is None:
+                return
+            self.conn.execute("INSERT OR REPLACE INTO searches VALUES (?, ?, ?, ?)", (key, provider, entry[1], entry[0]))
+            self._stores_since_purge += 1
+            if self._stores_since_purge >= SEARCH_CACHE_PURGE_INTERVAL:
+                self._stores_since_purge = 0
+                self.conn.execute("DELETE FROM searches WHERE expires_at <= ?", (time.time(),))
+            self.conn.commit()
+
+    def search(self, provider: str, key: str, run: Callable[[], Any]) -> Tuple[Any, bool]:
+        """Return (response, cached), running the search only if no fresh or in-flight response exists."""
+        response = self.get(provider, key)
+        if response is not None:
+            return response, True
+
+        with self.lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+        if not leader:
+            self.count(provider, "coalesced")
+            return json.loads(json.dumps(future.result())), True
+
+        self.count(provider, "misses")
+        try:
+            response = run()
+            self.put(provider, key, response)
+            future.set_result(response)
+            return response, False
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                del self._in_flight[key]
+
+    async def asearch(self, provider: str, key: str, run: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """Async version of search; searches are coalesced within an event loop.
+
+        If the search being waited on is cancelled, e.g. as the losing side of
+        a hedged search, its waiters are not cancelled with it: they search
+        again, one of them taking over as the searcher.
+        """
+        while True:
+            response = await asyncio.to_thread(self.get, provider, key)
+            if response is not None:
+                return response, True
+
+            in_flight = self._async_in_flight.setdefault(asyncio.get_running_loop(), {})
+            future = in_flight.get(key)
+            if future is None:
+                break
+            try:
+                response = await asyncio.shield(future)
+            except _Abandoned:
+                continue
+            self.count(provider, "coalesced")
+            return json.loads(json.dumps(response)), True
+
+        future = in_flight[key] = asyncio.get_running_loop().create_future()
+        self.count(provider, "misses")
+        try:
+            response = await run()
+            await asyncio.to_thread(self.put, provider, key, response)
+            future.set_result(response)
+            return response, False
+        except asyncio.CancelledError:
+            future.set_exception(_Abandoned())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; retrieve the exception so asyncio does not log it
+            future.exception()
+            raise
+        finally:
+            del in_flight[key]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            providers = {provider: dict(counters) for provider, counters in self.counters.items()}
+            cached = len(self.memory)
+        report = {}
+        for provider, counters in providers.items():
+            lookups = sum(counters.values())
+            hits = lookups - counters["misses"]
+            report[provider] = {**counters, "hit_ratio": round(hits / lookups, 3) if lookups else 0.0}
+        return {"providers": report, "memory_entries": cached, "persistent": self.conn is not None}
+
+_search_cache: Optional[SearchCache] = None
+_search_cache_lock = threading.Lock()
+
+def get_search_cache() -> SearchCache:
+    """Return the search cache shared by every run in this process."""
+    global _search_cache
+    with _search_cache_lock:
+        if _search_cache is None:
+            _search_cache = SearchCache()
+        return _search_cache
+
+def cached_search(provider: str, query: str, max_results: Optional[int], include_raw_content: bool, run: Callable[[], Any],
+                  text_chars: Optional[int] = None) -> Dict[str, Any]:
+    """Run a search through the cache, marking the response with whether it was served without a request.
+
+    Args:
+        provider (str): The search API, which selects the TTL
+        query (str): The search query, normalized for the cache key
+        max_results (int, optional): Part of the cache key
+        include_raw_content (bool): Part of the cache key
+        run (callable): Performs the search and returns a JSON-serializable dict
+        text_chars (int, optional): Part of the cache key, for searches that fetch full pages
+
+    Returns:
+        dict: The response, with "cached" set to True when no search request was made
+    """
+    response, cached = get_search_cache().search(provider, cache_key(provider, query, max_results, include_raw_content, text_chars), run)
+    return {**response, "cached": cached}
+
+async def acached_search(provider: str, query: str, max_results: Optional[int], include_raw_content: bool, run: Callable[[], Awaitable[Any]],
+                         text_chars: Optional[int] = None) -> Dict[str, Any]:
+    """Async version of cached_search."""
+    response, cached = await get_search_cache().asearch(provider, cache_key(provider, query, max_results, include_raw_content, text_chars), run)
+    return {**response, "cached": cached}
+
+def search_cache_stats() -> Dict[str, Any]:
+    """Report memory and disk hits, coalesced searches, misses and hit ratio per provider."""
+    return get_search_cache().stats()
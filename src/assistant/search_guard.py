@@ -0,0 +1,271 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple, Type, TypeVar
+
+import httpx
+import requests
+
+T = TypeVar("T")
+
+# Requests per second allowed to each search provider, shared by every run in
+# this process; 0 disables pacing for that provider
+SEARCH_RATE_LIMITS = {
+    "duckduckgo": float(os.environ.get("SEARCH_RATE_DUCKDUCKGO", "1")),
+    "tavily": float(os.environ.get("SEARCH_RATE_TAVILY", "5")),
+    "perplexity": float(os.environ.get("SEARCH_RATE_PERPLEXITY", "1")),
+}
+# Requests a provider may receive at once after being idle
+SEARCH_RATE_BURST = float(os.environ.get("SEARCH_RATE_BURST", "3"))
+# Seconds a search may wait for its turn before it is rejected
+SEARCH_MAX_WAIT = float(os.environ.get("SEARCH_MAX_WAIT", "30"))
+# Retries of a search failing with a rate limit, server error or timeout
+SEARCH_MAX_RETRIES = int(os.environ.get("SEARCH_MAX_RETRIES", "3"))
+# Backoff before retry n is random up to min(SEARCH_BACKOFF_MAX, SEARCH_BACKOFF_BASE * 2**n) seconds
+SEARCH_BACKOFF_BASE = float(os.environ.get("SEARCH_BACKOFF_BASE", "1"))
+SEARCH_BACKOFF_MAX = float(os.environ.get("SEARCH_BACKOFF_MAX", "30"))
+# Consecutive failed searches that open a provider's circuit
+SEARCH_BREAKER_FAILURES = int(os.environ.get("SEARCH_BREAKER_FAILURES", "5"))
+# Seconds an open circuit rejects searches before letting one through to test the provider
+SEARCH_BREAKER_COOLDOWN = float(os.environ.get("SEARCH_BREAKER_COOLDOWN", "60"))
+
+# Circuit states
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# State transitions kept per provider for the stats
+TRANSITION_HISTORY = 20
+
+# Errors worth retrying whatever the provider's client library
+RETRYABLE_ERRORS = (httpx.TransportError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+class SearchUnavailable(Exception):
+    """A search was not attempted, or gave up, because the provider is rate limited or down."""
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked to wait before retrying, if it said."""
+    seconds = getattr(error, "retry_after_seconds", None)
+    response = getattr(error, "response", None)
+    if seconds is None and response is not None:
+        seconds = getattr(response, "headers", {}).get("retry-after")
+    try:
+        return float(seconds) if seconds is not None else None
+    except ValueError:
+        return None
+
+def is_retryable(error: BaseException, retry_on: Tuple[Type[BaseException], ...] = ()) -> bool:
+    """Whether an error is transient: HTTP 429 or 5xx, a timeout, a dropped connection, or one of retry_on."""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(error, RETRYABLE_ERRORS + tuple(retry_on))
+
+def backoff_delay(attempt: int, error: BaseException) -> float:
+    """Full-jitter exponential backoff, but at least what the provider asked for."""
+    delay = random.uniform(0, min(SEARCH_BACKOFF_MAX, SEARCH_BACKOFF_BASE * 2 ** attempt))
+    asked = retry_after(error)
+    return min(max(delay, asked), SEARCH_BACKOFF_MAX) if asked is not None else delay
+
+class ProviderGuard:
+    """Token bucket pacing and a circuit breaker for one search provider.
+
+    The bucket refills at rate tokens per second up to burst. A search takes
+    a token, waiting its turn if none is left; tokens may go negative so
+    waiting searches queue up in order. The circuit opens after
+    SEARCH_BREAKER_FAILURES consecutive failed searches and rejects searches
+    without calling the provider for SEARCH_BREAKER_COOLDOWN seconds. It then
+    half-opens: one search is let through, closing the circuit if it
+    succeeds and opening it again if it fails.
+    """
+
+    def __init__(self, provider: str, rate: float, burst: float = SEARCH_RATE_BURST):
+        self.provider = provider
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self.counters = {"attempts": 0, "succeeded": 0, "failed": 0, "errors": 0, "retries": 0, "throttled": 0,
+                         "rejected_rate_limit": 0, "rejected_open": 0}
+        self.wait_seconds = 0.0
+        self.transitions: Deque[Dict[str, Any]] = deque(maxlen=TRANSITION_HISTORY)
+
+    def _transition(self, state: str, reason: str):
+        # Called with the lock held
+        if state == self.state:
+            return
+        self.transitions.append({"from": self.state, "to": state, "at": time.time(), "reason": reason})
+        print(f"Warning: {self.provider} search circuit {self.state} -> {state}: {reason}")
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+
+    def admit(self) -> float:
+        """Check the circuit and take a token, returning how long to wait before searching.
+
+        Raises:
+            SearchUnavailable: The circuit is open, or the wait would exceed SEARCH_MAX_WAIT
+        """
+        with self.lock:
+            self.counters["attempts"] += 1
+            if self.state == OPEN and time.monotonic() - self.opened_at >= SEARCH_BREAKER_COOLDOWN:
+                self._transition(HALF_OPEN, "cooldown over, testing with one search")
+            if self.state == OPEN or (self.state == HALF_OPEN and self.trial_running):
+                self.counters["rejected_open"] += 1
+                raise SearchUnavailable(f"{self.provider} search circuit is open after {self.failures} consecutive failures")
+            if self.rate <= 0:
+                wait = 0.0
+            else:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                wait = max(0.0, (1 - self.tokens) / self.rate)
+                if wait > SEARCH_MAX_WAIT:
+                    self.counters["rejected_rate_limit"] += 1
+                    raise SearchUnavailable(f"{self.provider} search would wait {wait:.1f}s for its rate limit")
+                self.tokens -= 1
+                if wait > 0:
+                    self.counters["throttled"] += 1
+                    self.wait_seconds += wait
+            if self.state == HALF_OPEN:
+                self.trial_running = True
+            return wait
+
+    def release(self):
+        """Give up an admitted search that was interrupted before it answered, e.g. cancelled.
+
+        This says nothing about the provider's health, but frees a half-open
+        circuit for the next test search.
+        """
+        with self.lock:
+            self.trial_running = False
+
+    def record_retry(self):
+        with self.lock:
+            self.counters["retries"] += 1
+
+    def record_success(self, counter: str = "succeeded"):
+        """Count a search the provider answered, closing the circuit.
+
+        A non-transient error such as a bad API key is an answer too, and is
+        recorded here under the "errors" counter: it shows the provider is up.
+        """
+        with self.lock:
+            self.trial_running = False
+            self.counters[counter] += 1
+            self.failures = 0
+            self._transition(CLOSED, "search succeeded")
+
+    def record_failure(self, reason: str):
+        """Count a search that failed transiently, toward opening the circuit."""
+        with self.lock:
+            self.trial_running = False
+            self.counters["failed"] += 1
+            self.failures += 1
+            if self.state == HALF_OPEN:
+                self._transition(OPEN, f"test search failed: {reason}")
+            elif self.failures >= SEARCH_BREAKER_FAILURES:
+                self._transition(OPEN, f"{self.failures} consecutive failures, last: {reason}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.failures,
+                **self.counters,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "rate_per_second": self.rate,
+                "transitions": list(self.transitions),
+            }
+
+_guards: Dict[str, ProviderGuard] = {}
+_guards_lock = threading.Lock()
+
+def get_guard(provider: str) -> ProviderGuard:
+    """Return the guard for a provider, shared by every run in this process."""
+    with _guards_lock:
+        guard = _guards.get(provider)
+        if guard is None:
+            guard = _guards[provider] = ProviderGuard(provider, SEARCH_RATE_LIMITS.get(provider, 0))
+        return guard
+
+def guarded_call(provider: str, call: Callable[[], T], retry_on: Tuple[Type[BaseException], ...] = ()) -> T:
+    """Call a provider under its rate limit and circuit breaker, retrying transient errors with backoff.
+
+    Args:
+        provider (str): The search API, which selects the rate limit and circuit
+        call (callable): Makes one request to the provider
+        retry_on (tuple): Provider-specific exception types that are also transient
+
+    Returns:
+        The call's return value
+
+    Raises:
+        SearchUnavailable: The circuit is open, the rate limit wait is too long,
+            or the call still failed transiently after SEARCH_MAX_RETRIES retries
+        Exception: Any error that is not transient, e.g. a bad API key, unchanged
+    """
+    guard = get_guard(provider)
+    for attempt in range(SEARCH_MAX_RETRIES + 1):
+        wait = guard.admit()
+        try:
+            if wait:
+                time.sleep(wait)
+            result = call()
+        except Exception as e:
+            if not is_retryable(e, retry_on):
+                guard.record_success(counter="errors")
+                raise
+            guard.record_failure(f"{type(e).__name__}: {e}")
+            if attempt == SEARCH_MAX_RETRIES:
+                raise SearchUnavailable(f"{provider} search failed after {attempt + 1} attempts: {e}") from e
+            guard.record_retry()
+            time.sleep(backoff_delay(attempt, e))
+            continue
+        except BaseException:
+            guard.release()
+            raise
+        guard.record_success()
+        return result
+
+async def aguarded_call(provider: str, call: Callable[[], Awaitable[T]], retry_on: Tuple[Type[BaseException], ...] = ()) -> T:
+    """Async version of guarded_call."""
+    guard = get_guard(provider)
+    for attempt in range(SEARCH_MAX_RETRIES + 1):
+        wait = guard.admit()
+        try:
+            if wait:
+                await asyncio.sleep(wait)
+            result = await call()
+        except Exception as e:
+            if not is_retryable(e, retry_on):
+                guard.record_success(counter="errors")
+                raise
+            guard.record_failure(f"{type(e).__name__}: {e}")
+            if attempt == SEARCH_MAX_RETRIES:
+                raise SearchUnavailable(f"{provider} search failed after {attempt + 1} attempts: {e}") from e
+            guard.record_retry()
+            await asyncio.sleep(backoff_delay(attempt, e))
+            continue
+        except BaseException:
+            # Cancelled, e.g. as the losing side of a hedged search, while
+            # waiting for its turn or for the answer
+            guard.release()
+            raise
+        guard.record_success()
+        return result
+
+def search_guard_stats() -> Dict[str, Dict[str, Any]]:
+    """Report circuit state, recent state transitions, retries, throttling and rejections per search provider."""
+    with _guards_lock:
+        guards = list(_guards.values())
+    return {guard.provider: guard.stats() for guard in guards}
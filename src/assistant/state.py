@@ -2,6 +2,10 @@ import operator
 from dataclasses import dataclass, field
 from typing_extensions import TypedDict, Annotated
 
+def add_or_clear(existing: list, update: list) -> list:
+    """ Reducer that appends, or empties the list when the update is None """
+    return [] if update is None else existing + update
+
 @dataclass(kw_only=True)
 class SummaryState:
     research_topic: str = field(default=None) # Report topic     
@@ -10,6 +14,34 @@ class SummaryState:
     sources_gathered: Annotated[list, operator.add] = field(default_factory=list) 
     research_loop_count: int = field(default=0) # Research loop count
     running_summary: str = field(default=None) # Final report
+    search_queries: list = field(default_factory=list) # Queries fanned out in parallel this loop
+    search_branch_results: Annotated[list, add_or_clear] = field(default_factory=list) # Results of this loop's parallel searches, cleared once merged
+    search_timings: Annotated[list, operator.add] = field(default_factory=list) # Per-loop parallel search timings
+    speculative_results: dict = field(default=None) # Results prefetched for the drafted follow-up query
+    speculation_stats: Annotated[list, operator.add] = field(default_factory=list) # Per-loop prefetch hits and misses
+    speculation_report: dict = field(default=None) # Prefetch hit rate and time saved for the run
+    seen_urls: Annotated[list, operator.add] = field(default_factory=list) # URLs returned by earlier loops
+    content_shingles: Annotated[list, operator.add] = field(default_factory=list) # Hashed word shingles of earlier loops' content
+    source_registry: Annotated[list, operator.add] = field(default_factory=list) # Canonical URL and content SimHash of every source summarized
+    source_novelty: Annotated[list, operator.add] = field(default_factory=list) # Per-loop fraction of new URLs and content
+    summary_changes: Annotated[list, operator.add] = field(default_factory=list) # Per-loop change between consecutive summaries
+    stop_reason: str = field(default=None) # Why the research loop stopped
+    loops_saved: int = field(default=0) # Research loops skipped by stopping early
+    summary_sections: list = field(default_factory=list) # Summary paragraphs with IDs, for incremental updates
+    ollama_backend: str = field(default=None) # Ollama endpoint serving this run, kept for prompt cache reuse
+    node_timings: Annotated[list, operator.add] = field(default_factory=list) # Wall-clock time of each node run
+    llm_calls: Annotated[list, operator.add] = field(default_factory=list) # Ollama token counts and timings per LLM call
+    search_calls: Annotated[int, operator.add] = field(default=0) # Search API requests made, including prefetches
+    search_cache_hits: Annotated[int, operator.add] = field(default=0) # Searches answered by the search cache
+    search_hedges: Annotated[int, operator.add] = field(default=0) # Searches also sent to the hedge search API
+    search_cache_report: dict = field(default=None) # Search cache hits and hit ratio for the run
+    search_hedge_report: dict = field(default=None) # Searches hedged and hedge rate for the run
+    prompt_cache_report: dict = field(default=None) # Per-node prompt evaluation and estimated prompt cache savings
+    json_early_exit_report: dict = field(default=None) # Per-node tokens and time saved by stopping structured calls early
+
+class SearchBranchState(TypedDict):
+    search_query: str # Query searched by this branch
+    research_loop_count: int # Loop the branch belongs to
 
 @dataclass(kw_only=True)
 class SummaryStateInput:
@@ -17,4 +49,16 @@ class SummaryStateInput:
 
 @dataclass(kw_only=True)
 class SummaryStateOutput:
-    running_summary: str = field(default=None) # Final report
\ No newline at end of file
+    running_summary: str = field(default=None) # Final report
+    search_timings: list = field(default_factory=list) # Per-loop parallel search timings
+    speculation_report: dict = field(default=None) # Prefetch hit rate and time saved for the run
+    stop_reason: str = field(default=None) # Why the research loop stopped
+    loops_saved: int = field(default=0) # Research loops skipped by stopping early
+    source_novelty: list = field(default_factory=list) # Per-loop fraction of new URLs and content
+    summary_changes: list = field(default_factory=list) # Per-loop change between consecutive summaries
+    node_latency: dict = field(default=None) # Per-node call count, latency and model
+    prompt_cache_report: dict = field(default=None) # Per-node prompt evaluation and estimated prompt cache savings
+    json_early_exit_report: dict = field(default=None) # Per-node tokens and time saved by stopping structured calls early
+    search_calls: int = field(default=0) # Search API requests made, including prefetches
+    search_cache_report: dict = field(default=None) # Search cache hits and hit ratio for the run
+    search_hedge_report: dict = field(default=None) # Searches hedged and hedge rate for the run
@@ -0,0 +1,227 @@
+import functools
+import hashlib
+import math
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+# Context window the Ollama server gives models when a request does not set
+# num_ctx; match the server's own OLLAMA_CONTEXT_LENGTH
+OLLAMA_CONTEXT_LENGTH = int(os.environ.get("OLLAMA_CONTEXT_LENGTH", "4096"))
+# tiktoken encoding to count tokens with, overriding the one picked from the model name
+TOKENIZER_ENCODING = os.environ.get("TOKENIZER_ENCODING", "")
+
+# tiktoken encodings closest to each model family's tokenizer. Llama 3 extends
+# cl100k_base, so its counts are near exact; for other families the counts
+# are closer than a character estimate but not exact.
+MODEL_ENCODINGS = (
+    ("gpt-oss", "o200k_base"),
+    ("llama3", "cl100k_base"),
+    ("llama-3", "cl100k_base"),
+    ("deepseek", "cl100k_base"),
+    ("qwen", "cl100k_base"),
+    ("phi", "cl100k_base"),
+)
+DEFAULT_ENCODING = "cl100k_base"
+# Characters per token when no tokenizer can be loaded
+CHARS_PER_TOKEN = 4
+
+class CharTokenizer:
+    """Estimates tokens from characters, for when tiktoken is missing or its encoding cannot be downloaded."""
+
+    name = f"{CHARS_PER_TOKEN} chars/token"
+
+    def count(self, text: str) -> int:
+        return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        return text[:max(max_tokens, 0) * CHARS_PER_TOKEN]
+
+# Token counts and encodings cached per tokenizer. One prompt assembly counts
+# each source for the budget and then truncates it, so the caches only need
+# to span the sources of a few searches
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("TOKEN_COUNT_CACHE_SIZE", "64"))
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "16"))
+# Tokens held by the encoding cache at most, so a few huge pages cannot pin memory
+TOKEN_CACHE_MAX_TOKENS = int(os.environ.get("TOKEN_CACHE_MAX_TOKENS", str(256 * 1024)))
+
+class _DigestCache:
+    """LRU of values computed from texts, keyed by a digest so the texts themselves are not kept.
+
+    With max_weight, the entries' total weigh() is bounded too, and values
+    heavier than that on their own are not cached at all.
+    """
+
+    def __init__(self, compute: Callable[[str], object], size: int, max_weight: Optional[int] = None, weigh: Callable[[object], int] = len):
+        self.compute = compute
+        self.size = max(size, 1)
+        self.max_weight = max_weight
+        self.weigh = weigh if max_weight is not None else (lambda value: 0)
+        self.weight = 0
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[bytes, object]" = OrderedDict()
+
+    def __call__(self, text: str):
+        key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        value = self.compute(text)
+        weight = self.weigh(value)
+        if self.max_weight is not None and weight > self.max_weight:
+            return value
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = value
+                self.weight += weight
+            while len(self.entries) > self.size or (self.max_weight is not None and self.weight > self.max_weight):
+                self.weight -= self.weigh(self.entries.popitem(last=False)[1])
+        return value
+
+class TiktokenTokenizer:
+    """Counts tokens with a tiktoken encoding; counts of recently seen texts are cached.
+
+    The tokens of the last few texts are cached too, so a source counted
+    for the budget and then truncated is only encoded once. Both caches are
+    keyed by a digest of the text, so they do not keep pages alive.
+    """
+
+    def __init__(self, encoding_name: str):
+        import tiktoken
+
+        self.name = encoding_name
+        self.encoding = tiktoken.get_encoding(encoding_name)
+        self.tokens = _DigestCache(self._encode, TOKEN_CACHE_SIZE, TOKEN_CACHE_MAX_TOKENS)
+        self.count = _DigestCache(self._count, TOKEN_COUNT_CACHE_SIZE)
+
+    def _encode(self, text: str) -> List[int]:
+        return self.encoding.encode(text, disallowed_special=())
+
+    def _count(self, text: str) -> int:
+        return len(self.tokens(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.tokens(text)
+        if len(tokens) <= max_tokens:
+            return text
+        # Tokens are pieces of the text's UTF-8 bytes, so the first max_tokens
+        # of them cover a prefix of it; a character split by the cut is dropped
+        size = len(self.encoding.decode_bytes(tokens[:max(max_tokens, 0)]))
+        return text.encode("utf-8")[:size].decode("utf-8", "ignore")
+
+def model_encoding(model: str) -> str:
+    """The tiktoken encoding for an Ollama model name, e.g. llama3.2:3b."""
+    if TOKENIZER_ENCODING:
+        return TOKENIZER_ENCODING
+    name = model.lower()
+    for prefix, encoding in MODEL_ENCODINGS:
+        if name.startswith(prefix):
+            return encoding
+    return DEFAULT_ENCODING
+
+@functools.lru_cache(maxsize=None)
+def _load_tokenizer(encoding_name: str):
+    try:
+        return TiktokenTokenizer(encoding_name)
+    except Exception as e:
+        print(f"Warning: Counting tokens as {CharTokenizer.name}, could not load the {encoding_name} tokenizer: {str(e)}")
+        return CharTokenizer()
+
+def get_tokenizer(model: str):
+    """Return the shared tokenizer for a model, loaded once per encoding."""
+    return _load_tokenizer(model_encoding(model))
+
+_context_lock = threading.Lock()
+_trained_context: Dict[Tuple[str, str], Optional[int]] = {}
+# Seconds to wait for /api/show
+SHOW_TIMEOUT = 5
+
+def _context_length(response: httpx.Response) -> Optional[int]:
+    response.raise_for_status()
+    info = response.json().get("model_info") or {}
+    lengths = [value for name, value in info.items() if name.endswith(".context_length")]
+    return int(lengths[0]) if lengths else None
+
+def _remember_context_length(key: Tuple[str, str], length: Optional[int]) -> Optional[int]:
+    with _context_lock:
+        _trained_context[key] = length
+    return length
+
+def trained_context_length(base_url: str, model: str) -> Optional[int]:
+    """The context length a model was trained with, from Ollama's /api/show, or None if unknown.
+
+    Answers are cached per server and model; failed lookups are not, so the
+    next call asks again.
+    """
+    key = (base_url.rstrip("/"), model)
+    with _context_lock:
+        if key in _trained_context:
+            return _trained_context[key]
+    try:
+        length = _context_length(httpx.post(f"{key[0]}/api/show", json={"model": model}, timeout=SHOW_TIMEOUT))
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Warning: Could not read the context length of {model}: {str(e)}")
+        return None
+    return _remember_context_length(key, length)
+
+async def atrained_context_length(base_url: str, model: str) -> Optional[int]:
+    """Async version of trained_context_length."""
+    key = (base_url.rstrip("/"), model)
+    with _context_lock:
+        if key in _trained_context:
+            return _trained_context[key]
+    try:
+        async with httpx.AsyncClient(timeout=SHOW_TIMEOUT) as client:
+            length = _context_length(await client.post(f"{key[0]}/api/show", json={"model": model}))
+    except (httpx.HTTPError, ValueError) as e:
+        print(f"Warning: Could not read the context length of {model}: {str(e)}")
+        return None
+    return _remember_context_length(key, length)
+
+def context_window(base_url: str, model: str, num_ctx: int = 0) -> int:
+    """Tokens a model can attend to per call: the requested num_ctx, or the server default, capped at its trained length."""
+    window = num_ctx or OLLAMA_CONTEXT_LENGTH
+    trained = trained_context_length(base_url, model)
+    return min(window, trained) if trained else window
+
+async def acontext_window(base_url: str, model: str, num_ctx: int = 0) -> int:
+    """Async version of context_window."""
+    window = num_ctx or OLLAMA_CONTEXT_LENGTH
+    trained = await atrained_context_length(base_url, model)
+    return min(window, trained) if trained else window
+
+def truncate_to_tokens(text: str, max_tokens: int, tokenizer) -> str:
+    """Cut text to at most max_tokens, at the last sentence boundary that fits.
+
+    The text is encoded once: the cut is the prefix its first max_tokens
+    tokens cover, moved back to the last sentence end within it. A first
+    sentence longer than the limit is cut at the last whole word.
+    """
+    cut = tokenizer.truncate(text, max_tokens)
+    if len(cut) >= len(text):
+        return text
+    # Searched from the end, as only the last sentence end matters
+    end = max(cut.rfind("\n"), *(cut.rfind(mark + " ") + 1 for mark in ".!?"))
+    if cut[:end].strip():
+        return cut[:end].rstrip()
+    return cut.rsplit(None, 1)[0] if " " in cut.strip() else cut
+
+def allocate_budget(needs: List[int], budget: int) -> List[int]:
+    """Split a token budget across items needing needs[i] tokens each.
+
+    Every item is offered an equal share; items needing less give the
+    remainder to the rest, so short sources are kept whole and long ones
+    share what is left.
+    """
+    allotments = [0] * len(needs)
+    remaining = max(budget, 0)
+    order = sorted(range(len(needs)), key=lambda index: needs[index])
+    for position, index in enumerate(order):
+        share = remaining // (len(order) - position)
+        allotments[index] = min(needs[index], share)
+        remaining -= allotments[index]
+    return allotments
@@ -1,20 +1,48 @@
+import asyncio
+import difflib
+import hashlib
+import json
 import os
+import re
+import zlib
+import httpx
+import numpy as np
 import requests
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from langsmith import traceable
-from tavily import TavilyClient
+from tavily import AsyncTavilyClient, TavilyClient
 from duckduckgo_search import DDGS
+from duckduckgo_search.exceptions import RatelimitException, TimeoutException
+from tavily.errors import TimeoutError as TavilyTimeoutError
 
-def deduplicate_and_format_sources(search_response, max_tokens_per_source, include_raw_content=False):
+from assistant.fetch import afetch_pages, fetch_pages
+from assistant.local_index import search_local
+from assistant.page_cache import canonical_url
+from assistant.rerank import select_passages
+from assistant.search_cache import acached_search, cached_search
+from assistant.search_guard import SearchUnavailable, aguarded_call, guarded_call
+from assistant.tokens import CharTokenizer, allocate_budget, truncate_to_tokens
+
+def deduplicate_and_format_sources(search_response, max_tokens_per_source=1000, include_raw_content=False, token_budget=None, tokenizer=None,
+                                   query=None, topic="", max_passages=12):
     """
     Takes either a single search response or list of responses from search APIs and formats them.
-    Limits the raw_content to approximately max_tokens_per_source.
+    Limits the raw_content to max_tokens_per_source, or when token_budget is given, packs the
+    raw_content of all sources into what is left of the budget after the titles, URLs and snippets.
+    With a query and a token_budget, only the raw_content passages that best match the query are packed.
     include_raw_content specifies whether to include the raw_content from Tavily in the formatted string.
     
     Args:
         search_response: Either:
             - A dict with a 'results' key containing a list of search results
             - A list of dicts, each containing search results
+        max_tokens_per_source (int): Token limit per source when no token_budget is given
+        include_raw_content (bool): Whether to include each source's raw_content
+        token_budget (int, optional): Tokens the whole formatted string may use
+        tokenizer (optional): Counts tokens, from assistant.tokens.get_tokenizer; defaults to a character estimate
+        query (str, optional): Search query the raw_content passages are ranked against
+        topic (str): Research topic, ranked against at a lower weight
+        max_passages (int): Most passages kept across all sources when ranking
             
     Returns:
         str: Formatted string with deduplicated sources
@@ -37,26 +65,277 @@ def deduplicate_and_format_sources(search_response, max_tokens_per_source, inclu
     for source in sources_list:
         if source['url'] not in unique_sources:
             unique_sources[source['url']] = source
-    
-    # Format output
-    formatted_text = "Sources:\n\n"
-    for i, source in enumerate(unique_sources.values(), 1):
-        formatted_text += f"Source {source['title']}:\n===\n"
-        formatted_text += f"URL: {source['url']}\n===\n"
-        formatted_text += f"Most relevant content from source: {source['content']}\n===\n"
-        if include_raw_content:
-            # Using rough estimate of 4 characters per token
-            char_limit = max_tokens_per_source * 4
+    sources = list(unique_sources.values())
+    tokenizer = tokenizer or CharTokenizer()
+
+    headers = [
+        f"Source {source['title']}:\n===\nURL: {source['url']}\n===\nMost relevant content from source: {source['content']}\n===\n"
+        for source in sources
+    ]
+    raw_contents = []
+    if include_raw_content:
+        for source in sources:
             # Handle None raw_content
             raw_content = source.get('raw_content', '')
             if raw_content is None:
                 raw_content = ''
                 print(f"Warning: No raw_content found for source {source['url']}")
-            if len(raw_content) > char_limit:
-                raw_content = raw_content[:char_limit] + "... [truncated]"
-            formatted_text += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n"
+            raw_contents.append(raw_content)
+
+    if token_budget is None:
+        limits = [max_tokens_per_source] * len(raw_contents)
+    else:
+        # Spread what the snippets leave of the budget across the full contents;
+        # sources shorter than their share pass the rest on to longer ones
+        label_tokens = tokenizer.count("Full source content limited to 10000 tokens: ... [truncated]\n\n")
+        fixed_tokens = tokenizer.count("Sources:\n\n" + "".join(headers)) + label_tokens * len(raw_contents)
+        if query and raw_contents:
+            raw_contents = select_passages(raw_contents, query, topic, tokenizer, token_budget - fixed_tokens, max_passages)
+        limits = allocate_budget([tokenizer.count(raw_content) for raw_content in raw_contents], token_budget - fixed_tokens)
+
+    # Format output in one pass, joining the parts once
+    parts = ["Sources:\n\n"]
+    for i, header in enumerate(headers):
+        parts.append(header)
+        if include_raw_content:
+            raw_content = raw_contents[i]
+            truncated = truncate_to_tokens(raw_content, limits[i], tokenizer)
+            # A packed source that got no share, or no matching passage, is left at its snippet
+            if token_budget is not None and not truncated:
+                continue
+            if len(truncated) < len(raw_content):
+                truncated += "... [truncated]"
+            if query and token_budget is not None:
+                parts.append(f"Most relevant passages of the full source content: {truncated}\n\n")
+            else:
+                parts.append(f"Full source content limited to {limits[i]} tokens: {truncated}\n\n")
                 
-    return formatted_text.strip()
+    return "".join(parts).strip()
+
+def _mix64(hashes: np.ndarray) -> np.ndarray:
+    # The splitmix64 finalizer, so every bit of a combined hash depends on every input bit
+    hashes = hashes ^ (hashes >> np.uint64(30))
+    hashes = hashes * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = hashes ^ (hashes >> np.uint64(27))
+    hashes = hashes * np.uint64(0x94D049BB133111EB)
+    return hashes ^ (hashes >> np.uint64(31))
+
+def simhash(text: str, size: int = 3, min_words: int = 24, max_words: int = 2000) -> Optional[int]:
+    """64-bit SimHash of a text's word n-grams; near-duplicate texts differ in only a few bits.
+
+    Args:
+        text (str): The text to fingerprint
+        size (int): Number of words per n-gram
+        min_words (int): Texts with fewer words are too short to fingerprint reliably
+        max_words (int): Only the first max_words words are used
+
+    Returns:
+        int: The fingerprint, or None for texts shorter than min_words
+    """
+    words = re.findall(r"\w+", text.lower())[:max_words]
+    if len(words) < min_words:
+        return None
+    # Hash each distinct word once, then combine the hashes of every run of
+    # size words, rotated by position so word order counts, into a shingle
+    # hash. Repeated shingles are only counted once.
+    hashes = {word: int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "big") for word in set(words)}
+    word_hashes = np.array([hashes[word] for word in words], dtype=np.uint64)
+    count = len(words) - size + 1
+    shingles = word_hashes[:count].copy()
+    for offset in range(1, size):
+        rotation = np.uint64(offset * 21 % 64)
+        hashes = word_hashes[offset:offset + count]
+        shingles ^= (hashes << rotation) | (hashes >> (np.uint64(64) - rotation))
+    shingles = np.unique(_mix64(shingles))
+    # Unpack the hashes into a shingles x 64 bit matrix and take a majority
+    # vote per bit position, most significant first
+    bits = np.unpackbits(shingles.astype(">u8").view(np.uint8)).reshape(-1, 64)
+    return int.from_bytes(np.packbits(2 * bits.sum(axis=0, dtype=np.int64) > len(shingles)).tobytes(), "big")
+
+def novel_sources(results: List[Dict[str, Any]], registry: List[Dict[str, Any]], max_distance: int = 3) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Drop sources that repeat one in the registry or earlier in results.
+
+    A source repeats another when their canonical URLs match, or when the
+    SimHash of their content is within max_distance bits, which catches the
+    same article on mirrors, AMP pages and syndication sites.
+
+    Args:
+        results (list): Search results with 'url', 'content' and optional 'raw_content'
+        registry (list): Entries for sources already kept, as returned by earlier calls
+        max_distance (int): Most SimHash bits a near-duplicate may differ by
+
+    Returns:
+        tuple: The novel results, and the registry entries to add for them
+    """
+    seen_urls = {entry["url"] for entry in registry}
+    fingerprints = [int(entry["simhash"], 16) for entry in registry if entry["simhash"]]
+    novel, entries = [], []
+    for source in results:
+        url = canonical_url(source["url"])
+        if url in seen_urls:
+            continue
+        fingerprint = simhash(source.get("raw_content") or source.get("content") or "")
+        if fingerprint is not None and any(bin(fingerprint ^ other).count("1") <= max_distance for other in fingerprints):
+            continue
+        novel.append(source)
+        entries.append({"url": url, "simhash": None if fingerprint is None else f"{fingerprint:016x}"})
+        seen_urls.add(url)
+        if fingerprint is not None:
+            fingerprints.append(fingerprint)
+    return novel, entries
+
+def content_shingles(text: str, size: int = 5, max_words: int = 2000) -> set:
+    """Hash the overlapping word n-grams (shingles) of a text.
+
+    Args:
+        text (str): The text to shingle
+        size (int): Number of words per shingle
+        max_words (int): Only the first max_words words are shingled
+
+    Returns:
+        set: CRC32 hashes of the shingles, stable across processes
+    """
+    words = re.findall(r"\w+", text.lower())[:max_words]
+    if len(words) < size:
+        return {zlib.crc32(" ".join(words).encode())} if words else set()
+    return {zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)}
+
+def summary_change(previous_summary: str, summary: str) -> float:
+    """Normalized word-level edit distance between two summaries, from 0 (identical) to 1."""
+    matcher = difflib.SequenceMatcher(None, previous_summary.split(), summary.split(), autojunk=False)
+    return 1.0 - matcher.ratio()
+
+def split_summary_sections(summary: str, first_id: int = 1) -> List[Dict[str, str]]:
+    """Split a summary into paragraphs with stable IDs.
+
+    Args:
+        summary (str): The summary text, paragraphs separated by blank lines
+        first_id (int): Number used for the first section's ID
+
+    Returns:
+        list: Sections as dicts with 'id' (e.g. "s1") and 'text'
+    """
+    paragraphs = [paragraph.strip() for paragraph in re.split(r"\n\s*\n", summary or "") if paragraph.strip()]
+    return [{"id": f"s{first_id + i}", "text": paragraph} for i, paragraph in enumerate(paragraphs)]
+
+def render_summary_sections(sections: List[Dict[str, str]]) -> str:
+    """Rebuild the full summary text from its sections."""
+    return "\n\n".join(section["text"] for section in sections)
+
+def summary_outline(sections: List[Dict[str, str]], max_chars: int = 160) -> str:
+    """Describe each section by its ID and opening sentence."""
+    lines = []
+    for section in sections:
+        opening = re.split(r"(?<=[.!?])\s", section["text"], maxsplit=1)[0]
+        if len(opening) > max_chars:
+            opening = opening[:max_chars].rsplit(" ", 1)[0] + "..."
+        lines.append(f"[{section['id']}] {opening}")
+    return "\n".join(lines)
+
+def select_related_sections(sections: List[Dict[str, str]], text: str, k: int) -> List[Dict[str, str]]:
+    """Pick the k sections sharing the most words with text, kept in summary order.
+
+    Overlap is normalized by the square root of the section length so long
+    sections are not always chosen.
+    """
+    words = set(re.findall(r"\w{4,}", text.lower()))
+
+    def score(section):
+        section_words = set(re.findall(r"\w{4,}", section["text"].lower()))
+        return len(section_words & words) / (len(section_words) ** 0.5 or 1)
+
+    selected = {section["id"] for section in sorted(sections, key=score, reverse=True)[:k]}
+    return [section for section in sections if section["id"] in selected]
+
+def apply_summary_patch(sections: List[Dict[str, str]], patch: Dict[str, Any], editable_ids: set) -> List[Dict[str, str]]:
+    """Apply an LLM-produced patch to the summary sections.
+
+    Args:
+        sections (list): The current sections
+        patch (dict): Patch containing:
+            - updates (list): {"id", "text"} rewrites of existing sections
+            - additions (list): {"after", "text"} new sections, inserted after
+              the section with ID 'after' or appended when it is unknown
+        editable_ids (set): IDs of the sections whose full text the LLM saw;
+            updates to any other section are ignored so no content is lost
+
+    Returns:
+        list: The patched sections
+    """
+    sections = [dict(section) for section in sections]
+    by_id = {section["id"]: section for section in sections}
+
+    for update in patch.get("updates") or []:
+        if not isinstance(update, dict) or not isinstance(update.get("text"), str) or not update["text"].strip():
+            continue
+        if update.get("id") in editable_ids and update["id"] in by_id:
+            by_id[update["id"]]["text"] = update["text"].strip()
+
+    next_id = max((int(section["id"][1:]) for section in sections if section["id"][1:].isdigit()), default=0) + 1
+    for addition in patch.get("additions") or []:
+        if not isinstance(addition, dict) or not isinstance(addition.get("text"), str) or not addition["text"].strip():
+            continue
+        section = {"id": f"s{next_id}", "text": addition["text"].strip()}
+        next_id += 1
+        ids = [existing["id"] for existing in sections]
+        index = ids.index(addition["after"]) + 1 if addition.get("after") in ids else len(sections)
+        sections.insert(index, section)
+
+    return sections
+
+_json_decoder = json.JSONDecoder()
+_whitespace = re.compile(r"\s*")
+
+def parse_json_fields(text: str) -> Dict[str, Any]:
+    """Parse the complete top-level fields of a JSON object that may still be streaming.
+
+    Fields are read in order up to the first one whose value is unfinished or
+    malformed. Numbers and literals at the very end of the text are left out,
+    since more digits may follow. Text before the opening brace, such as a
+    markdown code fence, is skipped.
+
+    Args:
+        text (str): The JSON received so far
+
+    Returns:
+        dict: The fields whose values are complete
+    """
+    fields: Dict[str, Any] = {}
+    index = text.find("{")
+    if index < 0:
+        return fields
+    index += 1
+    while True:
+        index = _whitespace.match(text, index).end()
+        if index < len(text) and text[index] == ",":
+            index += 1
+            continue
+        if index >= len(text) or text[index] == "}":
+            return fields
+        try:
+            key, index = _json_decoder.raw_decode(text, index)
+        except ValueError:
+            return fields
+        index = _whitespace.match(text, index).end()
+        if not isinstance(key, str) or index >= len(text) or text[index] != ":":
+            return fields
+        index = _whitespace.match(text, index + 1).end()
+        try:
+            value, index = _json_decoder.raw_decode(text, index)
+        except ValueError:
+            return fields
+        index = _whitespace.match(text, index).end()
+        if index >= len(text) and not isinstance(value, (str, list, dict)):
+            return fields
+        fields[key] = value
+
+def parse_json_object(text: str) -> Dict[str, Any]:
+    """Parse an LLM's JSON object output, keeping whatever complete fields a malformed or cut-off response has."""
+    try:
+        value = json.loads(text)
+    except ValueError:
+        return parse_json_fields(text)
+    return value if isinstance(value, dict) else {}
 
 def format_sources(search_results):
     """Format search results into a bullet-point list of sources.
@@ -72,13 +351,40 @@ def format_sources(search_results):
         for source in search_results['results']
     )
 
+def parse_duckduckgo_results(search_results: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Convert raw DuckDuckGo results to the common search result format, dropping incomplete ones."""
+    results = []
+    for r in search_results:
+        url = r.get('href')
+        title = r.get('title')
+        content = r.get('body')
+
+        if not all([url, title, content]):
+            print(f"Warning: Incomplete result from DuckDuckGo: {r}")
+            continue
+
+        # Add result to list
+        results.append({
+            "title": title,
+            "url": url,
+            "content": content,
+            "raw_content": content
+        })
+    return results
+
+# Client errors retried with backoff under the provider's search guard
+DDG_TRANSIENT_ERRORS = (RatelimitException, TimeoutException)
+TAVILY_TRANSIENT_ERRORS = (TavilyTimeoutError,)
+
 @traceable
-def duckduckgo_search(query: str, max_results: int = 3, fetch_full_page: bool = False) -> Dict[str, List[Dict[str, str]]]:
+def duckduckgo_search(query: str, max_results: int = 3, fetch_full_page: bool = False, text_chars: Optional[int] = None) -> Dict[str, List[Dict[str, str]]]:
     """Search the web using DuckDuckGo.
     
     Args:
         query (str): The search query to execute
         max_results (int): Maximum number of results to return
+        fetch_full_page (bool): Whether to replace snippets with the full page text
+        text_chars (int, optional): Characters of page text to read, defaults to FETCH_TEXT_CHARS
         
     Returns:
         dict: Search response containing:
@@ -87,50 +393,71 @@ def duckduckgo_search(query: str, max_results: int = 3, fetch_full_page: bool =
                 - url (str): URL of the search result
                 - content (str): Snippet/summary of the content
                 - raw_content (str): Same as content since DDG doesn't provide full page content
+            - cached (bool): Whether the response came from the search cache
     """
-    try:
+    def text_search():
         with DDGS() as ddgs:
-            results = []
-            search_results = list(ddgs.text(query, max_results=max_results))
-            
-            for r in search_results:
-                url = r.get('href')
-                title = r.get('title')
-                content = r.get('body')
-                
-                if not all([url, title, content]):
-                    print(f"Warning: Incomplete result from DuckDuckGo: {r}")
-                    continue
-
-                raw_content = content
-                if fetch_full_page:
-                    try:
-                        # Try to fetch the full page content using curl
-                        import urllib.request
-                        from bs4 import BeautifulSoup
-
-                        response = urllib.request.urlopen(url)
-                        html = response.read()
-                        soup = BeautifulSoup(html, 'html.parser')
-                        raw_content = soup.get_text()
-                        
-                    except Exception as e:
-                        print(f"Warning: Failed to fetch full page content for {url}: {str(e)}")
-                
-                # Add result to list
-                result = {
-                    "title": title,
-                    "url": url,
-                    "content": content,
-                    "raw_content": raw_content
-                }
-                results.append(result)
-            
+            return list(ddgs.text(query, max_results=max_results))
+
+    def run():
+        try:
+            results = parse_duckduckgo_results(guarded_call("duckduckgo", text_search, retry_on=DDG_TRANSIENT_ERRORS))
+
+            if fetch_full_page:
+                # Pages that fail or miss the fetch deadline keep their snippet
+                pages = fetch_pages([result["url"] for result in results], text_chars=text_chars)
+                for result in results:
+                    result["raw_content"] = pages.get(result["url"], result["raw_content"])
+
             return {"results": results}
-    except Exception as e:
-        print(f"Error in DuckDuckGo search: {str(e)}")
-        print(f"Full error details: {type(e).__name__}")
-        return {"results": []}
+        except SearchUnavailable:
+            # Rate limited or down: let the caller fail over instead of searching on with no results
+            raise
+        except Exception as e:
+            print(f"Error in DuckDuckGo search: {str(e)}")
+            print(f"Full error details: {type(e).__name__}")
+            return {"results": []}
+
+    return cached_search("duckduckgo", query, max_results, fetch_full_page, run, text_chars if fetch_full_page else None)
+
+@traceable
+async def aduckduckgo_search(query: str, max_results: int = 3, fetch_full_page: bool = False, text_chars: Optional[int] = None) -> Dict[str, List[Dict[str, str]]]:
+    """Async version of duckduckgo_search.
+
+    The DDGS client only offers a blocking API, so the search itself runs in
+    the default executor. Full pages are fetched concurrently without blocking.
+
+    Args:
+        query (str): The search query to execute
+        max_results (int): Maximum number of results to return
+        fetch_full_page (bool): Whether to replace snippets with the full page text
+        text_chars (int, optional): Characters of page text to read, defaults to FETCH_TEXT_CHARS
+
+    Returns:
+        dict: Search response in the same format as duckduckgo_search
+    """
+    def text_search():
+        with DDGS() as ddgs:
+            return list(ddgs.text(query, max_results=max_results))
+
+    async def run():
+        try:
+            results = parse_duckduckgo_results(await aguarded_call("duckduckgo", lambda: asyncio.to_thread(text_search), retry_on=DDG_TRANSIENT_ERRORS))
+
+            if fetch_full_page:
+                pages = await afetch_pages([result["url"] for result in results], text_chars=text_chars)
+                for result in results:
+                    result["raw_content"] = pages.get(result["url"], result["raw_content"])
+
+            return {"results": results}
+        except SearchUnavailable:
+            raise
+        except Exception as e:
+            print(f"Error in DuckDuckGo search: {str(e)}")
+            print(f"Full error details: {type(e).__name__}")
+            return {"results": []}
+
+    return await acached_search("duckduckgo", query, max_results, fetch_full_page, run, text_chars if fetch_full_page else None)
 
 @traceable
 def tavily_search(query, include_raw_content=True, max_results=3):
@@ -147,33 +474,82 @@ def tavily_search(query, include_raw_content=True, max_results=3):
                 - title (str): Title of the search result
                 - url (str): URL of the search result
                 - content (str): Snippet/summary of the content
-                - raw_content (str): Full content of the page if available"""
-     
-    api_key = os.getenv("TAVILY_API_KEY")
-    if not api_key:
-        raise ValueError("TAVILY_API_KEY environment variable is not set")
-    tavily_client = TavilyClient(api_key=api_key)
-    return tavily_client.search(query, 
-                         max_results=max_results, 
-                         include_raw_content=include_raw_content)
+                - raw_content (str): Full content of the page if available
+            - cached (bool): Whether the response came from the search cache"""
+
+    def run():
+        tavily_client = TavilyClient(api_key=get_tavily_api_key())
+        return guarded_call("tavily", lambda: tavily_client.search(query,
+                                                                  max_results=max_results,
+                                                                  include_raw_content=include_raw_content),
+                            retry_on=TAVILY_TRANSIENT_ERRORS)
+
+    return cached_search("tavily", query, max_results, include_raw_content, run)
 
 @traceable
-def perplexity_search(query: str, perplexity_search_loop_count: int) -> Dict[str, Any]:
-    """Search the web using the Perplexity API.
-    
+async def atavily_search(query, include_raw_content=True, max_results=3):
+    """Async version of tavily_search.
+
     Args:
         query (str): The search query to execute
-        perplexity_search_loop_count (int): The loop step for perplexity search (starts at 0)
-  
+        include_raw_content (bool): Whether to include the raw_content from Tavily in the formatted string
+        max_results (int): Maximum number of results to return
+
+    Returns:
+        dict: Search response in the same format as tavily_search
+    """
+    async def run():
+        tavily_client = AsyncTavilyClient(api_key=get_tavily_api_key())
+        return await aguarded_call("tavily", lambda: tavily_client.search(query,
+                                                                         max_results=max_results,
+                                                                         include_raw_content=include_raw_content),
+                                   retry_on=TAVILY_TRANSIENT_ERRORS)
+
+    return await acached_search("tavily", query, max_results, include_raw_content, run)
+
+@traceable
+def local_search(query: str, directory: str, max_results: int = 3) -> Dict[str, List[Dict[str, str]]]:
+    """Search a local directory of HTML, Markdown and text files through its SQLite FTS5 index.
+
+    The index is built on first use and brought up to date every
+    LOCAL_INDEX_REFRESH seconds; results are not cached, as the files change.
+
+    Args:
+        query (str): The search query to execute
+        directory (str): The directory to search, LOCAL_SEARCH_DIR
+        max_results (int): Maximum number of results to return
+
     Returns:
         dict: Search response containing:
             - results (list): List of search result dictionaries, each containing:
-                - title (str): Title of the search result
-                - url (str): URL of the search result
-                - content (str): Snippet/summary of the content
-                - raw_content (str): Full content of the page if available
+                - title (str): Title of the document
+                - url (str): file:// URL of the document
+                - content (str): The passage around the best matches
+                - raw_content (str): The document's text
     """
+    if not directory:
+        raise ValueError("LOCAL_SEARCH_DIR environment variable is not set")
+    return search_local(directory, query, max_results)
+
+@traceable
+async def alocal_search(query: str, directory: str, max_results: int = 3) -> Dict[str, List[Dict[str, str]]]:
+    """Async version of local_search; SQLite only offers a blocking API, so it runs in the default executor."""
+    return await asyncio.to_thread(local_search, query, directory, max_results)
+
+def get_tavily_api_key() -> str:
+    """Get the Tavily API key from the environment."""
+    api_key = os.getenv("TAVILY_API_KEY")
+    if not api_key:
+        raise ValueError("TAVILY_API_KEY environment variable is not set")
+    return api_key
+
+PERPLEXITY_URL = "https://api.perplexity.ai/chat/completions"
+# Seconds to wait for a Perplexity answer, which is written before it is sent;
+# a request that times out is retried like a rate limited one
+PERPLEXITY_TIMEOUT = float(os.environ.get("PERPLEXITY_TIMEOUT", "60"))
 
+def perplexity_request(query: str) -> Tuple[Dict[str, str], Dict[str, Any]]:
+    """Build the headers and payload for a Perplexity search request."""
     headers = {
         "accept": "application/json",
         "content-type": "application/json",
@@ -193,16 +569,10 @@ def perplexity_search(query: str, perplexity_search_loop_count: int) -> Dict[str
             }
         ]
     }
-    
-    response = requests.post(
-        "https://api.perplexity.ai/chat/completions",
-        headers=headers,
-        json=payload
-    )
-    response.raise_for_status()  # Raise exception for bad status codes
-    
-    # Parse the response
-    data = response.json()
+    return headers, payload
+
+def parse_perplexity_response(data: Dict[str, Any], perplexity_search_loop_count: int) -> Dict[str, Any]:
+    """Convert a Perplexity chat completion to the common search result format."""
     content = data["choices"][0]["message"]["content"]
 
     # Perplexity returns a list of citations for a single search result
@@ -225,4 +595,69 @@ def perplexity_search(query: str, perplexity_search_loop_count: int) -> Dict[str
             "raw_content": None
         })
     
-    return {"results": results}
\ No newline at end of file
+    return {"results": results}
+
+@traceable
+def perplexity_search(query: str, perplexity_search_loop_count: int) -> Dict[str, Any]:
+    """Search the web using the Perplexity API.
+    
+    Args:
+        query (str): The search query to execute
+        perplexity_search_loop_count (int): The loop step for perplexity search (starts at 0)
+  
+    Returns:
+        dict: Search response containing:
+            - results (list): List of search result dictionaries, each containing:
+                - title (str): Title of the search result
+                - url (str): URL of the search result
+                - content (str): Snippet/summary of the content
+                - raw_content (str): Full content of the page if available
+            - cached (bool): Whether the response came from the search cache
+    """
+
+    def post():
+        headers, payload = perplexity_request(query)
+        response = requests.post(
+            PERPLEXITY_URL,
+            headers=headers,
+            json=payload,
+            timeout=PERPLEXITY_TIMEOUT
+        )
+        response.raise_for_status()  # Raise exception for bad status codes
+        return response.json()
+
+    def run():
+        # Rate limits and server errors are retried with backoff, other errors raised at once
+        return guarded_call("perplexity", post)
+
+    # The completion is cached rather than the results, whose titles depend on the loop
+    data = cached_search("perplexity", query, None, False, run)
+    return {**parse_perplexity_response(data, perplexity_search_loop_count), "cached": data["cached"]}
+
+@traceable
+async def aperplexity_search(query: str, perplexity_search_loop_count: int) -> Dict[str, Any]:
+    """Async version of perplexity_search.
+
+    Args:
+        query (str): The search query to execute
+        perplexity_search_loop_count (int): The loop step for perplexity search (starts at 0)
+
+    Returns:
+        dict: Search response in the same format as perplexity_search
+    """
+    async def post():
+        headers, payload = perplexity_request(query)
+        async with httpx.AsyncClient(timeout=PERPLEXITY_TIMEOUT) as client:
+            response = await client.post(
+                PERPLEXITY_URL,
+                headers=headers,
+                json=payload
+            )
+        response.raise_for_status()  # Raise exception for bad status codes
+        return response.json()
+
+    async def run():
+        return await aguarded_call("perplexity", post)
+
+    data = await acached_search("perplexity", query, None, False, run)
+    return {**parse_perplexity_response(data, perplexity_search_loop_count), "cached": data["cached"]}
@@ -0,0 +1,66 @@
+import asyncio
+import operator
+from typing import Annotated, TypedDict
+
+import pytest
+from langgraph.graph import END, START, StateGraph
+
+from assistant.checkpoint import ResearchCheckpointer, aresume_input, connect, resume_input
+
+
+class CountState(TypedDict):
+    topic: str
+    steps: Annotated[int, operator.add]
+
+
+def build_graph(fail):
+    def first(state):
+        return {"steps": 1}
+
+    def second(state):
+        if fail["second"]:
+            raise RuntimeError("interrupted")
+        return {"steps": 1}
+
+    builder = StateGraph(CountState)
+    builder.add_node("first", first)
+    builder.add_node("second", second)
+    builder.add_edge(START, "first")
+    builder.add_edge("first", "second")
+    builder.add_edge("second", END)
+    return builder.compile(checkpointer=ResearchCheckpointer(connect(":memory:")))
+
+
+def test_resume_input_resumes_an_interrupted_run():
+    fail = {"second": True}
+    graph = build_graph(fail)
+    config = {"configurable": {"thread_id": "t"}}
+    with pytest.raises(RuntimeError):
+        graph.invoke({"topic": "x", "steps": 0}, config)
+
+    fail["second"] = False
+    assert resume_input(graph, config, {"topic": "x", "steps": 0}) is None
+    assert graph.invoke(None, config)["steps"] == 2
+
+
+def test_resume_input_starts_a_finished_run_over():
+    graph = build_graph({"second": False})
+    config = {"configurable": {"thread_id": "t"}}
+    assert graph.invoke({"topic": "x", "steps": 0}, config)["steps"] == 2
+
+    input = resume_input(graph, config, {"topic": "x", "steps": 0})
+    assert input == {"topic": "x", "steps": 0}
+    assert graph.invoke(input, config)["steps"] == 2
+
+
+def test_aresume_input_starts_a_finished_run_over():
+    graph = build_graph({"second": False})
+    config = {"configurable": {"thread_id": "t"}}
+
+    async def run_twice():
+        first = await graph.ainvoke(await aresume_input(graph, config, {"topic": "x", "steps": 0}), config)
+        second = await graph.ainvoke(await aresume_input(graph, config, {"topic": "x", "steps": 0}), config)
+        return first, second
+
+    first, second = asyncio.run(run_twice())
+    assert first["steps"] == second["steps"] == 2
@@ -0,0 +1,38 @@
+import pytest
+
+from assistant.configuration import Configuration
+
+
+@pytest.fixture(autouse=True)
+def clear_overrides(monkeypatch):
+    for name in ("PASSAGE_RERANK", "JSON_EARLY_EXIT", "OLLAMA_JSON_SCHEMA", "SOURCE_DEDUP_DISTANCE", "HEDGE_SEARCH_API", "MAX_WEB_RESEARCH_LOOPS"):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_falsy_overrides_are_applied():
+    configurable = Configuration.from_runnable_config({"configurable": {
+        "passage_rerank": False,
+        "json_early_exit": False,
+        "ollama_json_schema": False,
+        "source_dedup_distance": 0,
+        "hedge_search_api": "",
+    }})
+    assert configurable.passage_rerank is False
+    assert configurable.json_early_exit is False
+    assert configurable.ollama_json_schema is False
+    assert configurable.source_dedup_distance == 0
+    assert configurable.hedge_search_api == ""
+
+
+def test_environment_overrides_configurable(monkeypatch):
+    monkeypatch.setenv("MAX_WEB_RESEARCH_LOOPS", "5")
+    monkeypatch.setenv("PASSAGE_RERANK", "false")
+    configurable = Configuration.from_runnable_config({"configurable": {"max_web_research_loops": 1, "passage_rerank": True}})
+    assert configurable.max_web_research_loops == 5
+    assert configurable.passage_rerank is False
+
+
+def test_empty_environment_variable_counts_as_unset(monkeypatch):
+    monkeypatch.setenv("MAX_WEB_RESEARCH_LOOPS", "")
+    assert Configuration.from_runnable_config({"configurable": {"max_web_research_loops": 2}}).max_web_research_loops == 2
+    assert Configuration.from_runnable_config().max_web_research_loops == Configuration().max_web_research_loops
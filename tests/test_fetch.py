@@ -0,0 +1,79 @@
+import asyncio
+
+import httpx
+
+from assistant import page_cache
+from assistant.fetch import _AsyncFetcher, _DomainStats
+
+
+class Chunks(httpx.AsyncByteStream):
+    def __init__(self, body, size=1024):
+        self.body, self.size = body, size
+
+    async def __aiter__(self):
+        for start in range(0, len(self.body), self.size):
+            yield self.body[start:start + self.size]
+
+
+def test_domain_stats_keep_the_most_recently_fetched_domains():
+    stats = _DomainStats(size=2)
+    stats.record("http://a.example/1", 0.1, "ok")
+    stats.record("http://b.example/1", 0.1, "ok")
+    stats.record("http://a.example/2", 0.1, "ok")
+    stats.record("http://c.example/1", 0.1, "ok")
+    assert set(stats.report()) == {"a.example", "c.example"}
+    assert stats.report()["a.example"]["fetches"] == 2
+
+
+def test_async_fetcher_drops_idle_domain_slots(monkeypatch):
+    monkeypatch.setattr(page_cache, "_page_cache", None)
+    monkeypatch.setattr(page_cache, "PAGE_CACHE_DB", "")
+    html = b"<html><body><p>" + b"word " * 50 + b"</p></body></html>"
+
+    def respond(request):
+        return httpx.Response(200, headers={"content-type": "text/html"}, stream=httpx.ByteStream(html))
+
+    async def fetch_many():
+        fetcher = _AsyncFetcher()
+        fetcher.client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        urls = [f"http://site{i}.example/page{j}" for i in range(20) for j in range(3)]
+        texts = await asyncio.gather(*[fetcher.submit(url) for url in urls])
+        domains = dict(fetcher._domains)
+        await fetcher.client.aclose()
+        fetcher.extractor.shutdown()
+        return texts, domains
+
+    texts, domains = asyncio.run(fetch_many())
+    assert all("word" in text for text in texts)
+    assert domains == {}
+
+
+def test_pages_read_short_are_downloaded_again_for_a_longer_limit(monkeypatch, tmp_path):
+    monkeypatch.setattr(page_cache, "_page_cache", page_cache.PageCache(str(tmp_path / "pages.db")))
+    paragraphs = b"".join(b"<p>" + f"Paragraph {i} ".encode() * 20 + b"</p>" for i in range(200))
+    html = b"<html><body>" + paragraphs + b"</body></html>"
+    requests = []
+
+    def respond(request):
+        requests.append(request.url)
+        headers = {"content-type": "text/html", "cache-control": "max-age=600"}
+        return httpx.Response(200, headers=headers, stream=Chunks(html))
+
+    async def fetch(text_chars):
+        fetcher = _AsyncFetcher()
+        fetcher.client = httpx.AsyncClient(transport=httpx.MockTransport(respond))
+        text = await fetcher.submit("http://site.example/page", text_chars)
+        await fetcher.client.aclose()
+        fetcher.extractor.shutdown()
+        return text
+
+    short = asyncio.run(fetch(2000))
+    assert asyncio.run(fetch(2000)) == short
+    assert len(requests) == 1
+
+    longer = asyncio.run(fetch(20000))
+    assert len(requests) == 2
+    assert len(longer) > len(short) >= 2000
+    # The longer copy now serves the shorter limit too
+    assert asyncio.run(fetch(2000)) == longer
+    assert len(requests) == 2
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+import pytest
+
+from assistant.hedge import ahedged_search, hedged_search
+
+
+def results(url):
+    return {"results": [{"title": url, "url": url, "content": url}]}, True
+
+
+def test_fallback_raises_the_primary_error_when_the_secondary_fails_first():
+    def primary():
+        time.sleep(0.1)
+        raise ValueError("primary failed")
+
+    def secondary():
+        raise KeyError("secondary failed")
+
+    with pytest.raises(ValueError, match="primary failed") as error:
+        hedged_search("tavily", primary, "duckduckgo", secondary, delay=0.01, merge_window=0.01)
+    assert isinstance(error.value.__cause__, KeyError)
+
+
+def test_async_fallback_raises_the_primary_error_when_the_secondary_fails_first():
+    async def primary():
+        await asyncio.sleep(0.1)
+        raise ValueError("primary failed")
+
+    async def secondary():
+        raise KeyError("secondary failed")
+
+    with pytest.raises(ValueError, match="primary failed") as error:
+        asyncio.run(ahedged_search("tavily", primary, "duckduckgo", secondary, delay=0.01, merge_window=0.01))
+    assert isinstance(error.value.__cause__, KeyError)
+
+
+def test_async_hedge_survives_a_search_cancelled_elsewhere():
+    async def primary():
+        raise asyncio.CancelledError()
+
+    async def secondary():
+        return results("https://secondary.example/")
+
+    search_results, _ = asyncio.run(ahedged_search("tavily", primary, "duckduckgo", secondary, delay=1, merge_window=0.01))
+    assert search_results["provider"] == "duckduckgo"
+    assert search_results["hedged"]
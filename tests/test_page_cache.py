@@ -0,0 +1,13 @@
+from assistant.page_cache import PAGE_CACHE_TTL, cache_ttl
+
+
+def test_cache_ttl_follows_cache_control():
+    assert cache_ttl({}) == PAGE_CACHE_TTL
+    assert cache_ttl({"cache-control": "public, max-age=600"}) == 600
+    assert cache_ttl({"cache-control": "no-store"}) is None
+
+
+def test_cache_ttl_revalidates_no_cache_and_private_pages():
+    assert cache_ttl({"cache-control": "no-cache"}) == 0
+    assert cache_ttl({"cache-control": "private, max-age=600"}) == 0
+    assert cache_ttl({"cache-control": 'no-cache="set-cookie", max-age=60'}) == 0
@@ -0,0 +1,51 @@
+import asyncio
+
+from assistant.search_cache import SearchCache
+
+
+def response(url):
+    return {"results": [{"title": url, "url": url, "content": url}]}
+
+
+def test_coalesced_searches_share_one_request():
+    cache = SearchCache(path=None)
+    calls = []
+
+    async def run():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return response("a")
+
+    async def main():
+        return await asyncio.gather(*(cache.asearch("duckduckgo", "k", run) for _ in range(3)))
+
+    results = asyncio.run(main())
+    assert len(calls) == 1
+    assert [cached for _, cached in results] == [False, True, True]
+    assert cache.stats()["providers"]["duckduckgo"]["coalesced"] == 2
+
+
+def test_cancelled_leader_does_not_cancel_followers():
+    cache = SearchCache(path=None)
+
+    async def slow():
+        await asyncio.sleep(10)
+        return response("leader")
+
+    async def fast():
+        await asyncio.sleep(0.01)
+        return response("follower")
+
+    async def main():
+        leader = asyncio.ensure_future(cache.asearch("duckduckgo", "k", slow))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(cache.asearch("duckduckgo", "k", fast))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        result = await asyncio.wait_for(follower, 1)
+        assert leader.cancelled()
+        return result
+
+    result, cached = asyncio.run(main())
+    assert result == response("follower")
+    assert not cached
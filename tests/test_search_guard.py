@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+import requests
+
+from assistant import search_guard
+from assistant.search_guard import HALF_OPEN, OPEN, ProviderGuard, SearchUnavailable, aguarded_call, guarded_call
+
+
+class Response:
+    status_code = 429
+    headers = {}
+
+
+def rate_limited():
+    error = requests.HTTPError("429 Too Many Requests")
+    error.response = Response()
+    raise error
+
+
+@pytest.fixture
+def guard(monkeypatch):
+    monkeypatch.setattr(search_guard, "SEARCH_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(search_guard, "SEARCH_MAX_RETRIES", 2)
+    monkeypatch.setattr(search_guard, "SEARCH_BREAKER_FAILURES", 3)
+    monkeypatch.setattr(search_guard, "SEARCH_BREAKER_COOLDOWN", 0.05)
+    guard = ProviderGuard("test", rate=0)
+    monkeypatch.setitem(search_guard._guards, "test", guard)
+    return guard
+
+
+def test_rate_limited_search_is_retried(guard):
+    calls = []
+
+    def search():
+        calls.append(1)
+        if len(calls) < 3:
+            rate_limited()
+        return "results"
+
+    assert guarded_call("test", search) == "results"
+    assert guard.stats()["retries"] == 2
+    assert guard.state == "closed"
+
+
+def test_errors_that_are_not_transient_are_raised_at_once(guard):
+    with pytest.raises(ValueError):
+        guarded_call("test", lambda: (_ for _ in ()).throw(ValueError("bad key")))
+    assert guard.stats()["retries"] == 0
+    assert guard.stats()["errors"] == 1
+
+
+def test_circuit_opens_fails_fast_and_recovers(guard):
+    with pytest.raises(SearchUnavailable):
+        guarded_call("test", rate_limited)
+    assert guard.state == OPEN
+    with pytest.raises(SearchUnavailable):
+        guarded_call("test", lambda: "results")
+    assert guard.stats()["rejected_open"] == 1
+
+    time.sleep(0.06)
+    assert guarded_call("test", lambda: "results") == "results"
+    assert [(t["from"], t["to"]) for t in guard.stats()["transitions"]] == [("closed", "open"), ("open", "half_open"), ("half_open", "closed")]
+
+
+def test_trial_cancelled_while_waiting_for_its_turn_is_released(guard):
+    guard.state = HALF_OPEN
+    guard.rate, guard.burst, guard.tokens = 10.0, 1.0, 0.0
+
+    async def cancel_trial():
+        trial = asyncio.ensure_future(aguarded_call("test", lambda: asyncio.sleep(0, "results")))
+        await asyncio.sleep(0.02)
+        assert guard.trial_running
+        trial.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await trial
+
+    asyncio.run(cancel_trial())
+    assert not guard.trial_running
+    assert asyncio.run(aguarded_call("test", lambda: asyncio.sleep(0, "results"))) == "results"
+    assert guard.state == "closed"
+
+
+def test_trial_interrupted_in_a_sync_search_is_released(guard):
+    class Interrupted(BaseException):
+        pass
+
+    def interrupted():
+        raise Interrupted()
+
+    guard.state = HALF_OPEN
+    with pytest.raises(Interrupted):
+        guarded_call("test", interrupted)
+    assert not guard.trial_running
+    assert guard.state == HALF_OPEN
+
+
+def test_failures_open_the_circuit_and_any_answer_closes_it(guard):
+    for _ in range(3):
+        guard.record_failure("ConnectError: refused")
+    assert guard.state == OPEN
+    assert guard.stats()["failed"] == 3
+
+    guard.record_success(counter="errors")
+    assert guard.state == "closed"
+    assert guard.stats()["consecutive_failures"] == 0
+    assert guard.stats()["errors"] == 1
+    assert guard.stats()["succeeded"] == 0
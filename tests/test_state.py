@@ -0,0 +1,6 @@
+from assistant.state import add_or_clear
+
+
+def test_add_or_clear_appends_and_clears():
+    assert add_or_clear([1], [2, 3]) == [1, 2, 3]
+    assert add_or_clear([1, 2], None) == []
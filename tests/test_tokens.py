@@ -0,0 +1,42 @@
+from assistant.tokens import CharTokenizer, _DigestCache, allocate_budget, truncate_to_tokens
+
+
+def test_truncate_to_tokens_cuts_at_the_last_sentence_that_fits():
+    tokenizer = CharTokenizer()
+    text = "First sentence here. Second sentence here. Third sentence is longer than the rest."
+    assert truncate_to_tokens(text, 100, tokenizer) == text
+    assert truncate_to_tokens(text, 11, tokenizer) == "First sentence here. Second sentence here."
+    assert truncate_to_tokens("Line one\nLine two is here", 4, tokenizer) == "Line one"
+
+
+def test_truncate_to_tokens_cuts_a_long_first_sentence_at_a_word():
+    assert truncate_to_tokens("one two three four five six", 4, CharTokenizer()) == "one two three"
+
+
+def test_allocate_budget_passes_unused_shares_on():
+    assert allocate_budget([10, 100, 100], 110) == [10, 50, 50]
+
+
+
+def test_digest_cache_does_not_keep_texts_and_bounds_total_weight():
+    calls = []
+
+    def encode(text):
+        calls.append(text)
+        return text.split()
+
+    cache = _DigestCache(encode, size=3, max_weight=10)
+    assert cache("a b c") == ["a", "b", "c"]
+    assert cache("a b c") == ["a", "b", "c"]
+    assert calls == ["a b c"]
+    assert all(isinstance(key, bytes) and len(key) == 16 for key in cache.entries)
+
+    for text in ["d e f", "g h i", "j k l"]:
+        cache(text)
+    assert len(cache.entries) == 3 and cache.weight == 9
+
+    # Heavier than the whole budget: returned but not cached
+    assert len(cache("w " * 20)) == 20
+    assert cache.weight == 9
+    cache("m n o p")
+    assert cache.weight <= 10
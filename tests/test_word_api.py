@@ -0,0 +1,59 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessageChunk
+
+import assistant.graph
+from ollama_deep_researcher.word_api import router
+
+
+class StubGraph:
+    checkpointer = None
+
+    def __init__(self):
+        self.calls = []
+
+    async def astream(self, input, config=None, stream_mode=None):
+        self.calls.append((input, config, stream_mode))
+        yield "messages", (AIMessageChunk(content='{"query": "x"}'), {"langgraph_node": "generate_query", "langgraph_step": 1})
+        yield "updates", {"generate_query": {"search_query": "rust borrow checker"}}
+        yield "messages", (AIMessageChunk(content="The borrow"), {"langgraph_node": "summarize_sources", "langgraph_step": 3})
+        yield "messages", (AIMessageChunk(content=" checker"), {"langgraph_node": "summarize_sources", "langgraph_step": 3})
+        yield "updates", {"summarize_sources": {"running_summary": "The borrow checker"}}
+        yield "updates", {"finalize_summary": {"running_summary": "## Summary\n\nThe borrow checker"}}
+
+
+def parse_events(body):
+    events = []
+    for message in body.strip().split("\n\n"):
+        event, data = message.split("\n")
+        events.append((event.removeprefix("event: "), json.loads(data.removeprefix("data: "))))
+    return events
+
+
+def test_stream_research_sends_start_token_node_done(monkeypatch):
+    stub = StubGraph()
+    monkeypatch.setattr(assistant.graph, "graph", stub)
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+
+    response = TestClient(app).post(
+        "/api/research/stream", json={"topic": "rust borrow checker", "model": "m", "max_loops": 2}
+    )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+    assert [event for event, _ in events] == [
+        "start", "node", "token", "token", "node", "summary", "node", "done"
+    ]
+    assert events[0][1] == {"topic": "rust borrow checker", "thread_id": None, "resumed": False}
+    assert events[1][1]["search_query"] == "rust borrow checker"
+    assert [data["content"] for event, data in events if event == "token"] == ["The borrow", " checker"]
+    assert events[-1][1] == {"running_summary": "## Summary\n\nThe borrow checker"}
+
+    input, config, stream_mode = stub.calls[0]
+    assert input == {"research_topic": "rust borrow checker"}
+    assert config["configurable"] == {"local_llm": "m", "max_web_research_loops": 2}
+    assert stream_mode == ["messages", "updates"]